@@ -9,18 +9,39 @@ exp_tag = '_experiment'
 output_root_folder = 'results'
 plotting_context = 'notebook'  # one of {paper, notebook, talk, poster}
 file_format = 'pdf'  # or 'png'
-use_compression = False  # use gzip to compress the results
+# compress the results: 'auto' (the fastest codec installed), 'blosc',
+# 'zstd', 'lz4' or 'zlib' (always available); None to disable
+compression = None
+# dump only what the analysis needs of the fitted models (e.g. no Isomap
+# graphs, no grid search results); large arrays are saved in separate files
+# and memory-mapped by ade_analysis
+slim_models = False
+# profile some pipelines (ade_run and ade_analysis) with cProfile: a list of
+# pipe ids and/or step names, e.g. ['pipe3', 'KernelPCA'], or the fraction of
+# pipelines to profile, e.g. 0.1. The .prof files and a merged report are
+# written in the 'profiles' folder of the experiment
+profile = None
 
 # ----------------------------  INPUT DATA ---------------------------- #
-# Load an example dataset or specify your input data in tabular format
+# Load an example dataset or specify your input data in tabular format.
+# Sparse data (scipy .npz or Matrix Market .mtx) are kept sparse as long as
+# the steps support them
 data_file = 'data.csv'
 labels_file = 'labels.csv'  # OPTIONAL
 samples_on = 'rows'  # if samples lie on columns use 'cols' or 'col'
 data_sep = ','  # the data separator. e.g., ',', '\t', ' ', ...
+# working dtype of the data and of every intermediate result, 'float32'
+# halves memory and dump size (steps that upcast are logged)
+dtype = None  # e.g. 'float32'
 X, y, feat_names, index = data_source.load('custom',
                                            data_file, labels_file,
                                            samples_on=samples_on,
-                                           sep=data_sep)
+                                           sep=data_sep, dtype=dtype)
+# Out-of-core (streaming) mode: fit each step chunk_size rows at a time with
+# partial_fit (e.g. Standardize, MinMax, IncrementalPCA, MiniBatchKMeans).
+# Load .npy/.parquet/.feather/.h5 inputs with data_source.load(..., lazy=True)
+# to avoid reading the whole matrix into memory.
+chunk_size = None  # e.g. 10000
 
 # -----------------------  PIPELINES DEFINITION ------------------------ #
 # --- Missing values imputing --- #
@@ -35,17 +56,28 @@ step1 = {'None': [False], 'Recenter': [False], 'Standardize': [False],
          'MinMax': [False, {'feature_range': [(0, 1), (-1, 1)]}]}
 
 # --- Unsupervised features learning --- #
+# nearest neighbors graph shared by Isomap, LLE, SE and tSNE; one of
+# {'exact', 'approximate', None} ('auto' is 'exact'). 'approximate' is a
+# random projection forest, which misses some of the true neighbors; None
+# lets each step compute its own neighbors.
+knn_graph = 'exact'
 # affinity ca be precumputed for SE
-step2 = {'PCA': [False, {'n_components': 3}],
+# PCA solver is one of {'auto', 'full', 'randomized', 'gram', 'arpack',
+# 'incremental'}, 'auto' picks one from the shape of the data
+step2 = {'PCA': [False, {'n_components': 3, 'solver': 'auto'}],
          'IncrementalPCA': [False],
          'RandomizedPCA': [False],
+         'TruncatedSVD': [False],  # for sparse data, without centering
          'KernelPCA': [False, {'kernel': ['linear', 'rbf', 'poly']}],
+         'NystroemKernelPCA': [False, {'kernel': ['rbf', 'poly'],
+                                       'n_landmarks': 500}],
          'Isomap': [False, {'n_neighbors': 5}],
          'LLE': [False, {'n_neighbors': 5,
                          'method': ['standard', 'modified',
                                     'hessian', 'ltsa']}],
          'SE': [False, {'affinity': ['nearest_neighbors', 'rbf']}],
          'MDS': [False, {'metric': True}],
+         'LandmarkMDS': [False, {'n_landmarks': 500}],
          'tSNE': [False],
          'RBM': [False, {'n_components': 256}],
          'None': [False]
@@ -54,6 +86,7 @@ step2 = {'PCA': [False, {'n_components': 3}],
 # --- Clustering --- #
 # affinity ca be precumputed for AP, Spectral and Hierarchical
 step3 = {'KMeans': [False, {'n_clusters': [3, 'auto']}],
+         'MiniBatchKMeans': [False, {'n_clusters': [3]}],
          'AP': [False, {'preference': ['auto']}],
          'MS': [False],
          'Spectral': [False, {'n_clusters': [3, 8]}],
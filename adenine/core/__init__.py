@@ -4,4 +4,12 @@
 # FreeBSD License
 ######################################################################
 
-from adenine.core.job_distribution import main
+
+def main(config_file):
+    """Generate and run the pipelines (see adenine.core.job_distribution).
+
+    The heavy dependencies are imported here, so that importing adenine (and
+    starting ade_run and ade_analysis) stays fast.
+    """
+    from adenine.core.job_distribution import main as _main
+    return _main(config_file)
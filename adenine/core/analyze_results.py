@@ -8,6 +8,7 @@
 ######################################################################
 
 import os
+import csv
 import shutil
 import logging
 import matplotlib; matplotlib.use('AGG')
@@ -25,16 +26,27 @@ except:
 from sklearn import metrics
 
 from adenine.core import plotting
+from adenine.utils import profiling
 from adenine.utils import scores
+from adenine.utils.data_source import densify
 from adenine.utils.extra import title_from_filename
 from adenine.utils.extra import timed, items_iterator
 
 # to save info before logging is loaded
 GLOBAL_INFO = 'matplotlib backend set to AGG'
 
+# the clustering performance of every pipeline, appended by est_clst_perf
+SCORES_INDEX = 'summary_scores.csv'
+
+# the resources used by each step of each pipeline
+TIMINGS = 'summary_timings'
+PHASES = ('fit', 'evaluate', 'voronoi')
+MEASURES = ('ami', 'ari', 'completeness', 'homogeneity', 'v_measure',
+            'inertia', 'silhouette', 'fscore')
+
 
 def est_clst_perf(root, data_in, labels=None, t_labels=None, model=None,
-                  metric='euclidean'):
+                  metric='euclidean', scores_index=None, lock=None):
     """Estimate the clustering performance.
 
     This estimates the clustering performance by means of several indexes.
@@ -62,6 +74,14 @@ def est_clst_perf(root, data_in, labels=None, t_labels=None, model=None,
 
     metric : string
         The metric used during the clustering algorithms.
+
+    scores_index : string, optional
+        If provided, the path of the csv file to which a row with the scores
+        of this pipeline is appended.
+
+    lock : multiprocessing.synchronize.Lock, optional
+        Obtained by multiprocessing.Lock().
+        Needed to append to scores_index from parallel workers.
     """
     perf_out = dict()
     try:
@@ -72,14 +92,9 @@ def est_clst_perf(root, data_in, labels=None, t_labels=None, model=None,
         perf_out['silhouette'] = metrics.silhouette_score(data_in, labels, metric=metric)
         if t_labels is not None:
             # the next indexes need a gold standard
-            perf_out['ari'] = metrics.adjusted_rand_score(t_labels, labels)
-            perf_out['ami'] = metrics.adjusted_mutual_info_score(t_labels, labels)
-            perf_out['homogeneity'] = metrics.homogeneity_score(t_labels, labels)
-            perf_out['completeness'] = metrics.completeness_score(t_labels, labels)
-            perf_out['v_measure'] = metrics.v_measure_score(t_labels, labels)
-
-            perf_out['fscore'] = scores.precision_recall_fscore(
-                scores.confusion_matrix(t_labels, labels)[0])[2]
+            # (ari, ami, homogeneity, completeness, v_measure and fscore
+            # share the same contingency matrix)
+            perf_out.update(scores.clustering_scores(t_labels, labels))
 
     except ValueError as e:
         logging.warning("Clustering performance evaluation failed for %s. "
@@ -108,41 +123,105 @@ def est_clst_perf(root, data_in, labels=None, t_labels=None, model=None,
         pkl.dump(perf_out, f)
     logging.info("Dumped : %s", filename)
 
+    if scores_index is not None:
+        append_scores(scores_index, title_from_filename(root, " --> "),
+                      perf_out, lock)
+
+
+def append_scores(scores_index, pipeline, perf_out, lock=None):
+    """Append the clustering performance of a pipeline to the scores index.
+
+    Parameters
+    -----------
+    scores_index : string
+        The path of the csv file that collects the scores of every pipeline.
+
+    pipeline : string
+        The pipeline name.
+
+    perf_out : dictionary
+        The scores estimated by est_clst_perf().
+
+    lock : multiprocessing.synchronize.Lock, optional
+        Obtained by multiprocessing.Lock().
+        Needed when more processes append to the same file.
+    """
+    row = [pipeline] + [perf_out.get(mm, '') for mm in MEASURES]
+    if lock is None:
+        lock = _NoLock()
+    with lock:
+        write_header = not os.path.exists(scores_index) or \
+            os.path.getsize(scores_index) == 0
+        with open(scores_index, 'a') as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(['pipeline'] + list(MEASURES))
+            writer.writerow(row)
+
+
+class _NoLock(object):
+    """Context manager that does nothing, used when no lock is provided."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
 
 def make_df_clst_perf(root):
     """Summarize all the clustering performance estimations.
 
-    Given the output file produced by est_clst_perf(), this function groups all
+    Given the scores index filled by est_clst_perf(), this function groups all
     of them together in friendly text and latex files, and saves the two files
-    produced in a tree-like structure in the root folder.
+    produced in a tree-like structure in the root folder. It can be called
+    while the analysis is still running. If the scores index is missing, the
+    _scores.pkl files in the root folder are collected instead.
 
     Parameters
     -----------
     root : string
         The root path for the output creation.
     """
-    measures = ('ami', 'ari', 'completeness', 'homogeneity', 'v_measure',
-                'inertia', 'silhouette', 'fscore')
-    df = pd.DataFrame(columns=['pipeline'] + list(measures))
-    for root_, _, filenames in os.walk(root):
-        for fn in filenames:
-            if fn.endswith('_scores.pkl'):
-                with open(os.path.join(root_, fn), 'rb') as f:
-                    perf_out = pkl.load(f)
-                perf_out['pipeline'] = title_from_filename(root_,
-                                                           step_sep=" --> ")
-                df = df.append(perf_out, ignore_index=True)
-    df = df.fillna('')
+    measures = MEASURES
+    scores_index = os.path.join(root, SCORES_INDEX)
+    if os.path.exists(scores_index):
+        df = pd.read_csv(scores_index, dtype={'pipeline': str})
+    else:
+        # results analysed before the scores index was introduced
+        rows = []
+        for root_, _, filenames in os.walk(root):
+            for fn in filenames:
+                if fn.endswith('_scores.pkl'):
+                    with open(os.path.join(root_, fn), 'rb') as f:
+                        perf_out = pkl.load(f)
+                    perf_out['pipeline'] = title_from_filename(
+                        root_, step_sep=" --> ")
+                    rows.append(perf_out)
+        df = pd.DataFrame(rows, columns=['pipeline'] + list(measures))
+    df = df.sort_values('pipeline')
     nan_val = '---'
 
+    # format all the scores at once, column by column
+    scores = df[list(measures)].astype(float)
+    values = pd.DataFrame({mm: scores[mm].map(
+        lambda p: nan_val if np.isnan(p) else '{: .3}'.format(p))
+        for mm in measures}, index=df.index, dtype=object)
+    # find the best value for each score
+    stars = pd.DataFrame(np.where(scores == scores.max(), ' *', '  '),
+                         columns=measures, index=df.index, dtype=object)
+
     pipe_header = 'preprocess --> dim red --> clustering'
     size_pipe = max([len(p) for p in df['pipeline']] + [len(pipe_header)])
-    sizes = [3 + max([len('{: .3}'.format(p)) if p != '' else len(nan_val)
-                     for p in df[mm]] + [len(mm)]) for mm in measures]
+    sizes = [3 + max([len(p) for p in values[mm]] + [len(mm)])
+             for mm in measures]
 
-    # find the best value for each score
-    best_scores = {
-        mm: max([p for p in df[mm] if p != ''] or [np.nan]) for mm in measures}
+    txt_rows = df['pipeline'].str.ljust(size_pipe).str.cat(
+        [values[mm].str.rjust(size - 2) + stars[mm]
+         for size, mm in zip(sizes, measures)], sep='|')
+    tex_cells = [values[mm] + r'&' + stars[mm] for mm in measures]
+    tex_rows = df['pipeline'].map(lambda p: p.replace('-->', r'$\to$')) + \
+        ' & ' + tex_cells[0].str.cat(tex_cells[1:], sep=r'&')
 
     with open(os.path.join(root, 'summary_scores.txt'), 'w') as f, \
             open(os.path.join(root, 'summary_scores.tex'), 'w') as g:
@@ -175,26 +254,8 @@ def make_df_clst_perf(root):
                 r"&& \textbf{fscore}"
                 r" & \\ \hline " "\n")
 
-        for _ in df.iterrows():
-            row = _[1]
-            all_measures = ['{: .3}'.format(row[mm]) if row[mm] != ''
-                            else nan_val for mm in measures]
-
-            stars = [' *' if row[mm] == best_scores[mm] else '  ' for mm in measures]
-            row_measure = [' ' * max(size - len(x) - 2, 1) + x + ss
-                           for size, x, ss in zip(sizes, all_measures, stars)]
-            f.write("{}{}|{}\n"
-                    .format(
-                        row['pipeline'],
-                        ' ' * (size_pipe - len(row['pipeline'])),
-                        '|'.join(row_measure)
-                    ))
-            row_tex = [x + r'&' + ss for x, ss in zip(all_measures, stars)]
-            g.write(r"{} & {} \\" "\n"
-                    .format(
-                        row['pipeline'].replace('-->', r'$\to$'),
-                        r'&'.join(row_tex)
-                    ))
+        f.writelines(row + "\n" for row in txt_rows)
+        g.writelines(row + r" \\" "\n" for row in tex_rows)
 
         f.write("-" * len(header) + "\n")
         g.write(r"\hline" "\n"
@@ -204,6 +265,74 @@ def make_df_clst_perf(root):
                 r"\end{document}")
 
 
+def make_timings_table(input_dict, root):
+    """Summarize the resources used by each step of each pipeline.
+
+    The telemetry recorded by ade_run for the fit, the evaluation and the
+    voronoi fit of every step (wall time, CPU time, growth of the peak
+    resident set size and the shapes of input and output) is collected in a
+    csv file and in a friendly text file in the root folder.
+
+    Parameters
+    -----------
+    input_dict : dictionary
+        The dictionary created by ade_run.py on some data.
+
+    root : string
+        The root path for the output creation.
+    """
+    rows = []
+    for pipe_id, content in items_iterator(input_dict):
+        names, pipe_rows = [], []
+        for i, step in enumerate(sorted(content.keys())):
+            names.append(get_step_attributes(content[step], pos=i)[0])
+            if len(content[step]) < 8:
+                continue  # dumped without telemetry
+            telemetry = content[step][7]
+            for phase in PHASES:
+                if phase not in telemetry:
+                    continue
+                row = {'pipe_id': pipe_id, 'step': names[-1],
+                       'level': content[step][1], 'phase': phase,
+                       'shape_in': 'x'.join(map(str, telemetry.get(
+                           'shape_in') or [])),
+                       'shape_out': 'x'.join(map(str, telemetry.get(
+                           'shape_out') or []))}
+                row.update(telemetry[phase])
+                pipe_rows.append(row)
+        # as the plot titles, e.g. 'PCA_2' -> '2 PCA'
+        pipeline = " --> ".join(' '.join(name.split('_')[::-1])
+                                for name in names)
+        for row in pipe_rows:
+            row['pipeline'] = pipeline
+        rows.extend(pipe_rows)
+    if not rows:
+        logging.info("No telemetry found in the results")
+        return
+
+    columns = ['pipe_id', 'pipeline', 'step', 'level', 'phase', 'wall', 'cpu',
+               'peak_rss', 'shape_in', 'shape_out']
+    df = pd.DataFrame(rows, columns=columns).sort_values(
+        ['pipeline', 'pipe_id'], kind='mergesort')
+    df.to_csv(os.path.join(root, TIMINGS + '.csv'), index=False)
+
+    with open(os.path.join(root, TIMINGS + '.txt'), 'w') as f:
+        table = df.drop('pipe_id', axis=1).rename(columns={
+            'wall': 'wall (s)', 'cpu': 'cpu (s)',
+            'peak_rss': 'peak rss (MB)'}).to_string(
+            index=False, float_format=lambda x: '{:.3f}'.format(x))
+        width = len(table.splitlines()[0])
+        f.write("-" * width + "\n")
+        f.write("Adenine: Resources used by each step of each pipeline\n")
+        f.write("-" * width + "\n")
+        f.write(table + "\n")
+        f.write("-" * width + "\n")
+        totals = df.groupby('phase')[['wall', 'cpu']].sum()
+        for phase, total in totals.iterrows():
+            f.write("Total {}: {:.3f} s wall, {:.3f} s cpu\n"
+                    .format(phase, total['wall'], total['cpu']))
+
+
 def get_step_attributes(step, pos):
     """Get the attributes of the input step.
 
@@ -215,7 +344,8 @@ def get_step_attributes(step, pos):
     -----------
     step : list
         A step coded by ade_run.py as
-        [name, level, param, data_out, data_in, mdl obj, voronoi_mdl_obj]
+        [name, level, param, data_out, data_in, mdl obj, voronoi_mdl_obj,
+        telemetry], where telemetry is optional.
 
     pos : int
         The position of the step inside the pipeline.
@@ -265,7 +395,7 @@ def get_step_attributes(step, pos):
         name += "_({} - {})".format(*param['feature_range'])
 
     # Append additional parameters in the step name
-    if name == 'KernelPCA':
+    if name in ('KernelPCA', 'NystroemKernelPCA'):
         name += '_' + param['kernel']
     elif name == 'LLE':
         name += '_' + param['method']
@@ -279,6 +409,10 @@ def get_step_attributes(step, pos):
     elif name == 'SE':
         name += '_' + param['affinity']
 
+    # solver selected at fit time (e.g. by AdaptivePCA)
+    if getattr(mdl_obj, 'solver_', ''):
+        name += '_' + mdl_obj.solver_
+
     try:
         n_clusters = param.get('n_clusters', 0) or  \
             param.get('best_estimator_', dict()).get('cluster_centers_',
@@ -321,7 +455,8 @@ def analysis_worker(elem, root, y, feat_names, index, lock):
 
     lock : multiprocessing.synchronize.Lock
         Obtained by multiprocessing.Lock().
-        Needed for optional creation of directories.
+        Needed for optional creation of directories and for appending to the
+        scores index.
     """
     # Getting pipeID and content
     pipe, content = elem[:2]
@@ -332,6 +467,8 @@ def analysis_worker(elem, root, y, feat_names, index, lock):
         # Tree-like folder structure definition
         step_name, step_level, step_param, step_out, step_in, mdl_obj, \
             voronoi_mdl_obj, metric = get_step_attributes(content[step], pos=i)
+        # the plots need dense data
+        step_in = densify(step_in, 'The analysis of ' + step_name)
         logging.info("LEVEL {} : {}".format(step_level, step_name))
 
         # Output folder definition & creation
@@ -387,7 +524,9 @@ def analysis_worker(elem, root, y, feat_names, index, lock):
             plotting.silhouette(root=rootname, labels=step_out,
                                 data_in=step_in, model=mdl_obj)
             est_clst_perf(root=rootname, data_in=step_in, labels=step_out,
-                          t_labels=y, model=mdl_obj, metric=metric)
+                          t_labels=y, model=mdl_obj, metric=metric,
+                          scores_index=os.path.join(root, SCORES_INDEX),
+                          lock=lock)
 
 
 @timed
@@ -436,10 +575,18 @@ def analyze(input_dict, root, y=None, feat_names=None, index=None, **kwargs):
     else:
         plotting.DEFAULT_EXT = ff
     logging.info("File format set to %s", plotting.DEFAULT_EXT)
+
+    # the scores index is filled again by this analysis
+    if os.path.exists(os.path.join(root, SCORES_INDEX)):
+        os.remove(os.path.join(root, SCORES_INDEX))
+
     lock = mp.Lock()
     ps = []
     for elem in items_iterator(input_dict):
-        p = mp.Process(target=analysis_worker,
+        worker = profiling.profiled(
+            analysis_worker, 'analysis', elem[0],
+            [step[0] for step in elem[1].values()])
+        p = mp.Process(target=worker,
                        args=(elem, root, y, feat_names, index, lock))
         p.start()
         ps.append(p)
@@ -447,9 +594,15 @@ def analyze(input_dict, root, y=None, feat_names=None, index=None, **kwargs):
     for p in ps:
         p.join()
 
+    # merge the profiles of the selected pipelines, if any
+    profiling.merge_profiles('analysis')
+
     # Create summary_scores.{txt, tex}
     make_df_clst_perf(root)
 
+    # Create summary_timings.{txt, csv}
+    make_timings_table(input_dict, root)
+
     # Compile tex
     try:
         with open(os.devnull, 'w') as devnull:
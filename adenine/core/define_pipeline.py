@@ -9,35 +9,102 @@
 
 import inspect
 import logging
+import numbers
+import importlib
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.preprocessing import Normalizer
-from sklearn.decomposition import PCA
-from sklearn.decomposition import RandomizedPCA
-from sklearn.decomposition import IncrementalPCA
-from sklearn.manifold import Isomap
-from sklearn.manifold import LocallyLinearEmbedding
-from sklearn.manifold import SpectralEmbedding
-from sklearn.manifold import MDS
-from sklearn.manifold import TSNE
-from sklearn.neural_network import BernoulliRBM
-from sklearn.cluster import KMeans
-from sklearn.cluster import AffinityPropagation
-from sklearn.cluster import MeanShift
-from sklearn.cluster import SpectralClustering
-from sklearn.cluster import AgglomerativeClustering
-
-from adenine.utils.extensions import DummyNone
-from adenine.utils.extensions import Imputer
-from adenine.utils.extensions import GridSearchCV
-from adenine.utils.extensions import KernelPCA
-from adenine.utils.extensions import silhouette_score
+from collections import Counter
+from itertools import islice
+from itertools import product
 
 from adenine.utils.extra import modified_cartesian
 from adenine.utils.extra import ensure_list
 from adenine.utils.extra import values_iterator
 
+# maximum number of pipelines run by ade_run
+MAX_N_PIPES = 200
+
+# Estimator registries: the classes are imported only when a pipeline uses
+# them (see get_estimator), so that importing adenine stays fast
+DUMMY = 'adenine.utils.extensions.DummyNone'
+
+IMPUTING = {'none': DUMMY, 'impute': 'adenine.utils.extensions.Imputer'}
+
+PREPROCESSING = {'none': DUMMY,
+                 'recenter': 'sklearn.preprocessing.StandardScaler',
+                 'standardize': 'sklearn.preprocessing.StandardScaler',
+                 'normalize': 'sklearn.preprocessing.Normalizer',
+                 'minmax': 'sklearn.preprocessing.MinMaxScaler'}
+
+DIMRED = {'none': DUMMY,
+          'pca': 'adenine.utils.extensions.AdaptivePCA',
+          'incrementalpca': 'sklearn.decomposition.IncrementalPCA',
+          'randomizedpca': 'sklearn.decomposition.RandomizedPCA',
+          'truncatedsvd': 'sklearn.decomposition.TruncatedSVD',
+          'kernelpca': 'adenine.utils.extensions.KernelPCA',
+          'nystroemkernelpca': 'adenine.utils.extensions.NystroemKernelPCA',
+          'isomap': 'adenine.utils.extensions.Isomap',
+          'lle': 'adenine.utils.extensions.LocallyLinearEmbedding',
+          'se': 'adenine.utils.extensions.SpectralEmbedding',
+          'mds': 'sklearn.manifold.MDS',
+          'landmarkmds': 'adenine.utils.extensions.LandmarkMDS',
+          'tsne': 'adenine.utils.extensions.TSNE',
+          'rbm': 'sklearn.neural_network.BernoulliRBM'}
+
+# the linear projections, which cannot have more components than features
+# (while e.g. KernelPCA, Isomap or RBM can)
+LINEAR_PROJECTIONS = ('pca', 'incrementalpca', 'randomizedpca',
+                      'truncatedsvd')
+
+CLUSTERING = {'none': DUMMY,
+              'kmeans': 'sklearn.cluster.KMeans',
+              'minibatchkmeans': 'sklearn.cluster.MiniBatchKMeans',
+              'ap': 'sklearn.cluster.AffinityPropagation',
+              'ms': 'sklearn.cluster.MeanShift',
+              'spectral': 'sklearn.cluster.SpectralClustering',
+              'hierarchical': 'sklearn.cluster.AgglomerativeClustering'}
+
+
+def get_estimator(registry, key):
+    """Import the class registered under key (DummyNone if unknown).
+
+    Parameters
+    -----------
+    registry : dictionary
+        One of IMPUTING, PREPROCESSING, DIMRED or CLUSTERING.
+
+    key : str
+        The (case insensitive) name of the algorithm in the ade_config file.
+
+    Returns
+    -----------
+    cls : class
+        The sklearn (or sklearn-like) class.
+    """
+    module, name = registry.get(key.lower(), DUMMY).rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def import_estimators(specs):
+    """Import the classes used by the pipeline specifications.
+
+    The estimators are still created by the workers (see make_pipeline), but
+    importing their classes once beforehand lets the forked workers inherit
+    the modules instead of importing them again. Import errors are left to
+    the workers, which report the pipeline as failed.
+
+    Parameters
+    -----------
+    specs : list of list of tuples
+        The pipeline specifications (see iter_pipelines).
+    """
+    keys = set((key.lower(), level) for spec in specs
+               for key, _, level in spec if not inspect.isclass(key))
+    for key, level in sorted(keys):
+        try:
+            get_estimator(REGISTRIES[level], key)
+        except (ImportError, AttributeError) as exc:
+            logging.warning("Cannot import the %s step: %s", key, exc)
+
 
 def parse_imputing(key, content):
     """Parse the options of the imputing step.
@@ -67,8 +134,7 @@ def parse_imputing(key, content):
         pi = key(**content)
         key = pi.__class__.__name__.lower()
     else:
-        imputing_methods = {'none': DummyNone, 'impute': Imputer}
-        pi = imputing_methods.get(key.lower(), DummyNone)(**content)
+        pi = get_estimator(IMPUTING, key)(**content)
     return (key, pi, 'imputing')
 
 
@@ -100,21 +166,15 @@ def parse_preproc(key, content):
     if inspect.isclass(key):
         pp = key(**content)
         key = pp.__class__.__name__.lower()
-    elif key.lower() == 'none':
-        pp = DummyNone()
     elif key.lower() == 'recenter':
-        pp = StandardScaler(with_mean=True, with_std=False)
+        pp = get_estimator(PREPROCESSING, key)(with_mean=True, with_std=False)
     elif key.lower() == 'standardize':
-        pp = StandardScaler(with_mean=True, with_std=True)
-    elif key.lower() == 'normalize':
-        content.setdefault('norm', 'l2')
-        # pp = Normalizer(norm=content[1][0])
-        pp = Normalizer(**content)
-    elif key.lower() == 'minmax':
-        content.setdefault('feature_range', (0, 1))
-        pp = MinMaxScaler(**content)
+        pp = get_estimator(PREPROCESSING, key)(with_mean=True, with_std=True)
+    elif key.lower() in ('normalize', 'minmax'):
+        pp = get_estimator(PREPROCESSING, key)(
+            **step_defaults(key, content, 'preproc'))
     else:
-        pp = DummyNone()
+        pp = get_estimator(PREPROCESSING, 'none')()
     return (key, pp, 'preproc')
 
 
@@ -126,8 +186,9 @@ def parse_dimred(key, content):
 
     Parameters
     -----------
-    key : class or str, like {'None', 'PCA', 'KernelPCA', 'Isomap', 'LLE',
-                              'SE', 'MDS', 'tSNE', 'RBM'}
+    key : class or str, like {'None', 'PCA', 'TruncatedSVD', 'KernelPCA',
+                              'NystroemKernelPCA', 'Isomap', 'LLE', 'SE',
+                              'MDS', 'LandmarkMDS', 'tSNE', 'RBM'}
         The selected dimensionality reduction algorithm. In case in which key
         is a `class`, it must contain both a `fit` and `transform` method.
 
@@ -146,14 +207,8 @@ def parse_dimred(key, content):
         dr = key(**content)
         key = dr.__class__.__name__.lower()
     else:
-        drs = {'none': DummyNone, 'pca': PCA, 'incrementalpca': IncrementalPCA,
-               'randomizedpca': RandomizedPCA, 'kernelpca': KernelPCA,
-               'isomap': Isomap, 'lle': LocallyLinearEmbedding,
-               'se': SpectralEmbedding, 'mds': MDS, 'tsne': TSNE,
-               'rbm': BernoulliRBM}
-
-        content.setdefault('n_components', 3)  # use three cluster as default
-        dr = drs.get(key.lower(), DummyNone)(**content)
+        dr = get_estimator(DIMRED, key)(
+            **step_defaults(key, content, 'dimred'))
     return (key, dr, 'dimred')
 
 
@@ -165,7 +220,8 @@ def parse_clustering(key, content):
 
     Parameters
     -----------
-    key : class or str, like {'KMeans', 'AP', 'MS', 'Spectral', 'Hierarchical'}
+    key : class or str, like {'KMeans', 'MiniBatchKMeans', 'AP', 'MS',
+                              'Spectral', 'Hierarchical'}
         The selected clustering algorithm. In case in which key
         is a `class`, it must contain a `fit` method.
 
@@ -189,6 +245,8 @@ def parse_clustering(key, content):
             and key.lower() != 'hierarchical':
         # Wrapper class that automatically detects the best number of clusters
         # via 10-Fold CV
+        from adenine.utils.extensions import GridSearchCV
+        from adenine.utils.extensions import silhouette_score
         content.pop('n_clusters', '')
         content.pop('preference', '')
 
@@ -198,9 +256,9 @@ def parse_clustering(key, content):
         if key.lower() == 'kmeans':
             content.setdefault('init', 'k-means++')
             content.setdefault('n_jobs', 1)
-            kwargs['estimator'] = KMeans(**content)
+            kwargs['estimator'] = get_estimator(CLUSTERING, key)(**content)
         elif key.lower() == 'ap':
-            kwargs['estimator'] = AffinityPropagation(**content)
+            kwargs['estimator'] = get_estimator(CLUSTERING, key)(**content)
             kwargs['affinity'] = kwargs['estimator'].affinity
         else:
             logging.error("n_clusters = 'auto' specified outside kmeans or "
@@ -212,28 +270,77 @@ def parse_clustering(key, content):
             and key.lower() == 'hierarchical':
         # TODO implement this
         # from adenine.utils.extensions import AgglomerativeClustering
-        cl = AgglomerativeClustering(**content)
+        cl = get_estimator(CLUSTERING, key)(**content)
     else:
         if key.lower() == 'kmeans':
             content.setdefault('n_jobs', -1)
-            cl = KMeans(**content)
         elif key.lower() == 'ap':
-            content.setdefault('preference', 1)
-            cl = AffinityPropagation(**content)
-        elif key.lower() == 'ms':
-            cl = MeanShift(**content)
-        elif key.lower() == 'spectral':
-            cl = SpectralClustering(**content)
-        elif key.lower() == 'hierarchical':
-            cl = AgglomerativeClustering(**content)
-        else:
-            cl = DummyNone()
+            step_defaults(key, content, 'clustering')
+        elif key.lower() not in CLUSTERING:
+            content = dict()
+        cl = get_estimator(CLUSTERING, key)(**content)
     return (key, cl, 'clustering')
 
 
-def _lst_of_tpls(step, parsing_function, filt=None):
-    """Generate a list of tuples for each parameter combination."""
-    lst = []
+def hessian_n_neighbors(n_components):
+    """The number of neighbors required by the hessian LLE."""
+    return 1 + n_components * (n_components + 3) // 2
+
+
+def step_defaults(key, content, level):
+    """Set the default parameters of a step defined in the ade_config file.
+
+    Parameters
+    -----------
+    key : str
+        The name of the algorithm in the ade_config file.
+
+    content : dict
+        The parameters of the step, modified in place.
+
+    level : {'imputing', 'preproc', 'dimred', 'clustering'}
+        The step level.
+
+    Returns
+    -----------
+    content : dict
+        The parameters of the step, including the defaults.
+    """
+    key = key.lower()
+    if level == 'preproc' and key == 'normalize':
+        content.setdefault('norm', 'l2')
+    elif level == 'preproc' and key == 'minmax':
+        content.setdefault('feature_range', (0, 1))
+    elif level == 'dimred':
+        content.setdefault('n_components', 3)  # use three cluster as default
+        if key == 'lle' and content.get('method') == 'hessian' and \
+                _is_int(content['n_components']):
+            # the only n_neighbors accepted by the hessian LLE
+            content['n_neighbors'] = hessian_n_neighbors(
+                content['n_components'])
+    elif level == 'clustering' and key == 'ap':
+        content.setdefault('preference', 1)
+    return content
+
+
+def _is_int(value):
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def _is_dummy(key, level):
+    """Whether a step does nothing (it is a DummyNone)."""
+    return not inspect.isclass(key) and \
+        REGISTRIES[level].get(key.lower(), DUMMY) == DUMMY
+
+
+def step_name(key):
+    """The name of a step in the results (e.g. 'PCA')."""
+    return key.__name__.lower() if inspect.isclass(key) else key
+
+
+def _step_specs(step, level, filt=None):
+    """Generate a step specification for each parameter combination."""
+    specs = []
     for key in step:
         if step[key][0]:  # On/Off flag
             if len(step[key]) > 1:
@@ -243,13 +350,220 @@ def _lst_of_tpls(step, parsing_function, filt=None):
                     content = dict(zip(list(content_d), ll))
                     if filt is not None and filt(content):
                         continue
-                    lst.append(parsing_function(key, content))
+                    specs.append((key, content, level))
             else:
-                lst.append(parsing_function(key, {}))
-    return lst
+                specs.append((key, {}, level))
+    # the defaults are part of the parameters, so that equivalent
+    # specifications are identical
+    return [(key, content if inspect.isclass(key) else
+             step_defaults(key, content, level), level)
+            for key, content, level in specs]
+
+
+def spec_key(spec):
+    """Hashable description of what a pipeline computes.
+
+    Two pipelines with the same key produce the same results: the key lists
+    the algorithm and the parameters of each step, skipping the steps which
+    do nothing (e.g. a 'None' preprocessing).
+
+    Parameters
+    -----------
+    spec : list of tuples
+        The pipeline specification, as generated by iter_pipelines.
+
+    Returns
+    -----------
+    key : tuple
+    """
+    return tuple(
+        (level, key if inspect.isclass(key) else key.lower(),
+         repr(sorted(content.items())))
+        for key, content, level in spec if not _is_dummy(key, level))
+
+
+def check_spec(spec, n_samples=None, n_features=None):
+    """Check that a pipeline can run on data of the given shape.
+
+    Parameters
+    -----------
+    spec : list of tuples
+        The pipeline specification, as generated by iter_pipelines.
 
+    n_samples : int, optional, default None
+        The number of samples of the input data, if known.
 
-def parse_steps(steps, max_n_pipes=200):
+    n_features : int, optional, default None
+        The number of features of the input data, if known.
+
+    Returns
+    -----------
+    reason : string or None
+        Why the pipeline is invalid, None if it is valid (or if the shape of
+        the data is unknown).
+    """
+    for key, content, level in spec:
+        if _is_dummy(key, level):
+            continue
+        name = step_name(key)
+        n_components = content.get('n_components')
+        if level == 'dimred' and _is_int(n_components) and \
+                n_features is not None:
+            if name.lower() in LINEAR_PROJECTIONS and \
+                    n_components > n_features:
+                return "{}: n_components = {} > {} features".format(
+                    name, n_components, n_features)
+            n_features = n_components
+        n_clusters = content.get('n_clusters')
+        if level == 'clustering' and _is_int(n_clusters) and \
+                n_samples is not None and n_clusters > n_samples:
+            return "{}: n_clusters = {} > {} samples".format(
+                name, n_clusters, n_samples)
+    return None
+
+
+def describe(spec):
+    """Short description of a pipeline specification, for the logs."""
+    return ' --> '.join(
+        step_name(key) if _is_dummy(key, level) or not content else
+        '{}({})'.format(step_name(key), ', '.join(
+            '{}={!r}'.format(*item) for item in sorted(content.items())))
+        for key, content, level in spec)
+
+
+def iter_grid(steps, n_samples=None, n_features=None):
+    """Lazily generate every combination of the steps, with its status.
+
+    Parameters
+    -----------
+    steps : list of dictionaries
+        The steps of the ade_config file (see parse_steps).
+
+    n_samples : int, optional, default None
+        The number of samples of the input data, if known.
+
+    n_features : int, optional, default None
+        The number of features of the input data, if known.
+
+    Yields
+    -----------
+    spec : list of tuples
+        The pipeline specification: a ('step_name', parameters, level) tuple
+        for each step; make_pipeline creates the estimators.
+
+    reason : string or None
+        None if the pipeline is to be run (it is valid and new); else why it
+        is skipped, 'invalid: ...' or 'duplicate of pipeN', where pipeN is
+        the equivalent pipeline to run (numbered from pipe0).
+    """
+    # When parsing clustering options, take care of error-generating parameters
+    filters = {'clustering': (
+        lambda x: x.get('affinity', '') in ['manhattan', 'precomputed'] and
+        x.get('linkage', '') == 'ward')}
+    grid = [_step_specs(step, level, filters.get(level))
+            for step, level in zip(steps, LEVELS)]
+
+    seen = dict()  # spec_key -> pipe id
+    for spec in product(*[specs for specs in grid if specs]):
+        spec = list(spec)
+        reason = check_spec(spec, n_samples, n_features)
+        if reason is not None:
+            reason = 'invalid: ' + reason
+        else:
+            key = spec_key(spec)
+            if key in seen:
+                reason = 'duplicate of ' + seen[key]
+            else:
+                seen[key] = 'pipe' + str(len(seen))
+        yield spec, reason
+
+
+def iter_pipelines(steps, n_samples=None, n_features=None, skipped=None):
+    """Lazily generate the distinct valid pipeline specifications.
+
+    Equivalent combinations (e.g. differing only by steps which do nothing)
+    are generated only once, combinations which cannot run on data of the
+    given shape are skipped (with a warning). See iter_grid.
+
+    If provided, the collections.Counter skipped counts the skipped
+    combinations, by kind ('invalid' or 'duplicate').
+    """
+    for spec, reason in iter_grid(steps, n_samples, n_features):
+        if reason is None:
+            yield spec
+            continue
+        kind = 'invalid' if reason.startswith('invalid') else 'duplicate'
+        if skipped is not None:
+            skipped[kind] += 1
+        if kind == 'invalid':
+            logging.warning("Skipping pipeline %s (%s)", describe(spec),
+                            reason)
+        else:
+            logging.debug("Skipping pipeline %s (%s)", describe(spec), reason)
+
+
+def make_pipeline(spec):
+    """Create the estimators of a pipeline specification.
+
+    Parameters
+    -----------
+    spec : list of tuples
+        The pipeline specification, as generated by iter_pipelines.
+
+    Returns
+    -----------
+    pipe : list of tuples
+        A ('step_name', estimator, level) tuple for each step.
+    """
+    return [PARSERS[level](key, dict(content)) for key, content, level in spec]
+
+
+def list_pipelines(steps, max_n_pipes=MAX_N_PIPES, n_samples=None,
+                   n_features=None):
+    """The pipeline specifications to run, up to max_n_pipes.
+
+    Parameters
+    -----------
+    steps : list of dictionaries
+        The steps of the ade_config file (see parse_steps).
+
+    max_n_pipes : int, optional, default: MAX_N_PIPES
+        The maximum number of pipelines. If None, all of them are returned.
+
+    n_samples : int, optional, default None
+        The number of samples of the input data, if known.
+
+    n_features : int, optional, default None
+        The number of features of the input data, if known.
+
+    Returns
+    -----------
+    specs : list of list of tuples
+        The pipeline specifications (see iter_pipelines).
+    """
+    skipped = Counter()
+    specs = iter_pipelines(steps, n_samples, n_features, skipped)
+    if max_n_pipes is not None:
+        specs = islice(specs, max_n_pipes + 1)
+    specs = list(specs)
+
+    #  Get only the first max_n_pipes
+    if max_n_pipes is not None and len(specs) > max_n_pipes:
+        logging.warning("Maximum number of pipelines reached. "
+                        "I'm keeping the first %d", max_n_pipes)
+        specs = specs[:max_n_pipes]
+
+    if skipped:
+        logging.warning("Skipped %d invalid and %d duplicate pipeline(s)",
+                        skipped['invalid'], skipped['duplicate'])
+    for spec in specs:
+        logging.info("Generated pipeline: %s", describe(spec))
+    logging.info("*** %d pipeline(s) generated ***", len(specs))
+    return specs
+
+
+def parse_steps(steps, max_n_pipes=MAX_N_PIPES, n_samples=None,
+                n_features=None):
     """Parse the steps and create the pipelines.
 
     This function parses the steps coded as dictionaries in the ade_config
@@ -263,44 +577,42 @@ def parse_steps(steps, max_n_pipes=200):
     multiple params. In case in which the 'list of params' is actually a list,
     multiple pipelines are created for each combination of parameters.
 
+    Equivalent combinations are created only once (see iter_pipelines). To
+    create the estimators only when needed, use list_pipelines and
+    make_pipeline.
+
     Parameters
     -----------
     steps : list of dictionaries
         A list of (usually 4) dictionaries that contains the details of the
         pipelines to implement.
 
-    max_n_pipes : int, optional, default: 200
+    max_n_pipes : int, optional, default: MAX_N_PIPES
         The maximum number of combinations allowed. This avoids a too expensive
-        computation.
+        computation. If None, all the combinations are returned.
+
+    n_samples : int, optional, default None
+        The number of samples of the input data, if known.
+
+    n_features : int, optional, default None
+        The number of features of the input data, if known: pipelines
+        reducing the data to more components than features are skipped.
 
     Returns
     -----------
-    pipes : list of sklearn.pipeline.Pipeline
+    pipes : list of list of tuples
         The returned list must contain every possible combination of
         imputing -> preprocessing -> dimensionality reduction -> clustering
         algorithms (up to max_n_pipes).
     """
-    im_lst_of_tpls = _lst_of_tpls(steps[0], parse_imputing)
-    pp_lst_of_tpls = _lst_of_tpls(steps[1], parse_preproc)
-    dr_lst_of_tpls = _lst_of_tpls(steps[2], parse_dimred)
+    return [make_pipeline(spec) for spec in list_pipelines(
+        steps, max_n_pipes, n_samples, n_features)]
 
-    # When parsing clustering options, take care of error-generating parameters
-    cl_lst_of_tpls = _lst_of_tpls(
-        steps[3], parse_clustering,
-        filt=(lambda x: x.get('affinity', '') in ['manhattan', 'precomputed']
-              and x.get('linkage', '') == 'ward'))
-
-    # Generate the list of list of tuples (i.e. the list of pipelines)
-    pipes = modified_cartesian(im_lst_of_tpls, pp_lst_of_tpls, dr_lst_of_tpls,
-                               cl_lst_of_tpls, pipes_mode=True)
-    for pipe in pipes:
-        logging.info("Generated pipeline: \n %s \n", pipe)
-    logging.info("*** %d pipeline(s) generated ***", len(pipes))
 
-    #  Get only the first max_n_pipes
-    if len(pipes) > max_n_pipes:
-        logging.warning("Maximum number of pipelines reached. "
-                        "I'm keeping the first %d", max_n_pipes)
-        pipes = pipes[:max_n_pipes]
+LEVELS = ('imputing', 'preproc', 'dimred', 'clustering')
+
+REGISTRIES = {'imputing': IMPUTING, 'preproc': PREPROCESSING,
+              'dimred': DIMRED, 'clustering': CLUSTERING}
 
-    return pipes
+PARSERS = {'imputing': parse_imputing, 'preproc': parse_preproc,
+           'dimred': parse_dimred, 'clustering': parse_clustering}
@@ -4,15 +4,19 @@ import os
 import imp
 import logging
 import shutil
-import gzip
+import tempfile
 import numpy as np
 
 from collections import deque
-from six.moves import cPickle as pkl
 
 from adenine.core import define_pipeline
-from adenine.core.pipelines import pipe_worker
+from adenine.core.pipelines import set_stream_folder
+from adenine.core.pipelines import spec_worker
+from adenine.utils import compression
+from adenine.utils import dump
 from adenine.utils import extra
+from adenine.utils import neighbors
+from adenine.utils import profiling
 
 try:
     from mpi4py import MPI
@@ -37,24 +41,34 @@ DO_WORK = 100
 EXIT = 200
 
 
-def master_single_machine(pipes, X):
+def master_single_machine(pipes, X, chunk_size=None, dtype=None):
     """Fit and transform/predict some pipelines on some data (single machine).
 
     This function fits each pipeline in the input list on the provided data.
     The results are dumped into a pkl file as a dictionary of dictionaries of
     the form {'pipe_id': {'stepID' : [alg_name, level, params, data_out,
-    data_in, model_obj, voronoi_suitable_object], ...}, ...}. The model_obj is
-    the sklearn model which has been fit on the dataset, the
+    data_in, model_obj, voronoi_suitable_object, telemetry], ...}, ...}. The
+    model_obj is the sklearn model which has been fit on the dataset, the
     voronoi_suitable_object is the very same model but fitted on just the first
-    two dimensions of the dataset. If a pipeline fails for some reasons the
-    content of the stepID key is a list of np.nan.
+    two dimensions of the dataset. The telemetry is a dictionary with the
+    shapes of the input and output of the step and the resources (wall time,
+    CPU time, peak RSS growth) used by its fit, evaluate and voronoi fit. If a
+    pipeline fails for some reasons the content of the stepID key is a list of
+    np.nan.
 
     Parameters
     -----------
     pipes : list of list of tuples
-        Each tuple contains a label and a sklearn Pipeline object.
+        The pipeline specifications (see define_pipeline.iter_pipelines),
+        the estimators are created by the processes running them.
     X : array of float, shape : n_samples x n_features, default : ()
         The input data matrix.
+    chunk_size : int, optional, default None
+        If provided, the pipelines are executed in streaming mode, processing
+        chunk_size rows at a time.
+    dtype : numpy dtype, optional, default None
+        If provided, the working dtype of the data and of every intermediate
+        output.
 
     Returns
     -----------
@@ -62,6 +76,8 @@ def master_single_machine(pipes, X):
         Dictionary with the results of the computation.
     """
     import multiprocessing as mp
+    # the forked workers inherit the estimator modules
+    define_pipeline.import_estimators(pipes)
     jobs = []
     manager = mp.Manager()
     pipes_dump = manager.dict()
@@ -69,8 +85,12 @@ def master_single_machine(pipes, X):
     # Submit jobs
     for i, pipe in enumerate(pipes):
         pipe_id = 'pipe' + str(i)
-        proc = mp.Process(target=pipe_worker,
-                          args=(pipe_id, pipe, pipes_dump, X))
+        worker = profiling.profiled(spec_worker, 'run', pipe_id,
+                                    [define_pipeline.step_name(step[0])
+                                     for step in pipe])
+        proc = mp.Process(target=worker,
+                          args=(pipe_id, pipe, pipes_dump, X, chunk_size,
+                                dtype))
         jobs.append(proc)
         proc.start()
         logging.info("Job: %s submitted", pipe_id)
@@ -84,7 +104,7 @@ def master_single_machine(pipes, X):
 
     # import joblib as jl
     # jl.Parallel(n_jobs=-1) \
-    #     (jl.delayed(pipe_worker)(
+    #     (jl.delayed(spec_worker)(
     #         'pipe' + str(i), pipe, pipes_dump, X) for i, pipe in enumerate(
     #             pipes))
 
@@ -95,12 +115,14 @@ def master_single_machine(pipes, X):
 def master(config):
     """Distribute pipelines with mpi4py or multiprocessing."""
     # Pipeline definition
-    pipes = define_pipeline.parse_steps(
-        [config.step0, config.step1,
-         config.step2, config.step3])
+    # the estimators are created only when a worker runs the pipeline
+    pipes = define_pipeline.list_pipelines(
+        [config.step0, config.step1, config.step2, config.step3],
+        n_samples=config.X.shape[0], n_features=config.X.shape[1])
 
     if not IS_MPI_JOB:
-        return master_single_machine(pipes, config.X)
+        return master_single_machine(pipes, config.X, config.chunk_size,
+                                     config.dtype)
 
     # RUN PIPELINES
     nprocs = COMM.Get_size()
@@ -147,13 +169,19 @@ def master(config):
     return pipe_dump
 
 
-def slave(X):
+def slave(X, chunk_size=None, dtype=None):
     """Pipeline evaluation.
 
     Parameters
     ----------
     X : array of float, shape : n_samples x n_features, default : ()
         The input data matrix.
+    chunk_size : int, optional, default None
+        If provided, the pipelines are executed in streaming mode, processing
+        chunk_size rows at a time.
+    dtype : numpy dtype, optional, default None
+        If provided, the working dtype of the data and of every intermediate
+        output.
     """
     try:
         while True:
@@ -166,45 +194,39 @@ def slave(X):
             i, pipe = received
             # print(NAME + ": slave received", RANK, i)
             pipe_id = 'pipe' + str(i)
-            step_dump = pipe_worker(
-                pipe_id, pipe, None, X)
+            worker = profiling.profiled(spec_worker, 'run', pipe_id,
+                                        [define_pipeline.step_name(step[0])
+                                         for step in pipe])
+            step_dump = worker(pipe_id, pipe, None, X, chunk_size, dtype)
             COMM.send((pipe_id, step_dump), dest=0, tag=0)
 
     except StandardError as exc:
         print("Quitting ... TB:", str(exc))
 
 
-def main(config_file):
-    """Generate the pipelines."""
+def load_config(config_file):
+    """Load an ade_config file and set the defaults of the missing options.
 
-    if RANK == 0:
-        # Load the configuration file
-        config_path = os.path.abspath(config_file)
-
-        # For some reason, it must be atomic
-        imp.acquire_lock()
-        config = imp.load_source('ade_config', config_path)
-        imp.release_lock()
-
-    # this barrier prevents the slave to re-download the same GEO
-    # dataset if not locally present
-    if IS_MPI_JOB:
-        # Wait for all jobs to end
-        COMM.barrier()
+    Parameters
+    -----------
+    config_file : string
+        The path of the ade_config file.
 
-    if RANK != 0:
-        # Load the configuration file
-        config_path = os.path.abspath(config_file)
+    Returns
+    -----------
+    config : module
+        The loaded configuration, including the data matrix X.
+    """
+    config_path = os.path.abspath(config_file)
 
-        # For some reason, it must be atomic
-        imp.acquire_lock()
-        config = imp.load_source('ade_config', config_path)
-        imp.release_lock()
+    # For some reason, it must be atomic
+    imp.acquire_lock()
+    config = imp.load_source('ade_config', config_path)
+    imp.release_lock()
 
-    if hasattr(config, 'use_compression'):
-        use_compression = config.use_compression
-    else:
-        use_compression = False
+    # use_compression = True (older configs) picks the fastest codec
+    if getattr(config, 'use_compression', False):
+        extra.set_module_defaults(config, {'compression': 'auto'})
 
     extra.set_module_defaults(
         config, {
@@ -214,8 +236,37 @@ def main(config_file):
             'step3': {'None': [False]},
             'exp_tag': 'debug',
             'output_root_folder': 'results',
+            'chunk_size': None,
+            'knn_graph': None,
+            'dtype': None,
+            'slim_models': False,
+            'compression': None,
+            'profile': None,
             'verbose': False})
 
+    if config.dtype is not None and isinstance(config.X, np.ndarray):
+        config.X = config.X.astype(config.dtype, copy=False)
+    return config
+
+
+def main(config_file):
+    """Generate the pipelines."""
+    config_path = os.path.abspath(config_file)
+
+    if RANK == 0:
+        # Load the configuration file
+        config = load_config(config_file)
+
+    # this barrier prevents the slave to re-download the same GEO
+    # dataset if not locally present
+    if IS_MPI_JOB:
+        # Wait for all jobs to end
+        COMM.barrier()
+
+    if RANK != 0:
+        # Load the configuration file
+        config = load_config(config_file)
+
     # Read the variables from the config file
     X = config.X
 
@@ -235,9 +286,35 @@ def main(config_file):
         lsh.setFormatter(
             logging.Formatter('%(levelname)s (%(name)s): %(message)s'))
         root_logger.addHandler(lsh)
+
+    # The nearest neighbors graphs shared by the manifold learning steps
+    knn_cache = None
+    if RANK == 0 and config.knn_graph is not None:
+        knn_cache = tempfile.mkdtemp(prefix='.knn_graphs_', dir=root)
+    if IS_MPI_JOB:
+        knn_cache = COMM.bcast(knn_cache, root=0)
+    neighbors.set_graph_options(config.knn_graph, knn_cache)
+
+    # The profiles of the selected pipelines
+    profile_dir = None
+    if RANK == 0 and config.profile is not None:
+        profile_dir = tempfile.mkdtemp(prefix='.profiles_', dir=root)
+    if IS_MPI_JOB:
+        profile_dir = COMM.bcast(profile_dir, root=0)
+    profiling.set_profile_options(config.profile, profile_dir)
+
+    # The data clustered by the streamed pipelines, kept on disk until dumped
+    stream_dir = None
+    if RANK == 0 and config.chunk_size:
+        stream_dir = tempfile.mkdtemp(prefix='.streamed_', dir=root)
+    if IS_MPI_JOB:
+        stream_dir = COMM.bcast(stream_dir, root=0)
+    set_stream_folder(stream_dir)
+
+    if RANK == 0:
         pipes_dump = master(config)
     else:
-        slave(X)
+        slave(X, config.chunk_size, config.dtype)
 
     if IS_MPI_JOB:
         # Wait for all jobs to end
@@ -253,28 +330,36 @@ def main(config_file):
 
         # pkl Dump
         logging.info('Saving Adenine results...')
-        if use_compression:
-            with gzip.open(os.path.join(outfolder, outfile + '.pkl.tz'),
-                           'wb') as out:
-                pkl.dump(pipes_dump, out)
-            logging.info("Dump : %s", os.path.join(outfolder, outfile + '.pkl.tz'))
+        # arrays shared among steps and pipelines are stored only once; the
+        # codec is in the name (and in the header) of the files
+        codec = compression.get_codec(config.compression)
+        suffix = '.pkl' + ('.' + codec if codec else '')
+        dumpfile = os.path.join(outfolder, outfile + suffix)
+        # the data of the streamed pipelines are copied from their .npy file
+        # without being loaded into memory
+        lazy_bytes = dump.LAZY_BYTES \
+            if config.slim_models or config.chunk_size else None
+        if config.slim_models:
+            dump.save_results(dump.slim_results(pipes_dump), dumpfile,
+                              codec=codec, lazy_bytes=lazy_bytes)
         else:
-            with open(os.path.join(outfolder, outfile + '.pkl'), 'wb') as out:
-                pkl.dump(pipes_dump, out)
-                logging.info("Dump : %s", os.path.join(outfolder, outfile + '.pkl'))
+            dump.save_results(pipes_dump, dumpfile, codec=codec,
+                              lazy_bytes=lazy_bytes)
+        logging.info("Dump : %s", dumpfile)
 
         # Retrieve info from the config file
         _index = config.index if hasattr(config, 'index') \
             else np.arange(X.shape[0])
         _y = config.y if hasattr(config, 'y') else None
-        if use_compression:
-            with gzip.open(os.path.join(outfolder, '__data.pkl.tz'), 'wb') as out:
-                pkl.dump({'X': X, 'y': _y, 'index': _index}, out)
-            logging.info("Dump : %s", os.path.join(outfolder, '__data.pkl.tz'))
-        else:
-            with open(os.path.join(outfolder, '__data.pkl'), 'wb') as out:
-                pkl.dump({'X': X, 'y': _y, 'index': _index}, out)
-            logging.info("Dump : %s", os.path.join(outfolder, '__data.pkl'))
+        datafile = os.path.join(outfolder, '__data' + suffix)
+        dump.save_data(X, _y, _index, datafile, codec=codec,
+                       chunk_size=config.chunk_size or dump.DATA_CHUNK_SIZE)
+        logging.info("Dump : %s", datafile)
+
+        # the settings, feature names, index and labels for ade_analysis,
+        # which then does not need to execute the ade_config file
+        dump.save_metadata(config, X,
+                           os.path.join(outfolder, dump.METADATA_FILE))
 
         # Copy the ade_config just used into the outFolder
         shutil.copy(config_path, os.path.join(outfolder, 'ade_config.py'))
@@ -283,3 +368,15 @@ def main(config_file):
 
         # Move the logging file into the outFolder
         shutil.move(logfile, outfolder)
+
+        if knn_cache is not None:
+            shutil.rmtree(knn_cache, ignore_errors=True)
+
+        if stream_dir is not None:
+            shutil.rmtree(stream_dir, ignore_errors=True)
+
+        if profile_dir is not None:
+            # merge the profiles of all the processes in one report
+            shutil.move(profile_dir, os.path.join(outfolder, 'profiles'))
+            profiling.merge_profiles(
+                'run', os.path.join(outfolder, 'profiles'))
@@ -7,9 +7,52 @@
 # FreeBSD License
 ######################################################################
 
+import os
 import copy
+import shutil
 import logging
+import tempfile
 import numpy as np
+import scipy.sparse
+
+from sklearn.base import clone
+from sklearn.preprocessing import StandardScaler
+
+from adenine.core.define_pipeline import hessian_n_neighbors
+from adenine.core.define_pipeline import make_pipeline
+from adenine.utils.data_source import densify
+from adenine.utils.data_source import iter_chunks
+from adenine.utils.data_source import save_npy
+from adenine.utils.extra import measured
+
+# steps that learn nothing from the data, they can be fitted on any chunk
+STATELESS_STEPS = ('DummyNone', 'Normalizer')
+
+# steps which accept sparse data (in fit and in transform or predict), the
+# other ones are given a dense copy
+SPARSE_STEPS = ('DummyNone', 'Imputer', 'StandardScaler', 'Normalizer',
+                'AdaptivePCA', 'TruncatedSVD', 'KernelPCA',
+                'NystroemKernelPCA', 'Isomap', 'SpectralEmbedding',
+                'BernoulliRBM', 'KMeans', 'MiniBatchKMeans',
+                'AffinityPropagation', 'SpectralClustering')
+
+STREAM_OPTIONS = {'folder': None}
+
+
+def set_stream_folder(folder=None):
+    """Set where the streamed pipelines keep the input of their clustering.
+
+    In streaming mode the data clustered by each pipeline (used afterwards
+    by the analysis) are not loaded into memory, but stored as memory-mapped
+    .npy files in this folder, which must exist until the results are dumped.
+
+    Parameters
+    -----------
+    folder : string, optional, default None
+        The folder. If None, a new temporary folder is created by each
+        pipeline (and left on disk).
+    """
+    STREAM_OPTIONS['folder'] = folder
 
 
 def create(pdef):
@@ -59,10 +102,11 @@ def which_level(label):
         level = 'imputing'
     elif label in ('recenter', 'standardize', 'normalize', 'minmax'):
         level = 'preproc'
-    elif label in ('pca', 'incrementalpca', 'randomizedpca', 'kernelpca',
-                   'isomap', 'lle', 'se', 'mds', 'tsne', 'rbm'):
+    elif label in ('pca', 'incrementalpca', 'randomizedpca', 'truncatedsvd',
+                   'kernelpca', 'nystroemkernelpca', 'isomap', 'lle', 'se', 'mds',
+                   'landmarkmds', 'tsne', 'rbm'):
         level = 'dimred'
-    elif label in ('kmeans', 'ap', 'ms', 'spectral',
+    elif label in ('kmeans', 'minibatchkmeans', 'ap', 'ms', 'spectral',
                    'hierarchical'):
         level = 'clustering'
     else:
@@ -112,7 +156,257 @@ def evaluate(level, step, X):
     return res
 
 
-def pipe_worker(pipe_id, pipe, pipes_dump, X):
+def as_dtype(name, data, dtype):
+    """Cast the floating point output of a step to the working dtype.
+
+    Parameters
+    -----------
+    name : string
+        The step name, used to warn about steps that upcast their input.
+
+    data : array
+        The output of the step.
+
+    dtype : numpy dtype or None
+        The working dtype, if None data are returned as they are.
+    """
+    if dtype is None or not np.issubdtype(data.dtype, np.floating) or \
+            data.dtype == dtype:
+        return data
+    if data.dtype.itemsize > np.dtype(dtype).itemsize:
+        logging.warning("Step %s upcasts its %s input to %s, the output is "
+                        "cast back", name, np.dtype(dtype), data.dtype)
+    return data.astype(dtype)
+
+
+def copy_data(X, dtype=None):
+    """Copy a (dense or sparse) data matrix, optionally casting it."""
+    if scipy.sparse.issparse(X):
+        return X.astype(dtype or X.dtype, copy=True)
+    return np.array(X, dtype=dtype)
+
+
+def shape(X):
+    """Shape of a data matrix as a list (None if it has no shape)."""
+    return list(X.shape) if hasattr(X, 'shape') else None
+
+
+def accepts_sparse(step):
+    """Whether a step accepts sparse data (see SPARSE_STEPS)."""
+    step = getattr(step, 'estimator', step)  # GridSearchCV
+    if type(step).__name__ == 'Imputer' and \
+            step.strategy.lower() in ('nearest_neighbors', 'nn'):
+        return False
+    return type(step).__name__ in SPARSE_STEPS
+
+
+def fit_evaluate(name, level, step, X, telemetry=None):
+    """Fit and evaluate a step, densifying sparse data only if required.
+
+    Sparse data are passed as they are to the steps which accept them (see
+    accepts_sparse). They are converted to a dense array (logging the memory
+    cost) for the other steps, or when the step is a recentering, which
+    would make them dense anyway. Standardization is performed without
+    centering.
+
+    Parameters
+    -----------
+    name : string
+        The step name.
+
+    level : {'imputing', 'preproc', 'dimred', 'clustering', 'None'}
+        The step level.
+
+    step : sklearn-like object
+        The step.
+
+    X : array or sparse matrix, shape : n_samples x n_features
+        The input data matrix.
+
+    telemetry : dictionary, optional, default None
+        If provided, the resources used by the fit and by the evaluation are
+        stored in telemetry['fit'] and telemetry['evaluate'] (see
+        adenine.utils.extra.measured).
+
+    Returns
+    -----------
+    X : array or sparse matrix, shape : n_samples x n_features
+        The input data matrix, as it was used by the step.
+
+    X_next : array
+        The output of the step.
+    """
+    if scipy.sparse.issparse(X) and isinstance(step, StandardScaler) and \
+            step.with_mean:
+        if step.with_std:
+            logging.info("Step %s: sparse data are scaled without centering",
+                         name)
+            step.set_params(with_mean=False)
+        else:
+            X = densify(X, 'Step ' + name)
+    if scipy.sparse.issparse(X) and not accepts_sparse(step):
+        X = densify(X, 'Step ' + name)
+    with measured(telemetry, 'fit'):
+        step.fit(X)
+    with measured(telemetry, 'evaluate'):
+        return X, evaluate(level, step, X)
+
+
+def check_hessian(step):
+    """Set the number of neighbors required by the hessian LLE, if used."""
+    if step.get_params().get('method') == 'hessian':
+        n_components = step.get_params().get('n_components')
+        step.set_params(n_neighbors=hessian_n_neighbors(n_components))
+
+
+def _stream_fit(step, X, chunk_size, dtype=None, n_columns=None):
+    """Fit a step one chunk of rows at a time (through partial_fit).
+
+    If n_columns is provided, only the first n_columns columns of each chunk
+    are used (e.g. for the 2D voronoi tessellation).
+    """
+    chunks = (chunk[:, :n_columns] if n_columns else chunk
+              for chunk in iter_chunks(X, chunk_size, dtype))
+    if hasattr(step, 'partial_fit'):
+        for chunk in chunks:
+            step.partial_fit(chunk)
+    elif type(step).__name__ in STATELESS_STEPS:
+        step.fit(next(chunks))
+    else:
+        raise ValueError("{} does not implement partial_fit, hence it cannot "
+                         "be used in streaming mode"
+                         .format(type(step).__name__))
+    return step
+
+
+def _stream_evaluate(name, level, step, X, chunk_size, filename,
+                     dtype=None):
+    """Transform or predict one chunk of rows at a time.
+
+    Transformed data are written chunk by chunk into a memory-mapped .npy
+    file, while labels are collected in memory.
+    """
+    out, start = None, 0
+    for chunk in iter_chunks(X, chunk_size, dtype):
+        res = step.predict(chunk) if level == 'clustering' \
+            else step.transform(chunk)
+        if out is None:
+            # warn (once) about upcasting steps
+            res = as_dtype(name, res, dtype)
+            if level == 'clustering':
+                out = np.empty((X.shape[0],) + res.shape[1:], dtype=res.dtype)
+            else:
+                out = np.lib.format.open_memmap(
+                    filename, mode='w+', dtype=res.dtype,
+                    shape=(X.shape[0],) + res.shape[1:])
+        out[start:start + res.shape[0]] = res
+        start += res.shape[0]
+    return out
+
+
+def stream_worker(pipe_id, pipe, pipes_dump, X, chunk_size, dtype=None):
+    """Out-of-core pipelines execution.
+
+    Same as pipe_worker, but the data matrix is never loaded into memory as
+    a whole. Each step is fitted with partial_fit on chunks of rows of its
+    input (e.g. StandardScaler, MinMaxScaler, IncrementalPCA,
+    MiniBatchKMeans) and its output is written chunk by chunk into a
+    temporary memory-mapped file, which is the input of the next step. The
+    input of the clustering step is kept on disk as well, in the folder set
+    by set_stream_folder. The pipeline stops at the first failed step, as in
+    pipe_worker.
+
+    Parameters
+    -----------
+    pipe_id : string
+        Pipeline identifier.
+
+    pipe : list of tuples
+        Tuple containing a label and a sklearn Pipeline object.
+
+    pipes_dump : multiprocessing.Manager.dict
+        Dictionary containing the results of the parallel execution.
+
+    X : array-like, shape : n_samples x n_features
+        The input data matrix; any row-sliceable matrix (e.g. a memory-mapped
+        array or a adenine.utils.data_source.RowReader).
+
+    chunk_size : int
+        The number of rows processed at once.
+
+    dtype : numpy dtype, optional, default None
+        If provided, the working dtype of the data and of every intermediate
+        output.
+    """
+    step_dump = dict()
+    tmp_dir = tempfile.mkdtemp(prefix='ade_' + pipe_id + '_')
+    stream_dir = STREAM_OPTIONS['folder']
+    if stream_dir is None:
+        stream_dir = tempfile.mkdtemp(prefix='ade_streamed_')
+        logging.info("Clustered data of %s kept in %s", pipe_id, stream_dir)
+    stream_dir = os.path.join(stream_dir, pipe_id)
+    if not os.path.exists(stream_dir):
+        os.makedirs(stream_dir)
+
+    X_curr = X
+    try:
+        for j, step in enumerate(pipe):
+            step_id = 'step' + str(j)
+            level = step[-1]
+            check_hessian(step[1])
+            telemetry = {'shape_in': shape(X_curr)}
+            try:
+                with measured(telemetry, 'fit'):
+                    _stream_fit(step[1], X_curr, chunk_size, dtype)
+                with measured(telemetry, 'evaluate'):
+                    X_next = _stream_evaluate(
+                        step[0], level, step[1], X_curr, chunk_size,
+                        os.path.join(tmp_dir, step_id + '.npy'), dtype)
+                telemetry['shape_out'] = shape(X_next)
+
+                mdl_voronoi = None
+                if hasattr(step[1], 'cluster_centers_'):
+                    with measured(telemetry, 'voronoi'):
+                        mdl_voronoi = _stream_fit(
+                            clone(step[1]), X_curr, chunk_size, dtype,
+                            n_columns=2)
+
+                if level in ('preproc', 'imputing'):
+                    result = [step[0], level, step[1].get_params(),
+                              np.empty(0), np.empty(0), step[1], mdl_voronoi]
+                    X_curr = X_next
+                elif level == 'dimred':
+                    # the (low dimensional) embedding is kept in memory
+                    X_curr = np.array(X_next)
+                    result = [step[0], level, step[1].get_params(),
+                              X_curr, np.empty(0), step[1], mdl_voronoi]
+                elif level == 'clustering':
+                    # the clustered data are kept on disk (unless it is an
+                    # embedding, already in memory) and dumped from there
+                    if type(X_curr) is np.ndarray:
+                        X_in = np.asarray(X_curr, dtype=dtype)
+                    else:
+                        X_in = save_npy(X_curr, os.path.join(
+                            stream_dir, step_id + '.npy'), chunk_size, dtype)
+                    result = [step[0], level, step[1].get_params(),
+                              X_next, X_in, step[1], mdl_voronoi]
+                if level != 'None':
+                    step_dump[step_id] = result + [telemetry]
+
+            except (AssertionError, ValueError) as e:
+                logging.critical("Pipeline %s failed at step %s. "
+                                 "Traceback: %s", pipe_id, step[0], e)
+                break
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if pipes_dump is None:
+        return step_dump
+
+    pipes_dump[pipe_id] = step_dump
+
+
+def pipe_worker(pipe_id, pipe, pipes_dump, X, chunk_size=None, dtype=None):
     """Parallel pipelines execution.
 
     Parameters
@@ -128,12 +422,23 @@ def pipe_worker(pipe_id, pipe, pipes_dump, X):
 
     X : array of float, shape : n_samples x n_features, default : ()
         The input data matrix.
+
+    chunk_size : int, optional, default None
+        If provided, the pipeline is executed in streaming mode (see
+        stream_worker), processing chunk_size rows at a time.
+
+    dtype : numpy dtype, optional, default None
+        If provided, the working dtype of the data and of every intermediate
+        output (e.g. np.float32); steps that upcast are logged.
     """
+    if chunk_size:
+        return stream_worker(pipe_id, pipe, pipes_dump, X, chunk_size, dtype)
+
     step_dump = dict()
 
     # COPY X as X_curr (to avoid that the next pipeline
     # works on the results of the previuos one)
-    X_curr = np.array(X)
+    X_curr = copy_data(X, dtype)
     for j, step in enumerate(pipe):
         # step[0] -> step_label | step[1] -> model, sklearn (or sklearn-like)
         # object
@@ -141,28 +446,29 @@ def pipe_worker(pipe_id, pipe, pipes_dump, X):
         # 1. define which level of step is this (i.e.: imputing, preproc,
         # dimred, clustering, none)
         level = step[-1]
-        # 2. fit the model (whatever it is)
-        if step[1].get_params().get('method') == 'hessian':
-            # check hessian lle constraints
-            n_components = step[1].get_params().get('n_components')
-            n_neighbors = 1 + (n_components * (n_components + 3) / 2)
-            step[1].set_params(n_neighbors=n_neighbors)
+        # 2. fit the model (whatever it is), checking the hessian lle
+        # constraints
+        check_hessian(step[1])
+        # resources used by the step and shapes of its input and output
+        telemetry = {'shape_in': shape(X_curr)}
         try:
-            step[1].fit(X_curr)
-
-            # 3. evaluate (i.e. transform or predict according to the level)
-            # X_curr = evaluate(level, step[1], X_curr)
-            X_next = evaluate(level, step[1], X_curr)
+            # 3. fit and evaluate (i.e. transform or predict according to the
+            # level)
+            X_curr, X_next = fit_evaluate(step[0], level, step[1], X_curr,
+                                          telemetry)
+            X_next = as_dtype(step[0], X_next, dtype)
+            telemetry['shape_out'] = shape(X_next)
             # 3.1 if the model is suitable for voronoi tessellation: fit also
             # on 2D
             mdl_voronoi = None
             if hasattr(step[1], 'cluster_centers_'):
                 mdl_voronoi = copy.copy(step[1].best_estimator_ if hasattr(
                     step[1], 'best_estimator_') else step[1])
-                if not hasattr(step[1], 'affinity') or step[1].affinity != 'precomputed':
-                    mdl_voronoi.fit(X_curr[:, :2])
-                else:
-                    mdl_voronoi.fit(X_curr)
+                with measured(telemetry, 'voronoi'):
+                    if not hasattr(step[1], 'affinity') or step[1].affinity != 'precomputed':
+                        mdl_voronoi.fit(X_curr[:, :2])
+                    else:
+                        mdl_voronoi.fit(X_curr)
 
             # 4. save the results in a dictionary of dictionaries of the form:
             # save memory and do not dump data after preprocessing (unused in
@@ -170,7 +476,7 @@ def pipe_worker(pipe_id, pipe, pipes_dump, X):
             if level in ('preproc', 'imputing'):
                 result = [step[0], level, step[1].get_params(),
                           np.empty(0), np.empty(0), step[1], mdl_voronoi]
-                X_curr = np.array(X_next)  # update the matrix
+                X_curr = copy_data(X_next)  # update the matrix
 
             # save memory dumping X_curr only in case of clustering
             elif level == 'dimred':
@@ -183,12 +489,13 @@ def pipe_worker(pipe_id, pipe, pipes_dump, X):
                 result = [step[0], level, step[1].get_params(),
                           X_next, X_curr, step[1], mdl_voronoi]
             if level != 'None':
-                step_dump[step_id] = result
+                step_dump[step_id] = result + [telemetry]
 
         except (AssertionError, ValueError) as e:
+            # the next steps would work on stale data
             logging.critical("Pipeline %s failed at step %s. "
                              "Traceback: %s", pipe_id, step[0], e)
-
+            break
 
     # Monkey-patch, see: https://github.com/scikit-learn/scikit-learn/issues/7562
     # and wait for the next numpy update
@@ -198,3 +505,24 @@ def pipe_worker(pipe_id, pipe, pipes_dump, X):
         return step_dump
 
     pipes_dump[pipe_id] = step_dump
+
+
+def spec_worker(pipe_id, spec, pipes_dump, X, chunk_size=None, dtype=None):
+    """Create the estimators of a pipeline specification and run it.
+
+    The estimators are created only by the worker which runs the pipeline
+    (see adenine.core.define_pipeline.make_pipeline); the parameters are the
+    same of pipe_worker, except for spec, the pipeline specification. A
+    pipeline whose estimators cannot be created has no steps in the results.
+    """
+    try:
+        pipe = make_pipeline(spec)
+    except Exception as e:
+        # e.g. invalid parameters: the master still waits for the result
+        logging.critical("Pipeline %s cannot be created. Traceback: %s",
+                         pipe_id, e)
+        if pipes_dump is None:
+            return dict()
+        pipes_dump[pipe_id] = dict()
+        return
+    return pipe_worker(pipe_id, pipe, pipes_dump, X, chunk_size, dtype)
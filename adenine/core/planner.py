@@ -0,0 +1,428 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Pre-flight estimates of the time and memory needed by the pipelines."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+from __future__ import print_function
+
+import heapq
+import logging
+import time
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from adenine.core import define_pipeline
+from adenine.core.pipelines import fit_evaluate
+from adenine.utils.extra import sec_to_time
+
+# operations per second of the cost model, used without calibration
+OPS_PER_SECOND = 1e9
+
+# number of candidates of the GridSearchCV ('auto' n_clusters or preference)
+GRID_SIZE = 30
+
+# number of workers (MPI processes) in the plan summary
+WORKER_COUNTS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _int_param(params, name, default):
+    value = params.get(name)
+    return value if define_pipeline._is_int(value) else default
+
+
+def step_cost(step, level, n_samples, n_features):
+    """Rough cost of a step on data of the given shape.
+
+    The cost model counts the leading terms of the complexity of each
+    algorithm (e.g. n^2 d for the pairwise distances, n^3 for a dense
+    eigendecomposition of a kernel matrix), ignoring the constants: it is
+    meant to rank the pipelines and to spot the ones which would not fit in
+    memory, not to predict their exact running time.
+
+    Parameters
+    -----------
+    step : sklearn-like object
+        The step.
+
+    level : {'imputing', 'preproc', 'dimred', 'clustering'}
+        The step level.
+
+    n_samples : int
+        The number of samples of the input of the step.
+
+    n_features : int
+        The number of features of the input of the step.
+
+    Returns
+    -----------
+    ops : float
+        The number of operations.
+
+    memory : float
+        The number of items of the largest temporary data structures (e.g.
+        n^2 for an affinity matrix).
+
+    n_out : int
+        The number of features of the output of the step.
+    """
+    name = type(step).__name__
+    if name == 'DummyNone':
+        return 0., 0., int(n_features)
+    params = step.get_params(deep=False)
+    n, d = float(n_samples), float(n_features)
+    n_components = _int_param(params, 'n_components', None)
+    n_clusters = _int_param(params, 'n_clusters', 8)
+    log_n = np.log2(max(n, 2.))
+
+    if name == 'GridSearchCV':
+        # each candidate is fitted on every split
+        ops, memory, _ = step_cost(params['estimator'], level, n, d)
+        ops *= GRID_SIZE * (_int_param(params, 'cv', 3) + 1)
+    elif name == 'Imputer':
+        if str(params.get('strategy')).lower() in ('nearest_neighbors', 'nn'):
+            ops, memory = n * n * d, n * d
+        else:
+            ops, memory = n * d, n * d
+    elif name in ('StandardScaler', 'MinMaxScaler', 'Normalizer'):
+        ops, memory = n * d, n * d
+    elif name in ('AdaptivePCA', 'IncrementalPCA', 'PCA'):
+        ops, memory = n * d * min(n, d), n * d
+    elif name in ('RandomizedPCA', 'TruncatedSVD'):
+        ops, memory = 10 * n * d * (n_components or 2), n * d
+    elif name == 'KernelPCA':
+        ops, memory = n * n * d + n ** 3, n * n
+    elif name in ('NystroemKernelPCA', 'LandmarkMDS'):
+        m = min(float(_int_param(params, 'n_landmarks', 500)), n)
+        ops, memory = n * m * d + m ** 3, n * m
+    elif name in ('Isomap', 'AgglomerativeClustering'):
+        ops, memory = n * n * (d + log_n), n * n
+    elif name == 'LocallyLinearEmbedding':
+        k = _int_param(params, 'n_neighbors', 5)
+        ops, memory = n * n * d + n * k ** 3, n * (d + k)
+    elif name in ('SpectralEmbedding', 'SpectralClustering'):
+        ops, memory = n * n * (d + (n_components or n_clusters)), n * n
+    elif name == 'MDS':
+        iters = _int_param(params, 'max_iter', 300) * \
+            _int_param(params, 'n_init', 4)
+        ops, memory = n * n * (d + iters), 3 * n * n
+    elif name == 'TSNE':
+        iters = _int_param(params, 'n_iter', _int_param(
+            params, 'max_iter', 1000))
+        if params.get('method') == 'exact':
+            ops, memory = n * n * (d + iters), n * n
+        else:
+            k = 3 * float(params.get('perplexity', 30)) + 1
+            ops, memory = n * log_n * (d + k * iters), n * (d + k)
+    elif name == 'BernoulliRBM':
+        ops = n * d * (n_components or 256) * _int_param(params, 'n_iter', 10)
+        memory = n * (n_components or 256)
+    elif name == 'KMeans':
+        # n_init runs of a few tens of Lloyd iterations
+        ops = 30 * n * d * n_clusters * _int_param(params, 'n_init', 10)
+        memory = n * d
+    elif name == 'MiniBatchKMeans':
+        ops, memory = 10 * n * d * n_clusters, n * d
+    elif name == 'AffinityPropagation':
+        ops = n * n * (d + _int_param(params, 'max_iter', 200))
+        memory = 3 * n * n  # similarity, responsibility, availability
+    elif name == 'MeanShift':
+        ops, memory = n * n * d, n * d
+    else:
+        ops, memory = n * d, n * d
+
+    if level == 'clustering':
+        n_out = 1
+    elif level == 'dimred':
+        n_out = min(n_components or min(n, d), d)
+    else:
+        n_out = d
+    return ops, memory, int(n_out)
+
+
+def pipeline_cost(pipe, n_samples, n_features, itemsize=8, scales=None):
+    """Estimated time and peak memory of a pipeline.
+
+    Parameters
+    -----------
+    pipe : list of tuples
+        The pipeline (see define_pipeline.make_pipeline).
+
+    n_samples : int
+        The number of samples of the data.
+
+    n_features : int
+        The number of features of the data.
+
+    itemsize : int, optional, default 8
+        The number of bytes of each item of the data.
+
+    scales : list of floats, optional, default None
+        The seconds per operation of each step (see calibrate); if None,
+        1 / OPS_PER_SECOND.
+
+    Returns
+    -----------
+    seconds : float
+        The estimated running time.
+
+    peak_memory : float
+        The estimated peak memory (bytes): the input data, the output of
+        every step (kept for the analysis) and the largest temporary data
+        structure.
+    """
+    seconds, kept, temporary = 0., float(n_samples) * n_features, 0.
+    for i, (_, step, level) in enumerate(pipe):
+        ops, memory, n_out = step_cost(step, level, n_samples, n_features)
+        if level == 'clustering':
+            # the voronoi model, fitted on the first two dimensions
+            ops += step_cost(step, level, n_samples, 2)[0]
+        scale = 1. / OPS_PER_SECOND if scales is None else scales[i]
+        seconds += ops * scale
+        temporary = max(temporary, memory)
+        kept += float(n_samples) * n_out
+        n_features = n_out
+    return seconds, (kept + temporary) * itemsize
+
+
+def calibrate(specs, X, n_samples=500, random_state=0):
+    """Seconds per operation of each step, timed on a random subsample.
+
+    Each step is fitted and evaluated on the output of the previous steps
+    on the subsample (the prefixes shared by several pipelines are run only
+    once); its time is divided by its cost on the subsample (see step_cost).
+
+    Parameters
+    -----------
+    specs : list of list of tuples
+        The pipeline specifications (see define_pipeline.iter_pipelines).
+
+    X : array of float, shape : n_samples x n_features
+        The input data matrix.
+
+    n_samples : int, optional, default 500
+        The number of samples of the subsample.
+
+    random_state : int, optional, default 0
+        The seed of the subsample.
+
+    Returns
+    -----------
+    scales : list of lists of floats
+        For each pipeline, the seconds per operation of each step, None if
+        the pipeline failed on the subsample.
+
+    errors : list of strings
+        For each pipeline, the error raised on the subsample (or None).
+    """
+    rng = np.random.RandomState(random_state)
+    idx = np.sort(rng.choice(X.shape[0], min(n_samples, X.shape[0]),
+                             replace=False))
+    X_sub = X[idx]
+    default = 1. / OPS_PER_SECOND
+
+    prefixes = dict()  # pipeline prefix -> (output, scale, error)
+    scales, errors = [], []
+    for spec in specs:
+        X_curr, pipe_scales, error = X_sub, [], None
+        for i, (step_key, content, level) in enumerate(spec):
+            key = define_pipeline.spec_key(spec[:i + 1]) + (i,)
+            if key not in prefixes:
+                name = define_pipeline.step_name(step_key)
+                try:
+                    # the estimator is created here, so that invalid
+                    # parameters are reported as a failure
+                    name, step, _ = define_pipeline.PARSERS[level](
+                        step_key, dict(content))
+                    tic = time.time()
+                    X_next = fit_evaluate(name, level, step, X_curr)[1]
+                except Exception as exc:
+                    prefixes[key] = (None, None, "{}: {}".format(name, exc))
+                else:
+                    ops = step_cost(step, level, *X_curr.shape)[0]
+                    prefixes[key] = (X_next, (time.time() - tic) / ops
+                                     if ops > 0 else default, None)
+            X_curr, scale, error = prefixes[key]
+            if error is not None:
+                break
+            pipe_scales.append(scale)
+        scales.append(pipe_scales if error is None else None)
+        errors.append(error)
+    return scales, errors
+
+
+def makespan(seconds, n_workers):
+    """Time to run jobs of the given durations on n_workers workers.
+
+    The jobs are assigned longest first to the least loaded worker, as the
+    MPI master does with its queue.
+    """
+    loads = [0.] * n_workers
+    for job in sorted(seconds, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + job)
+    return max(loads)
+
+
+def _size(n_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n_bytes < 1024:
+            return "{:.1f} {}".format(n_bytes, unit)
+        n_bytes /= 1024.
+    return "{:.1f} TB".format(n_bytes)
+
+
+def make_plan(steps, X, calibration_samples=None, max_n_pipes=None):
+    """Expand the grid of pipelines and estimate their cost.
+
+    Parameters
+    -----------
+    steps : list of dictionaries
+        The steps of the ade_config file (see define_pipeline.iter_grid).
+
+    X : array of float, shape : n_samples x n_features
+        The input data matrix.
+
+    calibration_samples : int, optional, default None
+        If provided, the cost model is calibrated by timing each step on a
+        subsample of this size.
+
+    max_n_pipes : int, optional, default None
+        The number of pipelines run by ade_run, define_pipeline.MAX_N_PIPES
+        if None.
+
+    Returns
+    -----------
+    plan : pandas.DataFrame
+        One row for each pipeline of the grid, with its steps, its status
+        (run, duplicate of another pipeline, invalid, beyond max_n_pipes,
+        failed to be created or on the calibration subsample), and its
+        estimated time and peak memory.
+    """
+    max_n_pipes = max_n_pipes or define_pipeline.MAX_N_PIPES
+    n_samples, n_features = X.shape
+    itemsize = getattr(X, 'dtype', np.dtype(float)).itemsize
+
+    # the pipelines are numbered as ade_run does, skipping the invalid and
+    # duplicate ones
+    rows, valid = [], []
+    for spec, reason in define_pipeline.iter_grid(steps, n_samples,
+                                                  n_features):
+        row = {'pipe_id': '', 'pipeline': define_pipeline.describe(spec),
+               'status': reason}
+        if reason is None:
+            row['pipe_id'] = 'pipe' + str(len(valid))
+            row['status'] = 'run' if len(valid) < max_n_pipes else \
+                'skipped (max_n_pipes = {})'.format(max_n_pipes)
+            valid.append((row, spec))
+        rows.append(row)
+    valid = [(row, spec) for row, spec in valid if row['status'] == 'run']
+
+    if calibration_samples:
+        logging.info("Calibrating the cost model on %d samples",
+                     calibration_samples)
+        scales, errors = calibrate([spec for _, spec in valid], X,
+                                   calibration_samples)
+    else:
+        scales, errors = [None] * len(valid), [None] * len(valid)
+    for (row, spec), scale, error in zip(valid, scales, errors):
+        if error is not None:
+            row['status'] = 'failed on the subsample: ' + error
+        try:
+            pipe = define_pipeline.make_pipeline(spec)
+        except Exception as exc:
+            if error is None:
+                row['status'] = 'failed: {}'.format(exc)
+            continue
+        row['time'], row['peak_memory'] = pipeline_cost(
+            pipe, n_samples, n_features, itemsize, scale)
+
+    return pd.DataFrame(rows, columns=['pipe_id', 'pipeline', 'status',
+                                       'time', 'peak_memory'])
+
+
+def print_plan(plan, n_samples, n_features, output=None):
+    """Print the plan, with its totals for different numbers of workers.
+
+    Only the pipelines which ade_run would run (or which failed on the
+    subsample) are listed, the others (duplicate, invalid, beyond
+    max_n_pipes) are only counted; the output file has all of them.
+
+    Parameters
+    -----------
+    plan : pandas.DataFrame
+        The plan, as returned by make_plan.
+
+    n_samples : int
+        The number of samples of the data.
+
+    n_features : int
+        The number of features of the data.
+
+    output : string, optional, default None
+        If provided, the plan is also written to this csv file.
+    """
+    if output is not None:
+        plan.to_csv(output, index=False)
+
+    run = plan[plan.status == 'run']
+    table = plan[(plan.status == 'run') |
+                 plan.status.str.startswith('failed')].fillna('').copy()
+    table['time'] = [sec_to_time(t) if t != '' else '' for t in table.time]
+    table['peak_memory'] = [_size(m) if m != '' else ''
+                            for m in table.peak_memory]
+    table = table.to_string(index=False) if not table.empty else ''
+    width = max([len(line) for line in table.splitlines()] + [60])
+    print("-" * width)
+    print("Adenine: plan of {} pipelines on {} samples x {} features".format(
+        len(plan), n_samples, n_features))
+    print("-" * width)
+    if table:
+        print(table)
+        print("-" * width)
+    print("{} pipelines to run, {} duplicates, {} invalid, {} skipped, "
+          "{} failed".format(
+              len(run), plan.status.str.startswith('duplicate').sum(),
+              plan.status.str.startswith('invalid').sum(),
+              plan.status.str.startswith('skipped').sum(),
+              plan.status.str.startswith('failed').sum()))
+    if output is not None:
+        print("The full plan is written to {}".format(output))
+    if run.empty:
+        return
+
+    print("\nMPI workers  time      peak memory per worker")
+    peak = run.peak_memory.max()
+    for n_workers in WORKER_COUNTS:
+        print("{:>11d}  {}  {}".format(n_workers, sec_to_time(
+            makespan(run.time, n_workers)), _size(peak)))
+    # without MPI, every pipeline is a process started at once
+    print("\nSingle machine ({} CPUs, all the pipelines at once): {}, "
+          "peak memory {}".format(mp.cpu_count(), sec_to_time(
+              makespan(run.time, mp.cpu_count())),
+              _size(run.peak_memory.sum())))
+
+
+def main(config_file, calibration_samples=None, output=None):
+    """Print the plan of the pipelines of an ade_config file.
+
+    Parameters
+    -----------
+    config_file : string
+        The path of the ade_config file.
+
+    calibration_samples : int, optional, default None
+        If provided, the cost model is calibrated on a subsample of this size.
+
+    output : string, optional, default None
+        If provided, the plan is also written to this csv file.
+    """
+    from adenine.core.job_distribution import load_config
+    config = load_config(config_file)
+    plan = make_plan([config.step0, config.step1, config.step2, config.step3],
+                     config.X, calibration_samples)
+    print_plan(plan, config.X.shape[0], config.X.shape[1], output)
+    return plan
@@ -10,13 +10,16 @@
 
 import os
 import logging
+import tempfile
+import subprocess
 # import cPickle as pkl
 import numpy as np
 import scipy as sp
+import scipy.sparse
+from scipy.sparse.linalg import eigsh, ArpackNoConvergence
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns; sns.set(font="monospace")
-import time
 from sklearn import metrics
 # Legacy import
 try:
@@ -384,66 +387,67 @@ def tree(root, data_in, labels=None, index=None, model=None):
         be a clustering model provided with the clusters_centers_ attribute
         (e.g. KMeans).
     """
-    # see http://stackoverflow.com/questions/27386641/how-to-traverse-a-tree-from-sklearn-agglomerativeclustering
-    # ii = itertools.count(X.shape[0])
-    # [{'node_id': next(ii), 'left': x[0], 'right':x[1]} for x in model.children_]
-    aa = []
-    for ii, x in enumerate(model.children_):
-        ii += data_in.shape[0]
-        aa.append([ii, x[0]])
-        aa.append([ii, x[1]])
-    aa.append([None, ii])
-    aa = np.array(aa)
-    df = pd.DataFrame(aa).rename(columns=dict(zip(range(2), ['parent', 'name'])))
-    # write sample names in the leaves
-    lookup_table = dict(zip(np.arange(data_in.shape[0], dtype=float), index))
-    df = df.applymap(lambda x: lookup_table.get(x, False) or float(x) if x is not None else x)
-    table_filename = "/tmp/table{}.csv".format(time.time())
-    df.to_csv(table_filename, index=False)
-    
+    n_samples = data_in.shape[0]
+    children = np.asarray(model.children_, dtype=np.intp)
+    if index is None:
+        index = np.arange(n_samples)
+
+    # node names: sample identifiers for the leaves, merge ids for the others
+    names = np.concatenate((np.asarray(index).astype(str),
+                            np.arange(n_samples, n_samples +
+                                      children.shape[0]).astype(str)))
+    parents = np.repeat(np.arange(n_samples,
+                                  n_samples + children.shape[0]), 2)
+    df = pd.DataFrame({'parent': np.append(names[parents], ''),
+                       'name': np.append(names[children.ravel()],
+                                         names[-1])},
+                      columns=['parent', 'name'])
+
+    # the table lives next to the html page that loads it
+    basename = os.path.join(root, os.path.basename(root) + '_tree')
+    df.to_csv(basename + '.csv', index=False)
+
     # now it can be loaded to generate a D3.js tree
-    with open(os.path.join(root, os.path.basename(root) + '_tree.html'), 'w') as f:
+    with open(basename + '.html', 'w') as f:
         svg_crowbar_path = os.path.join(adenine.__path__[0], 'core', 'template', 'svg-crowbar.js')
-        f.write(D3_TREE % ("'%s'" % svg_crowbar_path, '"%s"' % table_filename))
+        f.write(D3_TREE % ("'%s'" % svg_crowbar_path,
+                           '"%s"' % os.path.basename(basename + '.csv')))
 
-    filename = os.path.join(root, os.path.basename(root) + '_tree.pdf')
+    # stream the DOT description of the tree, then let graphviz render it
+    if labels is None:
+        fillcolors = np.array(['white'] * n_samples)
+    else:
+        _, codes = np.unique(labels, return_inverse=True)
+        palette = Palette('hls', n_colors=codes.max() + 1)
+        fillcolors = np.array(palette.palette.as_hex())[codes]
+    fillcolors = np.append(fillcolors, ['white'] * children.shape[0])
+
+    quoted = np.char.add(np.char.add(
+        '"', np.char.replace(names, '"', r'\"')), '"')
+    filename = basename + '.pdf'
+    dotfile = None
     try:
-        import itertools
-        import pydot
-        graph = pydot.Dot(graph_type='graph')
-
-        if labels is None:
-            labels = np.zeros(1, dtype=np.short)
-            palette = Palette('hls', n_colors=np.unique(labels).shape[0])
-            palette.palette[0] = (1.0, 1.0, 1.0)
-        else:
-            palette = Palette('hls', n_colors=np.unique(labels).shape[0])
-
-        colors = dict(
-            zip(np.unique(labels), np.arange(np.unique(labels).shape[0])))
-        ii = itertools.count(data_in.shape[0])
-        for _, x in enumerate(model.children_):
-            root_node = next(ii)
-            fillcolor = (lambda _:
-                         palette.palette.as_hex()[colors[labels[x[_]]]]
-                         if x[_] < labels.shape[0] else 'white')
-            left_node = pydot.Node(
-                str(index[x[0]] if x[0] < len(index) else x[0]),
-                style="filled", fillcolor=fillcolor(0))
-            right_node = pydot.Node(
-                str(index[x[1]] if x[1] < len(index) else x[1]),
-                style="filled", fillcolor=fillcolor(1))
-
-            graph.add_node(left_node)
-            graph.add_node(right_node)
-            graph.add_edge(pydot.Edge(root_node, left_node))
-            graph.add_edge(pydot.Edge(root_node, right_node))
-
-        # graph.write_png(filename[:-2]+"ng")
-        graph.write_pdf(filename)
+        # a temporary file, only graphviz reads it
+        with tempfile.NamedTemporaryFile('w', suffix='.dot', dir=root,
+                                         delete=False) as f:
+            dotfile = f.name
+            f.write('graph G {\n')
+            f.writelines('%s [style="filled", fillcolor="%s"];\n' % x
+                         for x in zip(quoted[children.ravel()],
+                                      fillcolors[children.ravel()]))
+            f.writelines('%s -- %s;\n' % x
+                         for x in zip(quoted[parents],
+                                      quoted[children.ravel()]))
+            f.write('}\n')
+
+        if subprocess.call(['dot', '-Tpdf', dotfile, '-o', filename]) != 0:
+            raise OSError('graphviz returned a non-zero exit status')
         logging.info('Figure saved %s', filename)
-    except StandardError as e:
+    except (OSError, IOError) as e:
         logging.critical('Cannot create %s. tb: %s', filename, e)
+    finally:
+        if dotfile is not None and os.path.exists(dotfile):
+            os.remove(dotfile)
 
 
 def dendrogram(root, data_in, labels=None, index=None, model=None, n_max=150):
@@ -476,47 +480,93 @@ def dendrogram(root, data_in, labels=None, index=None, model=None, n_max=150):
         be a clustering model provided with the clusters_centers_ attribute
         (e.g. KMeans).
 
-    n_max : int, (INACTIVE)
-        The maximum number of samples to include in the dendrogram.
-        When the number of samples is bigger than n_max, only n_max samples
-        randomly extracted from the dataset are represented. The random
-        extraction is performed using
+    n_max : int, optional, default 150
+        The maximum number of rows to include in the dendrogram.
+        When the number of samples is bigger than n_max and the model carries
+        a complete tree, the fitted tree is cut at its top n_max - 1 merges
+        and each resulting group of samples is represented by its average.
+        Otherwise, only n_max samples randomly extracted from the dataset are
+        represented. The random extraction is performed using
         sklearn.model_selection.StratifiedShuffleSplit
         (or sklearn.cross_validation.StratifiedShuffleSplit for legacy
         reasons).
     """
-    # define col names
-    col = ["$x_{" + str(i) + "}$" for i in np.arange(0, data_in.shape[1], 1)]
-    df = pd.DataFrame(data=data_in, columns=col, index=index)
+    n_samples = data_in.shape[0]
+    precomputed = model.affinity == 'precomputed'
+    if index is None:
+        index = np.arange(n_samples)
+    index = np.asarray(index)
 
     # -- Code for row colors adapted from:
     # https://stanford.edu/~mwaskom/software/seaborn/examples/structured_heatmap.html
     # Create a custom palette to identify the classes
     if labels is None:
-        labels = np.zeros(df.shape[0], dtype=np.short)
+        labels = np.zeros(n_samples, dtype=np.short)
     else:
-        mapping = dict(
-            zip(np.unique(labels), np.arange(np.unique(labels).shape[0])))
-        labels = np.vectorize(mapping.get)(labels)
+        labels = np.unique(labels, return_inverse=True)[1]
+
+    # Reuse the merges already computed by the model
+    Z = _fitted_linkage(model, n_samples) if hasattr(model, 'children_') \
+        else None
+    if n_samples > n_max and Z is not None:
+        group, top_children = _cut_tree(model.children_, n_samples, n_max)
+        Z = _linkage_matrix(top_children, Z[n_samples - n_max:, 2], n_max)
+        sizes = np.bincount(group, minlength=n_max)
+
+        data_in = _group_mean(data_in, group, sizes)
+        if precomputed:
+            data_in = _group_mean(data_in.T, group, sizes).T
+        # each group is named after its first sample and coloured according
+        # to its most frequent label
+        first = np.full(n_max, n_samples, dtype=np.intp)
+        np.minimum.at(first, group, np.arange(n_samples))
+        index = np.array(['{} (+{})'.format(i, s - 1) if s > 1 else str(i)
+                          for i, s in zip(index[first], sizes)])
+        counts = np.bincount(group * (labels.max() + 1) + labels,
+                             minlength=n_max * (labels.max() + 1))
+        labels = counts.reshape(n_max, -1).argmax(axis=1)
+        logging.info('Dendrogram of %d samples aggregated in %d groups',
+                     n_samples, n_max)
+    elif n_samples > n_max:
+        try:  # Legacy for sklearn
+            sss = StratifiedShuffleSplit(labels, test_size=n_max, n_iter=1)
+        except TypeError:
+            sss = StratifiedShuffleSplit(test_size=n_max) \
+                .split(data_in, labels)
+        _, idx = list(sss)[0]
+        idx.sort()
+        data_in, labels, index = data_in[idx], labels[idx], index[idx]
+        if precomputed:
+            data_in = data_in[:, idx]
+        Z = None
+        logging.info('Dendrogram of %d samples randomly extracted from %d',
+                     n_max, n_samples)
+
+    # define col names
+    col = ["$x_{" + str(i) + "}$" for i in np.arange(0, data_in.shape[1], 1)]
+    df = pd.DataFrame(data=data_in, columns=col, index=index)
 
     n_colors = np.unique(labels).shape[0]
     custom_pal = sns.color_palette("hls", n_colors)
-    custom_lut = dict(zip(map(str, range(n_colors)), custom_pal))
+    custom_lut = dict(zip(map(str, np.unique(labels)), custom_pal))
 
     # Convert the palette to vectors that will be drawn on the matrix side
-    custom_colors = pd.Series(map(str, labels)).map(custom_lut)
+    custom_colors = pd.Series(list(map(str, labels)),
+                              index=df.index).map(custom_lut)
 
     # Create a custom colormap for the heatmap values
     cmap = sns.diverging_palette(220, 20, n=7, as_cmap=True)
 
-    if model.affinity == 'precomputed':
-        import scipy.spatial.distance as ssd
-        from scipy.cluster.hierarchy import linkage
-        # convert the redundant square matrix into a condensed one.
-        # Even if the docs of scipy said so, linkage function does not
-        # understand that the matrix is precomputed, unless it is 1-dimensional
-        Z = linkage(ssd.squareform(data_in), method=model.linkage,
-                    metric='euclidean')
+    if precomputed:
+        if Z is None:
+            import scipy.spatial.distance as ssd
+            from scipy.cluster.hierarchy import linkage
+            # convert the redundant square matrix into a condensed one.
+            # Even if the docs of scipy said so, linkage function does not
+            # understand that the matrix is precomputed, unless it is
+            # 1-dimensional
+            Z = linkage(ssd.squareform(data_in, checks=False),
+                        method=model.linkage, metric='euclidean')
         g = sns.clustermap(
             df, method=model.linkage, row_linkage=Z, col_linkage=Z,
             linewidths=.5, cmap=cmap)
@@ -527,7 +577,8 @@ def dendrogram(root, data_in, labels=None, index=None, model=None, n_max=150):
             model.affinity = 'cityblock'
 
         g = sns.clustermap(df, method=model.linkage, metric=model.affinity,
-                           row_colors=custom_colors, linewidths=.5, cmap=cmap)
+                           row_linkage=Z, row_colors=custom_colors,
+                           linewidths=.5, cmap=cmap)
 
     plt.setp(g.ax_heatmap.yaxis.get_majorticklabels(), rotation=0, fontsize=5)
     filename = os.path.join(root, os.path.basename(root) +
@@ -537,6 +588,67 @@ def dendrogram(root, data_in, labels=None, index=None, model=None, n_max=150):
     plt.close()
 
 
+def _linkage_matrix(children, distances, n_leaves):
+    """Build a scipy linkage matrix from the merges of a tree."""
+    children = np.asarray(children, dtype=np.intp)
+    sizes = np.ones(n_leaves + children.shape[0])
+    for i, (left, right) in enumerate(children):
+        sizes[n_leaves + i] = sizes[left] + sizes[right]
+    return np.column_stack((children, distances,
+                            sizes[n_leaves:])).astype(np.float64)
+
+
+def _fitted_linkage(model, n_samples):
+    """Get the linkage matrix of a fitted hierarchical model.
+
+    The merge distances are used if the model stores them, otherwise the
+    merge order is used as height. None is returned if the tree of the
+    model is not complete.
+    """
+    children = np.asarray(model.children_)
+    if children.shape[0] != n_samples - 1:
+        return None
+    distances = getattr(model, 'distances_', getattr(model, 'distances', None))
+    if distances is None:
+        distances = np.arange(1, n_samples, dtype=np.float64)
+    return _linkage_matrix(children, distances, n_samples)
+
+
+def _cut_tree(children, n_leaves, n_groups):
+    """Cut a complete tree keeping only its top n_groups - 1 merges.
+
+    Returns
+    -----------
+    group : array of int, shape : n_leaves
+        The group (i.e. the subtree below the cut) of each leaf.
+
+    top_children : array of int, shape : (n_groups - 1, 2)
+        The top merges, where the groups are the leaves of the new tree.
+    """
+    children = np.asarray(children, dtype=np.intp)
+    cut = 2 * n_leaves - n_groups
+    top_children = children[n_leaves - n_groups:]
+    heads = np.sort(top_children[top_children < cut])
+
+    relabel = np.empty(2 * n_leaves - 1, dtype=np.intp)
+    relabel[heads] = np.arange(n_groups)
+    relabel[cut:] = np.arange(n_groups, 2 * n_groups - 1)
+
+    # parents always have a higher id than their children
+    group = np.empty(cut, dtype=np.intp)
+    group[heads] = relabel[heads]
+    for node in range(cut - 1, n_leaves - 1, -1):
+        group[children[node - n_leaves]] = group[node]
+    return group[:n_leaves], relabel[top_children]
+
+
+def _group_mean(X, group, sizes):
+    """Average the rows of X that belong to the same group."""
+    out = np.zeros((sizes.shape[0], X.shape[1]))
+    np.add.at(out, group, X)
+    return out / sizes[:, np.newaxis]
+
+
 def pcmagnitude(root, points, title='', ylabel=''):
     """Plot the trend of principal components magnitude.
 
@@ -577,8 +689,8 @@ def eigs(root, affinity, n_clusters=0, title='', ylabel='', normalised=True,
     root : string
         The root path for the output creation.
 
-    affinity : array of float, shape : (n_samples, n_samples)
-        The affinity matrix.
+    affinity : array of float or sparse matrix, shape : (n_samples, n_samples)
+        The affinity matrix. Sparse matrices are never densified.
 
     n_clusters : int, optional
         The number of clusters.
@@ -607,35 +719,9 @@ def eigs(root, affinity, n_clusters=0, title='', ylabel='', normalised=True,
         Normalise the Laplacian matrix as the random walks point of view.
         This should be better suited with unclear data distributions.
     """
-    # Efficient way to extract the main diagonal from a sparse matrix
-    if isinstance(affinity, sp.sparse.csr.csr_matrix):
-        dd = affinity.diagonal()
-    else:  # or from a dense one
-        dd = np.diag(affinity)
-    W = affinity - np.diag(dd)
-    D = np.diag([np.sum(x) for x in W])
-    laplacian = D - W
-
-    if rw:
-        # compute normalised laplacian as random walks. Better with unclear
-        # distributions
-        aux = np.diag(1. / np.array([np.sum(x) for x in W]))
-        laplacian = np.eye(laplacian.shape[0]) - np.dot(aux, W)
-    elif normalised:
-        # Compute the normalised Laplacian
-        # aux = np.linalg.inv(np.diag([np.sqrt(np.sum(x)) for x in W]))
-        aux = np.diag(1. / np.array([np.sqrt(np.sum(x)) for x in W]))
-        laplacian = np.eye(laplacian.shape[0]) - (np.dot(np.dot(aux, W), aux))
-
-    # TODO: replace the previous manual laplacian creation with sklearn utils.
-    # Performance gain and np.allclose checks already performed with success.
-    # from sklearn.utils import graph
-    # laplacian = graph.graph_laplacian(affinity, normed=normalised)
-    # warn: RW is not implemented in sklearn
-
     try:
-        w = np.linalg.eigvals(laplacian)
-        w = np.array(sorted(np.abs(w)))
+        w = _laplacian_spectrum(affinity, n_components=n_components,
+                                normalised=normalised or rw)
         plt.plot(np.arange(1, len(w) + 1), w, '-o',
                  label='eigenvalues (sorted' +
                        (' and normalised rw)' if rw else
@@ -659,8 +745,80 @@ def eigs(root, affinity, n_clusters=0, title='', ylabel='', normalised=True,
             filename = os.path.join(root, os.path.basename(root) +
                                     "_eigenvals." + DEFAULT_EXT)
         plt.savefig(filename)
-    except np.linalg.LinAlgError:
+    except (np.linalg.LinAlgError, ArpackNoConvergence):
         logging.critical("Error in plot_eigs: Affinity matrix contained "
                          "negative values. You can try by specifying "
                          "normalised=False")
     plt.close()
+
+
+def _laplacian_spectrum(affinity, n_components=20, normalised=True):
+    """Compute the smallest eigenvalues of the graph Laplacian.
+
+    The Laplacian is never built explicitly. Sparse affinities stay sparse,
+    the degree scaling is applied with vectors and only the first
+    n_components eigenvalues are computed with the Lanczos solver of ARPACK.
+    The random walks Laplacian I - D^-1 W is similar to the normalised
+    Laplacian I - D^-1/2 W D^-1/2, hence they share the same spectrum.
+
+    Parameters
+    -----------
+    affinity : array of float or sparse matrix, shape : (n_samples, n_samples)
+        The (symmetric) affinity matrix.
+
+    n_components : int, optional, default 20
+        The number of eigenvalues to compute.
+
+    normalised : boolean, optional, default True
+        Choose whether to normalise the Laplacian matrix.
+
+    Returns
+    -----------
+    w : array of float, shape : n_components
+        The smallest eigenvalues of the Laplacian (in absolute value), sorted.
+    """
+    if sp.sparse.issparse(affinity):
+        W = sp.sparse.csr_matrix(affinity, dtype=np.float64, copy=True)
+        W.setdiag(0)
+        W.eliminate_zeros()
+        degree = np.asarray(W.sum(axis=1)).ravel()
+    else:
+        W = np.array(affinity, dtype=np.float64)
+        np.fill_diagonal(W, 0)
+        degree = W.sum(axis=1)
+
+    if normalised and (degree < 0).any():
+        raise np.linalg.LinAlgError("negative degrees in the affinity matrix")
+
+    n_samples = W.shape[0]
+    k = min(n_components, n_samples)
+
+    if normalised:
+        # isolated nodes have zero degree: leave them out of the scaling
+        d_inv_sqrt = np.zeros_like(degree)
+        d_inv_sqrt[degree > 0] = 1. / np.sqrt(degree[degree > 0])
+        if sp.sparse.issparse(W):
+            M = sp.sparse.diags(d_inv_sqrt).dot(W).dot(
+                sp.sparse.diags(d_inv_sqrt))
+        else:
+            M = W * d_inv_sqrt[:, np.newaxis] * d_inv_sqrt[np.newaxis, :]
+        # the smallest eigenvalues of I - M are 1 - the largest of M
+        shift = 1.
+    else:
+        # shift the spectrum of D - W by its Gershgorin bound, so that the
+        # smallest eigenvalues of the Laplacian become the largest ones
+        shift = 2. * max(degree.max(), 0) if n_samples > 0 else 0.
+        if sp.sparse.issparse(W):
+            M = sp.sparse.diags(shift - degree).tocsr() + W
+        else:
+            M = W.copy()
+            M[np.diag_indices_from(M)] += shift - degree
+
+    if k < n_samples - 1:
+        mu = eigsh(M, k=k, which='LA', return_eigenvectors=False)
+    else:
+        # ARPACK needs k < n_samples: small problems are solved directly
+        if sp.sparse.issparse(M):
+            M = M.toarray()
+        mu = np.linalg.eigvalsh(M)[::-1][:k]
+    return np.sort(np.abs(shift - mu))
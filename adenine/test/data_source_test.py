@@ -0,0 +1,33 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import numpy as np
+import pandas as pd
+
+from adenine.utils.data_source import _read_csv_chunks
+
+
+def _read(filename, **kwargs):
+    kwargs.setdefault('header', 0)
+    kwargs.setdefault('index_col', 0)
+    columns = pd.read_csv(filename, nrows=0, **kwargs).columns
+    chunks = list(_read_csv_chunks(filename, columns, np.float64, 7, 'auto',
+                                   **kwargs))
+    return np.concatenate([values for _, values in chunks])
+
+
+def test_read_csv_separators(tmpdir):
+    X = np.random.RandomState(0).rand(20, 3)
+    df = pd.DataFrame(X, columns=['a', 'b', 'c'],
+                      index=['s%d' % i for i in range(20)])
+    for sep, kwargs in ((',', {}), ('\t', {'sep': '\t'}),
+                        (' ', {'sep': r'\s+'}), (';', {'sep': None})):
+        filename = str(tmpdir.join('X.csv'))
+        df.to_csv(filename, sep=sep)
+        np.testing.assert_allclose(_read(filename, **kwargs), X)
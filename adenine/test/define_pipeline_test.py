@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+from adenine.core.define_pipeline import check_spec
+from adenine.core.define_pipeline import describe
+from adenine.core.define_pipeline import iter_grid
+
+
+def _spec(dimred, content, clustering='KMeans', n_clusters=3):
+    return [('None', {}, 'imputing'), ('None', {}, 'preproc'),
+            (dimred, dict(content), 'dimred'),
+            (clustering, {'n_clusters': n_clusters}, 'clustering')]
+
+
+def test_check_spec_linear_projections():
+    """Linear projections cannot have more components than features."""
+    for name in ('PCA', 'IncrementalPCA', 'RandomizedPCA', 'TruncatedSVD'):
+        spec = _spec(name, {'n_components': 3})
+        assert check_spec(spec, n_samples=100, n_features=2) is not None
+        assert check_spec(spec, n_samples=100, n_features=3) is None
+        # unknown shape
+        assert check_spec(spec) is None
+
+
+def test_check_spec_nonlinear_embeddings():
+    """Non linear embeddings may have more components than features."""
+    for name, content in (('RBM', {'n_components': 256}),
+                          ('KernelPCA', {'n_components': 3, 'kernel': 'rbf'}),
+                          ('NystroemKernelPCA', {'n_components': 3}),
+                          ('Isomap', {'n_components': 3}),
+                          ('SE', {'n_components': 3}),
+                          ('MDS', {'n_components': 3}),
+                          ('tSNE', {'n_components': 3})):
+        spec = _spec(name, content)
+        assert check_spec(spec, n_samples=100, n_features=2) is None, name
+
+
+def test_check_spec_clusters():
+    spec = _spec('None', {}, n_clusters=20)
+    assert check_spec(spec, n_samples=10, n_features=2) is not None
+    assert check_spec(spec, n_samples=20, n_features=2) is None
+
+
+def test_iter_grid():
+    steps = [{'None': [True], 'Impute': [False]},
+             {'None': [True], 'MinMax': [True]},
+             {'None': [True], 'PCA': [True, {'n_components': [2, 5]}],
+              'RBM': [True, {'n_components': 256}]},
+             {'KMeans': [True, {'n_clusters': [3]}]}]
+    grid = list(iter_grid(steps, n_samples=100, n_features=3))
+    assert len(grid) == 2 * 4
+    status = dict((describe(spec), reason) for spec, reason in grid)
+
+    # PCA with 5 components is invalid on 3 features, RBM is valid
+    invalid = [d for d, r in status.items() if r and r.startswith('invalid')]
+    assert len(invalid) == 2
+    assert all('PCA(n_components=5)' in d for d in invalid)
+    assert sum(r is None and 'RBM' in d for d, r in status.items()) == 2
+
+    # no duplicates here, every valid pipeline is run
+    assert not any(r and r.startswith('duplicate') for r in status.values())
+
+
+def test_iter_grid_duplicates():
+    # the 'None' steps do nothing, whatever their parameters
+    steps = [{'None': [True]}, {'None': [True]},
+             {'None': [True, {'n_components': [2, 3]}]},
+             {'KMeans': [True, {'n_clusters': [3]}]}]
+    grid = list(iter_grid(steps))
+    assert [reason for _, reason in grid] == [None, 'duplicate of pipe0']
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import os
+
+import numpy as np
+
+from adenine.utils import dump
+from adenine.utils.data_source import RowReader
+from adenine.utils.data_source import save_npy
+
+
+def _row_reader(X):
+    # a local closure, which cannot be pickled (as the readers of
+    # data_source.load(..., lazy=True))
+    def read_rows(idx):
+        return X[idx]
+    return RowReader(X.shape, read_rows)
+
+
+def test_save_data_row_reader(tmpdir):
+    """A lazily loaded data matrix is dumped and loaded back."""
+    X = np.random.RandomState(0).rand(2500, 7)
+    y = np.arange(2500) % 3
+    filename = str(tmpdir.join('__data.pkl'))
+    dump.save_data(_row_reader(X), y, np.arange(2500), filename,
+                   chunk_size=1000)
+
+    # the temporary copy of X is removed
+    assert not os.path.exists(filename + '.X.npy')
+    data = dump.load_results(filename)
+    np.testing.assert_array_equal(data['X'], X)
+    np.testing.assert_array_equal(data['y'], y)
+
+
+def test_save_data_array(tmpdir):
+    X = np.random.RandomState(0).rand(30, 4)
+    filename = str(tmpdir.join('__data.pkl'))
+    dump.save_data(X, None, np.arange(30), filename)
+    data = dump.load_results(filename)
+    np.testing.assert_array_equal(data['X'], X)
+    assert data['y'] is None
+
+
+def test_save_results_small_memmap(tmpdir):
+    """Memory-mapped arrays are stored in the dump, not by reference."""
+    X = np.random.RandomState(0).rand(10, 3)
+    npy = str(tmpdir.join('X.npy'))
+    filename = str(tmpdir.join('results.pkl'))
+    dump.save_results({'X': save_npy(X, npy, 4)}, filename)
+    os.remove(npy)
+    np.testing.assert_array_equal(dump.load_results(filename)['X'], X)
+
+
+def test_save_data_row_reader_lazy(tmpdir, monkeypatch):
+    """A large lazily loaded X is saved in its own .npy file."""
+    monkeypatch.setattr(dump, 'LAZY_BYTES', 8192)
+    X = np.random.RandomState(0).rand(500, 7)
+    filename = str(tmpdir.join('__data.pkl'))
+    dump.save_data(_row_reader(X), None, np.arange(500), filename,
+                   chunk_size=100)
+    assert len(os.listdir(str(tmpdir.join(dump.ARRAYS_FOLDER)))) == 1
+    data = dump.load_results(filename)
+    assert isinstance(data['X'], np.memmap)
+    np.testing.assert_array_equal(data['X'], X)
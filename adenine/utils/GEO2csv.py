@@ -9,43 +9,134 @@
 # FreeBSD License
 ######################################################################
 
-import GEOparse
 import logging
 import os
+import numpy as np
 import pandas as pd
 from sklearn import datasets
 from six.moves import filter
 
 
-def get_GEO(accession_number, phenotype_name='title', return_gse=False):
+def _cache_file(cache_dir, accession_number):
+    """The path of the cached dataset of a GEO accession number."""
+    return os.path.join(cache_dir, '{}.npz'.format(accession_number))
+
+
+def _to_cache(filename, data):
+    """Store a dataset bunch in a compact binary file (atomically)."""
+    phenotypes = data.phenotypes.fillna('').astype(str)
+    tmp = filename + '.tmp.npz'
+    np.savez(tmp, data=data.data,
+             index=np.asarray(data.index).astype(str),
+             feature_names=np.asarray(data.feature_names).astype(str),
+             pheno_columns=np.asarray(phenotypes.columns).astype(str),
+             pheno_values=np.asarray(phenotypes.values).astype(str),
+             platform_id=np.asarray(data.platform.index).astype(str),
+             platform_symbol=np.asarray(
+                 data.platform.fillna('').values).astype(str))
+    os.rename(tmp, filename)
+
+
+def _from_cache(filename):
+    """Load a dataset bunch stored by `_to_cache`."""
+    cache = np.load(filename)
+    index = cache['index'].tolist()
+    phenotypes = pd.DataFrame(cache['pheno_values'], index=index,
+                              columns=cache['pheno_columns'].tolist())
+    platform = pd.Series(cache['platform_symbol'], index=cache['platform_id'],
+                         name='GENE_SYMBOL').replace('', np.nan)
+    return datasets.base.Bunch(data=cache['data'], index=index,
+                               feature_names=cache['feature_names'].tolist(),
+                               phenotypes=phenotypes, platform=platform)
+
+
+def platform_annotation(gse):
+    """Get the ID -> GENE_SYMBOL annotation of the platform of a GSE.
+
+    Parameters
+    -----------
+    gse : GEOparse.GEOTypes.GSE
+        the GEOparse object
+
+    Returns
+    -----------
+    platform : pandas.Series
+        the gene symbols, indexed by platform ID (empty if the platform has no
+        GENE_SYMBOL annotation)
+    """
+    table = list(gse.gpls.values())[0].table
+    if 'GENE_SYMBOL' not in table.columns:
+        return pd.Series([], index=[], name='GENE_SYMBOL', dtype=object)
+    return pd.Series(table['GENE_SYMBOL'].values,
+                     index=table['ID'].astype(str).values, name='GENE_SYMBOL')
+
+
+def get_GEO(accession_number, phenotype_name='title', return_gse=False,
+            cache_dir=None, filepath=None):
     """Get the GEO data from its accession number.
 
+    The parsed data matrix, the phenotypes and the platform annotation are
+    stored in cache_dir, in a binary file named after the accession number.
+    Later calls load that file instead of downloading and parsing the SOFT
+    file again.
+
     Parameters
     -----------
     accession_number : string
         'GSEXXXXX' is any GEO accession ID loaded by `GEOparse`.
 
+    phenotype_name : string, optional, default 'title'
+        The phenotype field used as label vector.
+
+    return_gse : boolean, optional, default False
+        Whether to return also the GEOparse object. It is None when the
+        dataset is loaded from the cache.
+
+    cache_dir : string, optional, default None
+        The folder of the GEO cache. If None, no cache is used.
+
+    filepath : string, optional, default None
+        The path of a SOFT file already on disk. If provided, it is parsed
+        without downloading anything (offline mode).
+
     Returns
     -----------
     data : sklearn.datasets.base.Bunch
-        the dataset bunch
+        the dataset bunch, which also carries the phenotypes table and the
+        platform annotation
     gse : GEOparse.GEOTypes.GSE
         the GEOparse object
     """
-    gse = GEOparse.get_GEO(geo=accession_number, destdir=os.curdir,
-                           silent=True, include_data=True,
-                           how='full')
-    xx = gse.pivot_samples('VALUE').transpose()
-    index = xx.index.tolist()
-    feature_names = xx.columns.tolist()
-    yy = gse.phenotype_data[phenotype_name]
-    data = datasets.base.Bunch(data=xx.values, target=yy.values,
-                               feature_names=feature_names,
-                               index=index)
-
+    gse = None
+    cache_file = None if cache_dir is None \
+        else _cache_file(cache_dir, accession_number)
+    if cache_file is not None and os.path.exists(cache_file):
+        data = _from_cache(cache_file)
+        logging.info('%s loaded from %s', accession_number, cache_file)
+    else:
+        import GEOparse
+        if filepath is not None:
+            gse = GEOparse.get_GEO(filepath=filepath, silent=True,
+                                   include_data=True, how='full')
+        else:
+            gse = GEOparse.get_GEO(geo=accession_number, destdir=os.curdir,
+                                   silent=True, include_data=True,
+                                   how='full')
+        xx = gse.pivot_samples('VALUE').transpose()
+        data = datasets.base.Bunch(
+            data=xx.values, index=xx.index.tolist(),
+            feature_names=xx.columns.tolist(),
+            phenotypes=gse.phenotype_data.loc[xx.index],
+            platform=platform_annotation(gse))
+        if cache_file is not None:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            _to_cache(cache_file, data)
+            logging.info('%s cached in %s', accession_number, cache_file)
+    data.target = data.phenotypes[phenotype_name].values
 
     print('* Desired labels can be found with --label_field = ')
-    for k in gse.phenotype_data.keys():
+    for k in data.phenotypes.columns:
         print('\t{}'.format(k))
 
     out = [data]
@@ -128,36 +219,34 @@ def GEO_select_samples(data, labels, selected_labels, index,
     return datasets.base.Bunch(data=X.values, feature_names=X.columns,
                                target=y.values.ravel(), index=X.index.tolist())
 
-def id2gs(data, gse):
+def id2gs(data, gse=None):
     """Convert IDs into GENE_SYMBOL.
 
     Parameters
     -----------
     data : sklearn.datasets.base.Bunch
         the dataset bunch
-    gse : GEOparse.GEOTypes.GSE
-        the GEOparse object
+    gse : GEOparse.GEOTypes.GSE, optional, default None
+        the GEOparse object. If None, the platform annotation stored in
+        data.platform by `get_GEO` is used.
 
     Returns
     -----------
     data : sklearn.datasets.base.Bunch
         where feature_names has the gene symbols
     """
-    # Get the platform name
-    platform = gse.gpls.keys()[0]
-
     # Create the lookup table
-    lookup_table = pd.DataFrame(data=gse.gpls[platform].table['GENE_SYMBOL'].values,
-                                index=gse.gpls[platform].table['ID'].values,
-                                columns=['GENE_SYMBOL'])
-    # Correct NaN failures
-    for i, lt_value in enumerate(lookup_table.values.ravel()):
-        if pd.isnull(lt_value):
-            lookup_table.values[i] = str(lookup_table.index[i])+'__NO-MATCH'
-    gene_symbol = [lookup_table['GENE_SYMBOL'].loc[_id] for _id in data.feature_names]
+    lookup_table = data.platform if gse is None else platform_annotation(gse)
+
+    # Join the feature names with the lookup table and correct NaN failures
+    ids = pd.Index(data.feature_names).astype(str)
+    gene_symbol = pd.Series(lookup_table.reindex(ids).values, index=ids)
+    missing = gene_symbol.isnull().values
+    gene_symbol[missing] = ids[missing] + '__NO-MATCH'
 
     # Make bunch and return
-    return datasets.base.Bunch(data=data.data, feature_names=gene_symbol,
+    return datasets.base.Bunch(data=data.data,
+                               feature_names=gene_symbol.tolist(),
                                target=data.target, index=data.index)
 
 
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Chunked parallel compression of the adenine dumps."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import gzip
+import io
+import logging
+import struct
+import zlib
+import multiprocessing as mp
+
+from collections import deque
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+# header of the compressed files: MAGIC, codec name (padded to 8 bytes)
+MAGIC = b'ADECHNK1'
+GZIP_MAGIC = b'\x1f\x8b'
+
+# uncompressed size of the chunks compressed independently
+CHUNK_SIZE = 2 ** 22
+
+# each frame is: uncompressed size, compressed size, compressed chunk
+FRAME_HEADER = struct.Struct('<QQ')
+
+
+def _codecs():
+    """Available codecs {name: (compress, decompress)}, fastest first."""
+    codecs = OrderedDict()
+    if blosc is not None:
+        # the float arrays are already byte-shuffled (see adenine.utils.dump)
+        codecs['blosc'] = (
+            lambda b: blosc.compress(b, typesize=1, cname='lz4',
+                                     shuffle=blosc.NOSHUFFLE),
+            blosc.decompress)
+    if zstandard is not None:
+        codecs['zstd'] = (
+            lambda b: zstandard.ZstdCompressor(level=3).compress(b),
+            lambda b: zstandard.ZstdDecompressor().decompress(b))
+    if lz4 is not None:
+        codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+    codecs['zlib'] = (lambda b: zlib.compress(b, 1), zlib.decompress)
+    return codecs
+
+CODECS = _codecs()
+
+
+def get_codec(name):
+    """Name of the codec to use.
+
+    Parameters
+    -----------
+    name : string or None
+        One of 'auto' (the fastest available codec), 'blosc', 'zstd', 'lz4',
+        'zlib' (always available) or None (no compression).
+
+    Returns
+    -----------
+    codec : string or None
+        The name of an available codec; 'zlib' if the one requested is not
+        installed.
+    """
+    if name is None:
+        return None
+    name = name.lower()
+    if name == 'auto':
+        return list(CODECS)[0]
+    if name not in CODECS:
+        logging.warning("Compression codec %s not available, falling back "
+                        "to zlib", name)
+        return 'zlib'
+    return name
+
+
+class ChunkedWriter(io.RawIOBase):
+    """Binary file writer compressing chunks of data in parallel."""
+
+    def __init__(self, filename, codec, n_jobs=None):
+        self.codec = codec
+        self._compress = CODECS[codec][0]
+        self._n_jobs = n_jobs or mp.cpu_count()
+        self._pool = ThreadPool(self._n_jobs)
+        self._chunks = []
+        self._size = 0
+        self._fout = open(filename, 'wb')
+        self._fout.write(MAGIC + codec.encode('ascii').ljust(8, b' '))
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._size += len(data)
+        # compress as many chunks as threads at once
+        if self._size >= CHUNK_SIZE * self._n_jobs:
+            self._flush_chunks()
+        return len(data)
+
+    def _flush_chunks(self):
+        data = b''.join(self._chunks)
+        self._chunks, self._size = [], 0
+        chunks = [data[i:i + CHUNK_SIZE]
+                  for i in range(0, len(data), CHUNK_SIZE)]
+        for raw, comp in zip(chunks, self._pool.map(self._compress, chunks)):
+            self._fout.write(FRAME_HEADER.pack(len(raw), len(comp)))
+            self._fout.write(comp)
+
+    def close(self):
+        if not self.closed:
+            self._flush_chunks()
+            self._pool.close()
+            self._fout.close()
+        super(ChunkedWriter, self).close()
+
+
+class ChunkedReader(io.RawIOBase):
+    """Binary file reader decompressing the chunks while they are read.
+
+    The next n_jobs chunks are decompressed in parallel in the background.
+    """
+
+    def __init__(self, filename, n_jobs=None):
+        self._fin = open(filename, 'rb')
+        header = self._fin.read(len(MAGIC) + 8)
+        if header[:len(MAGIC)] != MAGIC:
+            raise IOError("{} is not a chunked compressed file"
+                          .format(filename))
+        self.codec = header[len(MAGIC):].decode('ascii').strip()
+        if self.codec not in CODECS:
+            raise IOError("{} is compressed with {}, which is not installed"
+                          .format(filename, self.codec))
+        self._decompress = CODECS[self.codec][1]
+        self._n_jobs = n_jobs or mp.cpu_count()
+        self._pool = ThreadPool(self._n_jobs)
+        self._pending = deque()
+        self._buffer = b''
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        """Move to the next decompressed chunk; False at the end of file."""
+        while len(self._pending) < self._n_jobs:
+            header = self._fin.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                break
+            comp_size = FRAME_HEADER.unpack(header)[1]
+            self._pending.append(self._pool.apply_async(
+                self._decompress, (self._fin.read(comp_size),)))
+        if not self._pending:
+            return False
+        self._buffer = self._pending.popleft().get()
+        self._pos = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        parts, n_read = [], 0
+        while size < 0 or n_read < size:
+            if self._pos >= len(self._buffer):
+                if not self._next_chunk():
+                    break
+                continue
+            end = len(self._buffer) if size < 0 else \
+                min(len(self._buffer), self._pos + size - n_read)
+            parts.append(self._buffer[self._pos:end])
+            n_read += end - self._pos
+            self._pos = end
+        return b''.join(parts)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        parts, n_read = [], 0
+        while size < 0 or n_read < size:
+            if self._pos >= len(self._buffer):
+                if not self._next_chunk():
+                    break
+            end = self._buffer.find(b'\n', self._pos)
+            end = len(self._buffer) if end < 0 else end + 1
+            if size >= 0:
+                end = min(end, self._pos + size - n_read)
+            parts.append(self._buffer[self._pos:end])
+            n_read += end - self._pos
+            self._pos = end
+            if parts[-1].endswith(b'\n'):
+                break
+        return b''.join(parts)
+
+    def close(self):
+        if not self.closed:
+            self._pool.close()
+            self._fin.close()
+        super(ChunkedReader, self).close()
+
+
+def open_file(filename, mode='rb', codec=None, n_jobs=None):
+    """Open a (possibly compressed) binary file.
+
+    Parameters
+    -----------
+    filename : string
+        The file to open.
+    mode : {'rb', 'wb'}
+        Read or write mode.
+    codec : string, optional, default None
+        Only for mode 'wb', the codec to use (see get_codec); None for an
+        uncompressed file. In mode 'rb' the codec is detected from the file
+        header (gzip files written by older versions are supported too).
+    n_jobs : int, optional, default None
+        The number of chunks (de)compressed in parallel; all the CPUs if
+        None.
+
+    Returns
+    -----------
+    f : file-like object
+    """
+    if mode == 'wb':
+        codec = get_codec(codec)
+        if codec is None:
+            return open(filename, 'wb')
+        return ChunkedWriter(filename, codec, n_jobs)
+
+    with open(filename, 'rb') as f:
+        header = f.read(len(MAGIC))
+    if header == MAGIC:
+        return ChunkedReader(filename, n_jobs)
+    if header[:2] == GZIP_MAGIC:
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
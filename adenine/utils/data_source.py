@@ -13,6 +13,8 @@ import os
 import logging
 import numpy as np
 import pandas as pd
+import scipy.io
+import scipy.sparse
 from sklearn import datasets
 from sklearn.preprocessing import Binarizer
 
@@ -54,11 +56,336 @@ def generate_gauss(mu=None, std=None, n_sample=None):
     return X, y
 
 
-def load_custom(x_filename, y_filename, samples_on='rows', **kwargs):
+def _open(filename):
+    """Open a (possibly compressed) text file in binary mode."""
+    if filename.endswith('.gz'):
+        import gzip
+        return gzip.open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        import bz2
+        return bz2.BZ2File(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _count_lines(filename, buffer_size=1 << 20):
+    """Count the lines of a text file, without parsing it."""
+    n_lines, last = 0, b'\n'
+    with _open(filename) as f:
+        for buf in iter(lambda: f.read(buffer_size), b''):
+            n_lines += buf.count(b'\n')
+            last = buf[-1:]
+    return n_lines + (last != b'\n')
+
+
+def _read_csv_chunks(filename, columns, dtype, chunksize, engine, **kwargs):
+    """Yield (index, values) pairs, reading a csv file chunk by chunk.
+
+    The pyarrow streaming reader is used when engine is 'pyarrow', or when
+    engine is 'auto', pyarrow is installed and kwargs only contain the
+    options it supports (sep, header, index_col), sep being a single
+    character. Otherwise pandas parses the file, with the python engine
+    when the separator is sniffed (sep=None).
+    """
+    header, index_col = kwargs.get('header'), kwargs.get('index_col')
+    sep = kwargs.get('sep', ',')
+    if engine == 'auto':
+        engine = 'c' if sep is not None else 'python'
+        if set(kwargs) <= set(('sep', 'header', 'index_col')) and \
+                isinstance(sep, str) and len(sep) == 1 and \
+                header == 0 and index_col in (0, None):
+            try:
+                import pyarrow.csv  # noqa
+                engine = 'pyarrow'
+            except ImportError:
+                pass
+
+    if engine == 'pyarrow':
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        # the header has already been parsed: rename the columns to avoid
+        # duplicated or empty names
+        skip = 1 if index_col == 0 else 0
+        names = ['__index__'] * skip + \
+            ['c%d' % i for i in range(len(columns))]
+        reader = pacsv.open_csv(
+            filename,
+            read_options=pacsv.ReadOptions(skip_rows=int(header is not None),
+                                           column_names=names),
+            parse_options=pacsv.ParseOptions(delimiter=sep),
+            convert_options=pacsv.ConvertOptions(column_types=dict(
+                (name, pa.from_numpy_dtype(dtype)) for name in names[skip:])))
+        count = 0
+        for batch in reader:
+            values = np.column_stack(
+                [c.to_numpy(zero_copy_only=False)
+                 for c in batch.columns[skip:]]) \
+                if len(columns) else np.empty((batch.num_rows, 0), dtype)
+            if skip:
+                index = batch.column(0).to_numpy(zero_copy_only=False)
+            else:
+                index = np.arange(count, count + batch.num_rows)
+            count += batch.num_rows
+            yield index, values
+    else:
+        for chunk in pd.read_csv(filename, chunksize=chunksize,
+                                 engine=engine, **kwargs):
+            yield chunk.index.values, chunk.values
+
+
+class RowReader(object):
+    """Data matrix stored on disk, whose rows are read only when selected.
+
+    It exposes the shape of the matrix and supports row selection with
+    X[idx] (idx being a sorted array of indexes, or a slice) and
+    np.asarray(X), which reads the whole matrix.
+    """
+
+    def __init__(self, shape, read_rows):
+        self.shape = shape
+        self._read_rows = read_rows
+
+    def __getitem__(self, idx):
+        return self._read_rows(idx)
+
+    def __array__(self, dtype=None):
+        X = self._read_rows(slice(None))
+        return X if dtype is None else X.astype(dtype, copy=False)
+
+
+def iter_chunks(X, chunk_size, dtype=None):
+    """Yield consecutive chunks of rows of a data matrix.
+
+    X can be any row-sliceable matrix, such as a numpy array, a memory-mapped
+    .npy file or a RowReader: only one chunk at a time is read into memory.
+    A last chunk smaller than chunk_size / 2 is merged with the previous one,
+    so that estimators fitted on each chunk always see enough samples.
+
+    Parameters
+    -----------
+    X : array-like, shape : n_samples x n_features
+        The data matrix.
+
+    chunk_size : int
+        The number of rows of each chunk.
+
+    dtype : numpy dtype, optional, default None
+        If provided, the chunks are cast to this dtype.
+    """
+    n_samples = X.shape[0]
+    starts = list(range(0, n_samples, chunk_size))
+    if len(starts) > 1 and n_samples - starts[-1] < chunk_size // 2:
+        starts.pop()
+    for start, end in zip(starts, starts[1:] + [n_samples]):
+        yield np.asarray(X[start:end], dtype=dtype)
+
+
+def open_npy(filename):
+    """Memory-map (read-only) a .npy file."""
+    return np.load(filename, mmap_mode='r')
+
+
+class NpyMemmap(np.memmap):
+    """Memory-mapped .npy file which is pickled by reference.
+
+    Pickling (e.g. to send the results to another process or to dump them)
+    stores only the name of the file, which is memory-mapped again when
+    unpickled and must therefore still exist. Views of a part of the file are
+    pickled as plain arrays.
+    """
+
+    filename_npy = None
+
+    def __reduce__(self):
+        if self.filename_npy is None:
+            return np.array(self).__reduce__()
+        return open_npy, (self.filename_npy,)
+
+
+def save_npy(X, filename, chunk_size, dtype=None):
+    """Write a data matrix into a .npy file, one chunk of rows at a time.
+
+    Parameters
+    -----------
+    X : array-like, shape : n_samples x n_features
+        The data matrix, any row-sliceable matrix (see iter_chunks).
+
+    filename : string
+        The .npy file.
+
+    chunk_size : int
+        The number of rows read into memory at once.
+
+    dtype : numpy dtype, optional, default None
+        If provided, the dtype of the file.
+
+    Returns
+    -----------
+    X_npy : NpyMemmap, shape : n_samples x n_features
+        The (read-only) memory-mapped file.
+    """
+    out, start = None, 0
+    for chunk in iter_chunks(X, chunk_size, dtype):
+        if out is None:
+            out = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=chunk.dtype,
+                shape=(X.shape[0],) + chunk.shape[1:])
+        out[start:start + chunk.shape[0]] = chunk
+        start += chunk.shape[0]
+    out.flush()
+    del out
+    X_npy = open_npy(filename).view(NpyMemmap)
+    X_npy.filename_npy = filename
+    return X_npy
+
+
+def densify(X, name='data'):
+    """Convert a sparse matrix to a dense array, logging its memory cost.
+
+    Parameters
+    -----------
+    X : array or sparse matrix, shape : n_samples x n_features
+        The data matrix, returned as it is if it is not sparse.
+
+    name : string, optional, default 'data'
+        Who requires the dense matrix (e.g. the step name), for the log.
+    """
+    if not scipy.sparse.issparse(X):
+        return X
+    sparse_bytes = sum(getattr(X, attr).nbytes
+                       for attr in ('data', 'indices', 'indptr', 'row', 'col')
+                       if hasattr(X, attr))
+    logging.warning("%s requires dense data: a %d x %d sparse matrix is "
+                    "converted from %.1f MB to %.1f MB", name, X.shape[0],
+                    X.shape[1], sparse_bytes / 2. ** 20,
+                    X.shape[0] * X.shape[1] * X.dtype.itemsize / 2. ** 20)
+    return X.toarray()
+
+
+def _load_labels(y_filename, **kwargs):
+    """Load the label vector from any of the supported file formats."""
+    if y_filename is None:
+        return None
+    if y_filename.endswith('.npy'):
+        return np.load(y_filename)
+    elif y_filename.endswith('.npz'):
+        archive = np.load(y_filename)
+        return archive[archive.files[0]].ravel()
+    # Before loading labels, remove parameters that were likely
+    # specified for data only.
+    kwargs.pop('usecols', None)
+    return pd.read_csv(y_filename, **kwargs).values.ravel()
+
+
+def _load_hdf5(x_filename, key, samples_on, dtype):
+    """Lazily load a data matrix stored as an HDF5 dataset (needs h5py)."""
+    import h5py
+    with h5py.File(x_filename, 'r') as f:
+        if key is None:
+            key = 'X' if 'X' in f else list(f.keys())[0]
+        shape = f[key].shape
+    by_rows = samples_on in ['row', 'rows']
+
+    def read_rows(idx):
+        with h5py.File(x_filename, 'r') as f:
+            X = f[key][idx] if by_rows else f[key][:, idx].T
+        return X.astype(dtype, copy=False)
+
+    return datasets.base.Bunch(
+        data=RowReader(shape if by_rows else shape[::-1], read_rows),
+        feature_names=np.arange(shape[1 if by_rows else 0]))
+
+
+def _load_arrow(x_filename, samples_on, dtype):
+    """Lazily load a data matrix stored in a Parquet or Feather file.
+
+    Only the row groups (samples on rows) or the columns (samples on
+    columns) containing the selected samples are read from disk.
+    """
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    if x_filename.endswith('.feather'):
+        table = feather.read_table(x_filename, memory_map=True)
+        schema, n_rows = table.schema, table.num_rows
+    else:
+        pf = pq.ParquetFile(x_filename)
+        schema, n_rows = pf.schema_arrow, pf.metadata.num_rows
+        bounds = np.cumsum([0] + [pf.metadata.row_group(i).num_rows
+                                  for i in range(pf.num_row_groups)])
+
+    # the pandas index, if stored as a column
+    pandas_index = [c for c in (schema.pandas_metadata or {}).get(
+        'index_columns', []) if not isinstance(c, dict)]
+    if not pandas_index and len(schema) and \
+            str(schema.types[0]) in ('string', 'large_string'):
+        # otherwise, a first column of strings holds the identifiers
+        pandas_index = schema.names[:1]
+    columns = [c for c in schema.names if c not in pandas_index]
+
+    def to_numpy(tbl, names):
+        return np.column_stack(
+            [tbl.column(c).to_numpy().astype(dtype, copy=False)
+             for c in names]) if names else np.empty((tbl.num_rows, 0), dtype)
+
+    def read_table(idx, names):
+        if x_filename.endswith('.feather'):
+            return table.select(names) if isinstance(idx, slice) \
+                else table.select(names).take(idx)
+        if isinstance(idx, slice):
+            return pf.read(columns=names)
+        # read only the row groups that contain the selected rows
+        group_of = np.searchsorted(bounds, idx, side='right') - 1
+        groups = np.unique(group_of)
+        sizes = bounds[groups + 1] - bounds[groups]
+        starts = np.cumsum(sizes) - sizes  # position in the table read
+        local = idx - bounds[group_of] + \
+            starts[np.searchsorted(groups, group_of)]
+        return pf.read_row_groups(groups.tolist(), columns=names).take(local)
+
+    if samples_on in ['row', 'rows']:
+        row_names = read_table(slice(None), pandas_index).column(0) \
+            .to_pylist() if pandas_index else np.arange(n_rows)
+
+        def read_rows(idx):
+            return to_numpy(read_table(idx, columns), columns)
+
+        return datasets.base.Bunch(
+            data=RowReader((n_rows, len(columns)), read_rows),
+            feature_names=columns, index=row_names)
+
+    feature_names = read_table(slice(None), pandas_index).column(0) \
+        .to_pylist() if pandas_index else np.arange(n_rows)
+
+    def read_cols(idx):
+        names = columns[idx] if isinstance(idx, slice) \
+            else [columns[i] for i in idx]
+        return to_numpy(read_table(slice(None), names), names).T
+
+    return datasets.base.Bunch(
+        data=RowReader((len(columns), n_rows), read_cols),
+        feature_names=feature_names, index=columns)
+
+
+def load_custom(x_filename, y_filename, samples_on='rows', dtype=None,
+                chunksize=10000, engine='auto', key=None, **kwargs):
     """Load a custom dataset.
 
     This function loads the data matrix and the label vector returning a
-    unique sklearn-like object dataSetObj.
+    unique sklearn-like object dataSetObj. Supported formats are text files
+    (.csv, .txt), NumPy files (.npy, memory-mapped, and .npz), HDF5 files
+    (.h5, .hdf5, .hdf, requires h5py) and Parquet or Feather files (.parquet,
+    .pq, .feather, requires pyarrow). Memory-mapped, HDF5, Parquet and
+    Feather data are read lazily: when only some samples are selected (see
+    `load`), only their rows are read from disk.
+
+    Sparse matrices are read from scipy .npz files (see scipy.sparse.save_npz)
+    and from Matrix Market files (.mtx, .mtx.gz), and are returned in CSR
+    format.
+
+    Text files are read chunk by chunk straight into a preallocated array of
+    the required dtype. When samples lie on the columns, the file rows are
+    stored as they are read and the data matrix is returned as a
+    (column-major) transposed view, so that no further copy is needed.
 
     Parameters
     -----------
@@ -73,6 +400,22 @@ def load_custom(x_filename, y_filename, samples_on='rows', **kwargs):
         the input data matrix, or viceversa in ['col', 'cols'] the other way
         around.
 
+    dtype : numpy dtype, optional, default None
+        The dtype of the data matrix (e.g. np.float32 to halve the memory
+        footprint). None means np.float64.
+
+    chunksize : int, optional, default 10000
+        The number of lines of the text file parsed at once.
+
+    engine : {'auto', 'pyarrow', 'c', 'python'}, optional, default 'auto'
+        The csv parser. 'auto' uses the pyarrow streaming reader if it is
+        installed and the options are supported, the pandas C parser
+        otherwise.
+
+    key : string, optional, default None
+        The name of the array in .npz files or of the dataset in HDF5 files.
+        If None, 'X' is used if present, the first one otherwise.
+
     kwargs : dict
         Arguments of pandas.read_csv function.
 
@@ -84,47 +427,90 @@ def load_custom(x_filename, y_filename, samples_on='rows', **kwargs):
     """
     if x_filename is None:
         raise IOError("Filename for X must be specified with mode 'custom'.")
+    dtype = np.dtype(np.float64 if dtype is None else dtype)
 
-    if x_filename.endswith('.npy'):  # it an .npy file is provided
+    if x_filename.endswith(('.npy', '.npz', '.mtx', '.mtx.gz')):
         try:  # labels are not mandatory
-            y = np.load(y_filename)
+            y = _load_labels(y_filename, **kwargs)
         except IOError as e:
             y = None
             e.strerror = "No labels file provided"
             logging.error("I/O error({0}): {1}".format(e.errno, e.strerror))
-        X = np.load(x_filename)
+        if x_filename.endswith('.npy'):
+            # memory-mapped: rows are read from disk only when accessed
+            X = np.load(x_filename, mmap_mode='r')
+        elif x_filename.endswith(('.mtx', '.mtx.gz')):
+            X = scipy.sparse.csr_matrix(scipy.io.mmread(x_filename))
+        else:
+            archive = np.load(x_filename)
+            if 'indptr' in archive.files:
+                # saved with scipy.sparse.save_npz
+                X = scipy.sparse.load_npz(x_filename).tocsr()
+            else:
+                key = key or ('X' if 'X' in archive.files
+                              else archive.files[0])
+                X = archive[key]
+                if y is None and 'y' in archive.files:
+                    y = archive['y']
+        if X.dtype != dtype:
+            X = X.astype(dtype)
         if samples_on not in ['row', 'rows']:
             # data matrix must be n_samples x n_features
-            X = X.T
+            X = X.T.tocsr() if scipy.sparse.issparse(X) else X.T
         return datasets.base.Bunch(data=X, target=y,
                                    index=np.arange(X.shape[0]))
 
+    elif x_filename.endswith(('.h5', '.hdf5', '.hdf')):
+        data = _load_hdf5(x_filename, key, samples_on, dtype)
+        data.target = _load_labels(y_filename, **kwargs)
+        data.index = np.arange(data.data.shape[0])
+        return data
+
+    elif x_filename.endswith(('.parquet', '.pq', '.feather')):
+        data = _load_arrow(x_filename, samples_on, dtype)
+        data.target = _load_labels(y_filename, **kwargs)
+        return data
+
     elif x_filename.endswith('.csv') or x_filename.endswith('.txt'):
         y = None
         kwargs.setdefault('header', 0)  # header on first row
         kwargs.setdefault('index_col', 0)  # indexes on first
         try:
-            dfx = pd.read_csv(x_filename, **kwargs)
+            columns = pd.read_csv(x_filename, nrows=0, **kwargs).columns
+            # upper bound of the number of rows, the buffer is trimmed later
+            n_rows = _count_lines(x_filename) - \
+                (0 if kwargs['header'] is None else 1)
+            buf = np.empty((max(n_rows, 0), len(columns)), dtype=dtype)
+
+            count, rows_index = 0, []
+            for index, values in _read_csv_chunks(
+                    x_filename, columns, dtype, chunksize, engine, **kwargs):
+                buf[count:count + values.shape[0]] = values
+                count += values.shape[0]
+                rows_index.append(index)
+            buf = buf[:count]
+            rows_index = np.concatenate(rows_index).tolist() \
+                if rows_index else []
+
             if samples_on not in ['row', 'rows']:
                 # data matrix must be n_samples x n_features
-                dfx = dfx.transpose()
-            if y_filename is not None:
-                # Before loading labels, remove parameters that were likely
-                # specified for data only.
-                kwargs.pop('usecols', None)
-                y = pd.read_csv(y_filename, **kwargs).as_matrix().ravel()
+                X, feature_names, index = buf.T, rows_index, columns.tolist()
+            else:
+                X, feature_names, index = buf, columns.tolist(), rows_index
+
+            y = _load_labels(y_filename, **kwargs)
 
         except IOError as e:
             e.strerror = "Can't open {} or {}".format(x_filename, y_filename)
             logging.error("I/O error({0}): {1}".format(e.errno, e.strerror))
             sys.exit(-1)
 
-        return datasets.base.Bunch(data=dfx.as_matrix(), feature_names=dfx.columns.tolist(),
-                                   target=y, index=dfx.index.tolist())
+        return datasets.base.Bunch(data=X, feature_names=feature_names,
+                                   target=y, index=index)
 
 
 def load(opt='custom', x_filename=None, y_filename=None, n_samples=0,
-         samples_on='rows', **kwargs):
+         samples_on='rows', lazy=False, **kwargs):
     """Load a specified dataset.
 
     This function can be used either to load one of the standard scikit-learn
@@ -139,6 +525,7 @@ def load(opt='custom', x_filename=None, y_filename=None, n_samples=0,
         'boston', 'circles' and 'moons' refer to the correspondent
         `scikit-learn` datasets. 'custom' can be used to load a custom dataset
         which name is specified in `x_filename` and `y_filename` (optional).
+        See `load_custom` for the supported file formats.
 
     x_filename : string, default : None
         The data matrix file name.
@@ -150,15 +537,23 @@ def load(opt='custom', x_filename=None, y_filename=None, n_samples=0,
         The number of samples to be loaded. This comes handy when dealing with
         large datasets. When n_samples is less than the actual size of the
         dataset this function performs a random subsampling that is stratified
-        w.r.t. the labels (if provided).
+        w.r.t. the labels (if provided). For lazily loaded files, only the
+        selected samples are read from disk.
 
     samples_on : string
         This can be either in ['row', 'rows'] if the samples lie on the row of
         the input data matrix, or viceversa in ['col', 'cols'] the other way
         around.
 
-    data_sep : string
-        The data separator. For instance comma, tab, blank space, etc.
+    lazy : boolean, optional, default False
+        If True, memory-mapped, HDF5, Parquet and Feather data are not read
+        into memory, but returned as a row-sliceable object (see
+        `iter_chunks`). Needed by the streaming mode (see `chunk_size` in
+        ade_config).
+
+    kwargs : dict
+        Arguments of load_custom (e.g. dtype, chunksize, engine) and of
+        pandas.read_csv function (e.g. sep, the data separator).
 
     Returns
     -----------
@@ -224,17 +619,23 @@ def load(opt='custom', x_filename=None, y_filename=None, n_samples=0,
                 # idx = np.random.permutation(X.shape[0])[:n_samples]
             except TypeError:
                 sss = StratifiedShuffleSplit(test_size=n_samples) \
-                    .split(X, y)
+                    .split(np.zeros(X.shape[0]), y)
             _, idx = list(sss)[0]
         else:
             idx = np.arange(X.shape[0])
             np.random.shuffle(idx)
             idx = idx[:n_samples]
 
-        X, y = X[idx, :], y[idx]
+        # sorted indexes: lazily loaded data read the selected rows in order
+        idx = np.sort(idx)
+        X = X[idx] if scipy.sparse.issparse(X) else np.asarray(X[idx])
+        if y is not None:
+            y = y[idx]
     else:
         # The length of index must be consistent with the number of samples
         idx = np.arange(X.shape[0])
+        if isinstance(X, RowReader) and not lazy:
+            X = np.asarray(X)
 
     feat_names = data.feature_names if hasattr(data, 'feature_names') \
         else np.arange(X.shape[1])
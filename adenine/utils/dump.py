@@ -0,0 +1,373 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Storage of the pipeline results with deduplicated arrays."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import os
+import copy
+import json
+import hashlib
+import logging
+import numpy as np
+
+from six import BytesIO
+from six.moves import cPickle as pkl
+
+from adenine.utils import compression
+
+# marker of the first record of a deduplicated dump
+DUMP_FORMAT = 'adenine-dedup'
+DUMP_VERSION = 1
+
+# arrays smaller than this are pickled inline (hashing is not worth it)
+MIN_SHARED_BYTES = 1024
+
+# in slim mode, arrays larger than this are saved in separate .npy files
+# (in the ARRAYS_FOLDER next to the dump) and memory-mapped when loaded
+LAZY_BYTES = 2 ** 24
+ARRAYS_FOLDER = '__arrays'
+
+# rows read at once when dumping a lazily loaded data matrix (see save_data)
+DATA_CHUNK_SIZE = 10000
+
+# training-sized state of the fitted models, unused by the analysis
+HEAVY_ATTRIBUTES = ('X_fit_', 'training_data_', 'dist_matrix_', 'alphas_',
+                    'eigenvectors_', 'dissimilarity_matrix_', 'embedding_',
+                    'cv_results_', 'grid_scores_', 'affinity_matrix_')
+
+# heavy attributes still needed by the clustering analysis (eigs plot)
+CLUSTERING_ATTRIBUTES = ('affinity_matrix_',)
+
+# the experiment metadata, read by ade_analysis instead of the ade_config
+METADATA_FILE = '__metadata.json'
+METADATA_VERSION = 1
+
+# the config variables holding data, stored as arrays in the metadata (or
+# not at all, X)
+DATA_VARIABLES = ('X', 'y', 'index', 'feat_names')
+
+
+def _array_key(X):
+    """Content hash of an array (dtype, shape and data)."""
+    X = np.ascontiguousarray(X)
+    sha = hashlib.sha1()
+    sha.update(X.dtype.str.encode('ascii'))
+    sha.update(str(X.shape).encode('ascii'))
+    sha.update(X.view(np.uint8).reshape(-1) if X.size else b'')
+    return sha.hexdigest()
+
+
+class _ArrayTable(object):
+    """Collect the unique arrays met while pickling an object.
+
+    Used as the persistent_id hook of a Pickler: every large numerical array
+    is replaced by its content hash and stored once in `arrays`, no matter
+    how many steps, pipelines or fitted models refer to it.
+    """
+
+    def __init__(self, min_bytes=MIN_SHARED_BYTES):
+        self.min_bytes = min_bytes
+        self.arrays = dict()
+        self._seen = dict()  # id(array) -> (key, array), avoids hashing twice
+        self.n_refs = 0
+
+    def __call__(self, obj):
+        # memory-mapped files included (e.g. data_source.NpyMemmap), whatever
+        # their size, so that the dump does not refer to their file
+        if not (type(obj) is np.ndarray or isinstance(obj, np.memmap)) or \
+                obj.dtype.hasobject or (obj.nbytes < self.min_bytes and
+                                        not isinstance(obj, np.memmap)):
+            return None
+        if id(obj) in self._seen:
+            key = self._seen[id(obj)][0]
+        else:
+            key = _array_key(obj)
+            # keep obj alive, so that its id cannot be reused while pickling
+            self._seen[id(obj)] = (key, obj)
+            self.arrays.setdefault(key, np.asarray(obj))
+        self.n_refs += 1
+        return key
+
+
+def _shuffle(X):
+    """Byte-shuffle an array, so that it compresses better.
+
+    The first bytes of all the items come first, then the second bytes, and
+    so on: the slowly varying bytes (sign, exponent) of the floats end up
+    next to each other.
+    """
+    X = np.ascontiguousarray(X)
+    shuffled = X.reshape(-1).view(np.uint8).reshape(-1, X.itemsize).T
+    return X.dtype.str, X.shape, shuffled.tobytes()
+
+
+def _unshuffle(shuffled):
+    """Inverse of _shuffle."""
+    dtype, shape, data = shuffled
+    dtype = np.dtype(dtype)
+    X = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1).T
+    return np.ascontiguousarray(X).view(dtype).reshape(shape)
+
+
+def slim_model(model, keep=()):
+    """Copy of a fitted model without its training-sized state.
+
+    The copy keeps the class of the model and the attributes needed for
+    prediction and plotting (e.g. cluster_centers_, components_, labels_,
+    children_, lambdas_); the attributes in HEAVY_ATTRIBUTES and the fitted
+    sub-estimators (e.g. Isomap.nbrs_) are dropped, the best_estimator_ of a
+    grid search is slimmed in turn.
+
+    Parameters
+    -----------
+    model : sklearn or sklearn-like object
+        The fitted model.
+    keep : tuple of strings, optional, default ()
+        Heavy attributes to keep anyway.
+
+    Returns
+    -----------
+    slim : sklearn or sklearn-like object
+        The slim copy of model.
+    """
+    from sklearn.base import BaseEstimator
+    if not isinstance(model, BaseEstimator):
+        return model
+    slim = copy.copy(model)
+    for attr, value in list(slim.__dict__.items()):
+        if attr in keep or not attr.endswith('_'):
+            continue
+        if attr == 'best_estimator_':
+            setattr(slim, attr, slim_model(value, keep))
+        elif attr in HEAVY_ATTRIBUTES or isinstance(value, BaseEstimator):
+            delattr(slim, attr)
+    return slim
+
+
+def slim_results(pipes_dump):
+    """Slim every fitted model in the pipeline results (see slim_model).
+
+    Parameters
+    -----------
+    pipes_dump : dict
+        The results of the pipelines, {'pipe_id': {'stepID': [alg_name,
+        level, params, data_out, data_in, model_obj, voronoi_obj,
+        telemetry]}}.
+
+    Returns
+    -----------
+    pipes_dump : dict
+        The results with slim models.
+    """
+    slim_dump = dict()
+    for pipe_id, step_dump in pipes_dump.items():
+        slim_dump[pipe_id] = dict()
+        for step_id, result in step_dump.items():
+            keep = CLUSTERING_ATTRIBUTES if result[1] == 'clustering' else ()
+            slim_dump[pipe_id][step_id] = list(result[:5]) + [
+                slim_model(mdl, keep) for mdl in result[5:7]] + \
+                list(result[7:])
+    return slim_dump
+
+
+def save_results(obj, filename, codec=None, lazy_bytes=None):
+    """Pickle obj to filename storing each unique array only once.
+
+    The file holds two consecutive pickles: a table {hash: array} of the
+    unique arrays and the object itself, where every array is replaced by
+    a reference to the table.
+
+    Parameters
+    -----------
+    obj : object
+        The object to dump (e.g. the dictionary of the pipeline results).
+    filename : string
+        The output file.
+    codec : string, optional, default None
+        The compression codec (see adenine.utils.compression.get_codec), None
+        for no compression. When compressing, the float arrays are
+        byte-shuffled.
+    lazy_bytes : int, optional, default None
+        If provided, the arrays of at least lazy_bytes bytes are saved
+        (uncompressed) in separate .npy files in the ARRAYS_FOLDER next to
+        filename, and memory-mapped when loaded.
+    """
+    table = _ArrayTable()
+    buf = BytesIO()
+    pickler = pkl.Pickler(buf, pkl.HIGHEST_PROTOCOL)
+    pickler.persistent_id = table
+    pickler.dump(obj)
+
+    arrays = table.arrays
+    logging.info("Dump of %s: %d array references, %d unique arrays "
+                 "(%.1f MB)", filename, table.n_refs, len(arrays),
+                 sum(a.nbytes for a in arrays.values()) / 2. ** 20)
+
+    if lazy_bytes is not None:
+        folder = os.path.join(os.path.dirname(filename), ARRAYS_FOLDER)
+        for key, array in list(arrays.items()):
+            if array.nbytes >= lazy_bytes:
+                if not os.path.exists(folder):
+                    os.makedirs(folder)
+                np.save(os.path.join(folder, key + '.npy'), array)
+                arrays[key] = None  # to be loaded from its own file
+
+    if codec is not None:
+        for key, array in list(arrays.items()):
+            if array is not None and array.dtype.kind in 'fc':
+                arrays[key] = _shuffle(array)
+
+    with compression.open_file(filename, 'wb', codec) as out:
+        pkl.dump((DUMP_FORMAT, DUMP_VERSION, arrays), out,
+                 pkl.HIGHEST_PROTOCOL)
+        out.write(buf.getvalue())
+
+
+def save_data(X, y, index, filename, codec=None,
+              chunk_size=DATA_CHUNK_SIZE):
+    """Dump the input data with save_results.
+
+    A lazily loaded X (a data_source.RowReader, which cannot be pickled) is
+    first streamed, chunk_size rows at a time, to a temporary .npy file next
+    to filename, and then saved as a separate array (see lazy_bytes).
+
+    Parameters
+    -----------
+    X : array-like, shape : n_samples x n_features
+        The data matrix.
+    y : array or None
+        The labels.
+    index : array
+        The sample identifiers.
+    filename : string
+        The output file.
+    codec : string, optional, default None
+        The compression codec, see save_results.
+    chunk_size : int, optional, default DATA_CHUNK_SIZE
+        The number of rows of a lazily loaded X read at once.
+    """
+    from adenine.utils.data_source import RowReader
+    from adenine.utils.data_source import save_npy
+    tmp_file, lazy_bytes = None, None
+    if isinstance(X, RowReader):
+        tmp_file, lazy_bytes = filename + '.X.npy', LAZY_BYTES
+        X = save_npy(X, tmp_file, chunk_size)
+    try:
+        save_results({'X': X, 'y': y, 'index': index}, filename,
+                     codec=codec, lazy_bytes=lazy_bytes)
+    finally:
+        if tmp_file is not None:
+            os.remove(tmp_file)
+
+
+def load_results(filename):
+    """Load a file written by save_results, resolving the array references.
+
+    The compression codec is detected from the file. The arrays saved in
+    separate files are memory-mapped (copy-on-write), so they are read from
+    disk only when accessed. Plain pickle files (written by older versions)
+    are loaded as they are.
+
+    Parameters
+    -----------
+    filename : string
+        The input file.
+
+    Returns
+    -----------
+    obj : object
+        The dumped object.
+    """
+    with compression.open_file(filename, 'rb') as f:
+        head = pkl.load(f)
+        if not (isinstance(head, tuple) and len(head) == 3 and
+                head[0] == DUMP_FORMAT):
+            return head  # not deduplicated
+        arrays = head[2]
+        folder = os.path.join(os.path.dirname(filename), ARRAYS_FOLDER)
+
+        def _load_array(key):
+            if arrays[key] is None:
+                arrays[key] = np.load(os.path.join(folder, key + '.npy'),
+                                      mmap_mode='c')
+            elif isinstance(arrays[key], tuple):
+                arrays[key] = _unshuffle(arrays[key])
+            return arrays[key]
+
+        unpickler = pkl.Unpickler(f)
+        unpickler.persistent_load = _load_array
+        return unpickler.load()
+
+
+def _json_list(values):
+    """A 1D array-like as a list of JSON values (None if values is None)."""
+    if values is None:
+        return None
+    values = np.asarray(values).ravel().tolist()
+    return json.loads(json.dumps(values, default=str))
+
+
+def save_metadata(config, X, filename):
+    """Write the experiment metadata to a JSON file.
+
+    The file holds the settings of the ade_config file (the variables which
+    can be represented in JSON), the number of samples and features, the
+    feature names, the sample index and the labels, so that the analysis
+    does not need to execute the ade_config file (and load the data again).
+
+    Parameters
+    -----------
+    config : module
+        The loaded ade_config file.
+    X : array of float, shape : n_samples x n_features
+        The input data.
+    filename : string
+        The output file.
+    """
+    settings = dict()
+    for name, value in vars(config).items():
+        if name.startswith('_') or name in DATA_VARIABLES:
+            continue
+        try:
+            settings[name] = json.loads(json.dumps(value))
+        except (TypeError, ValueError):
+            continue  # modules, functions, classes, arrays, ...
+
+    n_samples, n_features = X.shape
+    metadata = {
+        'version': METADATA_VERSION,
+        'n_samples': n_samples, 'n_features': n_features,
+        'settings': settings,
+        'feat_names': _json_list(getattr(config, 'feat_names',
+                                         np.arange(n_features))),
+        'index': _json_list(getattr(config, 'index', np.arange(n_samples))),
+        'y': _json_list(getattr(config, 'y', None))}
+    with open(filename, 'w') as f:
+        json.dump(metadata, f)
+
+
+def load_metadata(filename):
+    """Load a file written by save_metadata.
+
+    Parameters
+    -----------
+    filename : string
+        The input file.
+
+    Returns
+    -----------
+    metadata : dict
+        With keys 'settings' (dictionary of the ade_config variables),
+        'n_samples', 'n_features', 'feat_names', 'index' and 'y' (arrays, y
+        is None for unlabelled data).
+    """
+    with open(filename) as f:
+        metadata = json.load(f)
+    for key in ('feat_names', 'index', 'y'):
+        if metadata[key] is not None:
+            metadata[key] = np.asarray(metadata[key])
+    return metadata
@@ -7,17 +7,42 @@
 # FreeBSD License
 ######################################################################
 
+import re
 import sys
+import copy
 import logging
 import warnings
 
 import numpy as np
-
+import scipy.sparse
+import sklearn
+import six
+
+from scipy.linalg import eigh
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import LinearOperator
+from scipy.sparse.linalg import eigsh
+from scipy.sparse.linalg import svds
+from sklearn.decomposition import PCA
+from sklearn.decomposition import IncrementalPCA
 from sklearn.decomposition import KernelPCA
+from sklearn.base import BaseEstimator
+from sklearn.base import TransformerMixin
+from sklearn.kernel_approximation import Nystroem
+from sklearn.manifold import Isomap
+from sklearn.manifold import LocallyLinearEmbedding
+from sklearn.manifold import SpectralEmbedding
+from sklearn.manifold import TSNE
 from sklearn.preprocessing import Imputer
 from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import silhouette_score as sil
 from sklearn.metrics.pairwise import pairwise_distances
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.utils import check_random_state
+from sklearn.utils.extmath import randomized_svd
+from sklearn.utils.extmath import svd_flip
+
+from adenine.utils import neighbors
 
 # Legacy import
 try:
@@ -25,6 +50,12 @@ try:
 except ImportError:
     from sklearn.grid_search import GridSearchCV
 
+# Isomap, SpectralEmbedding and t-SNE accept a sparse graph of precomputed
+# neighbors since sklearn 0.22, older versions compute their own neighbors
+_SKLEARN_VERSION = tuple(
+    int(v) for v in re.match(r'(\d+)\.(\d+)', sklearn.__version__).groups())
+PRECOMPUTED_GRAPH = _SKLEARN_VERSION >= (0, 22)
+
 if sys.version_info >= (3, 0):
     imap = map
 
@@ -63,6 +94,9 @@ class Imputer(Imputer):
 
     def fit(self, X, y=None):
         if self.strategy.lower() in ['nearest_neighbors', 'nn']:
+            if scipy.sparse.issparse(X):
+                raise TypeError("The nearest_neighbors strategy requires "
+                                "dense data")
             self._nn_fit(X)
         else:
             if y is not None:
@@ -326,6 +360,20 @@ def silhouette_score(estimator, X, y=None):
     return np.nan
 
 
+def _autosigma(data, n_neighbors=5):
+    """Average distance of each sample from its (n_neighbors + 1)-th neighbor.
+
+    The neighbors are found with a tree (or read from the shared graph of
+    adenine.utils.neighbors), instead of computing and sorting all the
+    pairwise distances.
+    """
+    graph = neighbors.shared_kneighbors(data, n_neighbors + 1)
+    if graph is None:
+        graph = NearestNeighbors(n_neighbors=n_neighbors + 1).fit(
+            data).kneighbors()
+    return np.mean(graph[0][:, n_neighbors])
+
+
 class KernelPCA(KernelPCA):
     """Extension of sklearn Kernel PCA.
 
@@ -359,11 +407,7 @@ class KernelPCA(KernelPCA):
         n_neighbors : int
             The number of considered nearest neighbors (optional, default = 5).
         """
-        # evaluate pairwise euclidean distances
-        from sklearn.metrics.pairwise import pairwise_distances
-        D = pairwise_distances(data, data)
-        D.sort(axis=0)
-        return np.mean(D[n_neighbors+1, :].ravel())
+        return _autosigma(data, n_neighbors)
 
     def fit(self, X, **kwargs):
         # Apply the _autosigma heuristic
@@ -371,3 +415,501 @@ class KernelPCA(KernelPCA):
             self.gamma = 1.0 / (2 * self._autosigma(data=X)**2)
             # print("Gamma is: {}".format(self.gamma))
         super(KernelPCA, self).fit(X, **kwargs)
+
+
+# AdaptivePCA: the centered copy of inputs larger than this (in bytes) is not
+# kept in memory and the incremental solver is used instead
+MAX_COPY_BYTES = 2 ** 30
+# AdaptivePCA: the Gram matrix is used with at most this number of samples,
+# when the features are at least GRAM_RATIO times the samples
+GRAM_MAX_SAMPLES = 5000
+GRAM_RATIO = 5
+
+
+class AdaptivePCA(BaseEstimator, TransformerMixin):
+    """PCA with a solver chosen from the shape of the data.
+
+    With solver='auto' the singular value decomposition of the centered data
+    is computed with:
+
+    - 'arpack' for sparse inputs, centering them implicitly;
+    - 'incremental' (i.e. IncrementalPCA) for memory-mapped inputs, or inputs
+      too large to be copied (see MAX_COPY_BYTES);
+    - 'gram' for inputs with much more features than samples (n << p), from
+      the eigendecomposition of the n x n Gram matrix;
+    - 'randomized' if only a few components are requested from a large
+      input (same rule as sklearn PCA);
+    - 'full' otherwise.
+
+    The selected solver is stored in solver_, which is reported by the
+    analysis.
+
+    Parameters
+    -----------
+    n_components : int, optional, default None
+        The number of components, if None all of them are kept.
+
+    solver : {'auto', 'full', 'randomized', 'gram', 'arpack', 'incremental'}
+        The solver, see above.
+
+    whiten : bool, optional, default False
+        Scale the components to unit variance.
+
+    batch_size : int, optional, default None
+        The batch size of the incremental solver.
+
+    random_state : int or RandomState, optional, default None
+        Seed of the randomized and arpack solvers.
+    """
+
+    def __init__(self, n_components=None, solver='auto', whiten=False,
+                 batch_size=None, random_state=None):
+        self.n_components = n_components
+        self.solver = solver
+        self.whiten = whiten
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def _select_solver(self, X):
+        n_samples, n_features = X.shape
+        n_components = self.n_components or min(n_samples, n_features)
+        if scipy.sparse.issparse(X):
+            if n_components < min(n_samples, n_features):
+                return 'arpack'
+            return 'full'
+        if not isinstance(X, np.ndarray) or isinstance(X, np.memmap) or \
+                n_samples * n_features * X.dtype.itemsize > MAX_COPY_BYTES:
+            return 'incremental'
+        if n_features >= GRAM_RATIO * n_samples and \
+                n_samples <= GRAM_MAX_SAMPLES:
+            return 'gram'
+        if n_components < .8 * min(n_samples, n_features) and \
+                max(n_samples, n_features) > 500:
+            return 'randomized'
+        return 'full'
+
+    def _from_incremental(self):
+        for attr in ('components_', 'explained_variance_',
+                     'explained_variance_ratio_', 'mean_', 'n_components_'):
+            setattr(self, attr, getattr(self.ipca_, attr))
+        self.solver_ = 'incremental'
+        return self
+
+    def _svd(self, X, solver, n_components):
+        """Return the mean, U, S, Vt, and the total variance of X."""
+        random_state = check_random_state(self.random_state)
+        n_samples = X.shape[0]
+        if solver == 'arpack':
+            # sparse or dense, X is centered implicitly
+            if scipy.sparse.issparse(X):
+                X = X.tocsr().astype(np.float64)
+                sum_sq = X.multiply(X).sum()
+            else:
+                X = np.asarray(X, dtype=np.float64)
+                sum_sq = np.einsum('ij,ij->', X, X)
+            mean = np.asarray(X.mean(axis=0)).ravel()
+            Xc = LinearOperator(
+                X.shape, dtype=np.float64,
+                matvec=lambda v: X.dot(v.ravel()) - mean.dot(v.ravel()),
+                rmatvec=lambda u: X.T.dot(u.ravel()) - mean * u.sum())
+            U, S, Vt = svds(Xc, k=n_components,
+                            v0=random_state.uniform(-1, 1, min(X.shape)))
+            order = np.argsort(S)[::-1]
+            U, S, Vt = U[:, order], S[order], Vt[order]
+            total_var = sum_sq - n_samples * mean.dot(mean)
+            return mean, U, S, Vt, total_var
+
+        X = X.toarray() if scipy.sparse.issparse(X) else np.asarray(X)
+        mean = X.mean(axis=0)
+        Xc = X - mean
+        total_var = np.einsum('ij,ij->', Xc, Xc)
+        if solver == 'randomized':
+            U, S, Vt = randomized_svd(Xc, n_components,
+                                      random_state=random_state)
+        elif solver == 'gram':
+            eigvals, U = np.linalg.eigh(Xc.dot(Xc.T))
+            eigvals = eigvals[::-1][:n_components]
+            U = U[:, ::-1][:, :n_components]
+            S = np.sqrt(np.maximum(eigvals, 0))
+            Vt = Xc.T.dot(U).T
+            Vt[S > 0] /= S[S > 0][:, None]
+        elif solver == 'full':
+            U, S, Vt = np.linalg.svd(Xc, full_matrices=False)
+        else:
+            raise ValueError("Unknown PCA solver: {}".format(solver))
+        return mean, U, S, Vt, total_var
+
+    def fit(self, X, y=None):
+        """Fit the principal components of X."""
+        solver = self._select_solver(X) if self.solver == 'auto' \
+            else self.solver
+        if solver == 'incremental':
+            self.ipca_ = IncrementalPCA(n_components=self.n_components,
+                                        batch_size=self.batch_size).fit(X)
+            return self._from_incremental()
+
+        n_components = self.n_components or min(X.shape)
+        mean, U, S, Vt, total_var = self._svd(X, solver, n_components)
+        U, Vt = svd_flip(U, Vt)
+
+        self.solver_ = solver
+        self.mean_ = mean
+        self.n_components_ = n_components
+        self.components_ = Vt[:n_components]
+        self.singular_values_ = S[:n_components]
+        self.explained_variance_ = S[:n_components] ** 2 / (X.shape[0] - 1)
+        self.explained_variance_ratio_ = S[:n_components] ** 2 / total_var
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Incrementally fit the principal components on a batch of X."""
+        if not hasattr(self, 'ipca_'):
+            self.ipca_ = IncrementalPCA(n_components=self.n_components,
+                                        batch_size=self.batch_size)
+        self.ipca_.partial_fit(X)
+        return self._from_incremental()
+
+    def transform(self, X):
+        """Project X on the principal components."""
+        # keep single precision inputs in single precision
+        dtype = X.dtype if X.dtype in (np.float32, np.float64) \
+            else np.float64
+        components = self.components_.astype(dtype, copy=False)
+        X_new = X.dot(components.T) - \
+            self.mean_.astype(dtype, copy=False).dot(components.T)
+        if self.whiten:
+            X_new /= np.sqrt(self.explained_variance_)
+        return X_new
+
+
+class NystroemKernelPCA(BaseEstimator, TransformerMixin):
+    """Kernel PCA on the Nystroem approximation of the kernel matrix.
+
+    The kernel is evaluated only between the samples and n_landmarks randomly
+    chosen landmarks, hence memory and time grow as
+    n_samples x n_landmarks instead of n_samples^2. As in KernelPCA, the
+    default gamma of rbf kernels is 1 / (2 * sigma^2), where sigma is the
+    output of _autosigma.
+
+    Parameters
+    -----------
+    n_components : int, optional, default None
+        The number of components, if None all of them are kept.
+
+    kernel : string, optional, default 'linear'
+        The kernel, as in KernelPCA ('precomputed' is not supported).
+
+    gamma, degree, coef0, kernel_params : optional
+        The kernel parameters, as in KernelPCA.
+
+    n_landmarks : int, optional, default 500
+        The number of landmarks, i.e. the rank of the approximation.
+
+    random_state : int or RandomState, optional, default None
+        Seed of the landmarks selection.
+    """
+
+    def __init__(self, n_components=None, kernel="linear", gamma=None,
+                 degree=3, coef0=1, kernel_params=None, n_landmarks=500,
+                 random_state=None):
+        self.n_components = n_components
+        self.kernel = kernel
+        self.gamma = gamma
+        self.degree = degree
+        self.coef0 = coef0
+        self.kernel_params = kernel_params
+        self.n_landmarks = n_landmarks
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        """Select the landmarks and fit the PCA of the kernel features."""
+        gamma = self.gamma
+        if self.kernel == 'rbf' and gamma is None:
+            gamma = 1.0 / (2 * _autosigma(X)**2)
+        self.nystroem_ = Nystroem(kernel=self.kernel, gamma=gamma,
+                                  degree=self.degree, coef0=self.coef0,
+                                  kernel_params=self.kernel_params,
+                                  n_components=min(self.n_landmarks,
+                                                   X.shape[0]),
+                                  random_state=self.random_state)
+        self.pca_ = PCA(n_components=self.n_components).fit(
+            self.nystroem_.fit_transform(X))
+
+        # proportional to the eigenvalues of the centered kernel matrix
+        self.lambdas_ = self.pca_.explained_variance_
+        return self
+
+    def transform(self, X):
+        """Project the kernel features of X on the principal components."""
+        return self.pca_.transform(self.nystroem_.transform(X))
+
+
+class LandmarkMDS(BaseEstimator, TransformerMixin):
+    """Landmark multidimensional scaling.
+
+    Classical (metric) MDS is solved on n_landmarks randomly chosen samples,
+    then every sample is placed by distance-based triangulation from its
+    squared euclidean distances to the landmarks (de Silva and Tenenbaum,
+    2004). Memory and time grow as n_samples x n_landmarks instead of
+    n_samples^2, and new samples can be embedded with transform.
+
+    Parameters
+    -----------
+    n_components : int, optional, default 2
+        The dimension of the embedding.
+
+    n_landmarks : int, optional, default 500
+        The number of landmarks.
+
+    random_state : int or RandomState, optional, default None
+        Seed of the landmarks selection.
+    """
+
+    def __init__(self, n_components=2, n_landmarks=500, random_state=None):
+        self.n_components = n_components
+        self.n_landmarks = n_landmarks
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        """Select the landmarks and embed them with classical MDS."""
+        X = np.asarray(X, dtype=np.float64)
+        random_state = check_random_state(self.random_state)
+        idx = random_state.choice(X.shape[0], min(self.n_landmarks,
+                                                  X.shape[0]), replace=False)
+        self.landmarks_ = X[np.sort(idx)]
+
+        D = euclidean_distances(self.landmarks_, squared=True)
+        self.mean_sq_distances_ = D.mean(axis=0)
+        B = -0.5 * (D - self.mean_sq_distances_ -
+                    self.mean_sq_distances_[:, None] + D.mean())
+        eigvals, eigvecs = np.linalg.eigh(B)
+        eigvals = eigvals[::-1][:self.n_components]
+        eigvecs = eigvecs[:, ::-1][:, :self.n_components]
+
+        # non-positive eigenvalues correspond to non-euclidean directions
+        positive = eigvals > 0
+        self.eigenvalues_ = eigvals
+        self.pinv_ = np.zeros_like(eigvecs)
+        self.pinv_[:, positive] = eigvecs[:, positive] / \
+            np.sqrt(eigvals[positive])
+        return self
+
+    def transform(self, X):
+        """Triangulate the samples of X from their distances to landmarks."""
+        D = euclidean_distances(X, self.landmarks_, squared=True)
+        return -0.5 * (D - self.mean_sq_distances_).dot(self.pinv_)
+
+
+def _is_euclidean(estimator):
+    """Check whether the neighbors of the estimator are euclidean."""
+    return (getattr(estimator, 'metric', 'minkowski') in ('minkowski',
+                                                          'euclidean') and
+            getattr(estimator, 'p', 2) == 2 and
+            getattr(estimator, 'radius', None) is None)
+
+
+def _copy_fitted(source, estimator, X):
+    """Copy the fitted attributes of source, fitted on the graph of X."""
+    for attr, value in vars(source).items():
+        if attr.endswith('_'):
+            setattr(estimator, attr, value)
+    estimator.n_features_in_ = X.shape[1]
+    return estimator
+
+
+class Isomap(Isomap):
+    """Extension of sklearn Isomap.
+
+    The neighbors graph is read from adenine.utils.neighbors, so that it is
+    computed only once for all the manifold learning steps sharing the same
+    input (see adenine.utils.neighbors.set_graph_options). This requires
+    sklearn >= 0.22, older versions compute their own neighbors. A
+    disconnected graph is left to sklearn, which connects its components
+    (only when it computes the neighbors itself).
+    """
+
+    def fit(self, X, y=None):
+        graph = None
+        if PRECOMPUTED_GRAPH and _is_euclidean(self):
+            # the graph includes each sample as its own (first) neighbor
+            graph = neighbors.shared_kneighbors(X, self.n_neighbors + 1)
+        if graph is not None:
+            graph = neighbors.kneighbors_graph(*graph, include_self=True)
+            if connected_components(graph, directed=False)[0] > 1:
+                graph = None
+        if graph is None:
+            return super(Isomap, self).fit(X)
+
+        X = np.asarray(X, dtype=np.float64)
+        isomap = copy.copy(self)
+        isomap.metric = 'precomputed'
+        super(Isomap, isomap).fit(graph)
+        _copy_fitted(isomap, self, X)
+        # transform searches the neighbors of new samples among those of X
+        self.nbrs_ = NearestNeighbors(n_neighbors=self.n_neighbors,
+                                      algorithm=self.neighbors_algorithm,
+                                      n_jobs=getattr(self, 'n_jobs', 1)).fit(X)
+        return self
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).embedding_
+
+
+def _barycenter_weights(X, indices, reg=1e-3, batch_size=1000):
+    """Weights reconstructing each sample from its neighbors (as in sklearn).
+
+    The local Gram matrices are solved in batches of batch_size samples.
+    """
+    n_samples, n_neighbors = indices.shape
+    weights = np.empty(indices.shape)
+    diag = np.arange(n_neighbors)
+    for start in range(0, n_samples, batch_size):
+        rows = slice(start, min(start + batch_size, n_samples))
+        Z = X[indices[rows]] - X[rows][:, None, :]
+        C = np.einsum('ikj,ilj->ikl', Z, Z)
+        trace = np.einsum('ikk->i', C)
+        C[:, diag, diag] += np.where(trace > 0, reg * trace, reg)[:, None]
+        w = np.linalg.solve(C, np.ones(C.shape[:2] + (1,)))[..., 0]
+        weights[rows] = w / w.sum(axis=1)[:, None]
+    return weights
+
+
+def _null_space(M, k, k_skip=1, eigen_solver='arpack', tol=1e-6,
+                max_iter=100, random_state=None):
+    """The k eigenvectors of M with the smallest eigenvalues (as in sklearn).
+
+    The first k_skip ones are discarded; returns the eigenvectors and the
+    sum of their eigenvalues.
+    """
+    if eigen_solver == 'auto':
+        eigen_solver = 'arpack' if M.shape[0] > 200 and k + k_skip < 10 \
+            else 'dense'
+    if eigen_solver == 'arpack':
+        v0 = check_random_state(random_state).uniform(-1, 1, M.shape[0])
+        eigen_values, eigen_vectors = eigsh(
+            M, k + k_skip, sigma=0.0, tol=tol, maxiter=max_iter, v0=v0)
+    else:
+        if scipy.sparse.issparse(M):
+            M = M.toarray()
+        eigen_values, eigen_vectors = eigh(M)
+        index = np.argsort(np.abs(eigen_values))[:k + k_skip]
+        eigen_values, eigen_vectors = eigen_values[index], \
+            eigen_vectors[:, index]
+    return eigen_vectors[:, k_skip:], np.sum(eigen_values[k_skip:])
+
+
+class LocallyLinearEmbedding(LocallyLinearEmbedding):
+    """Extension of sklearn LocallyLinearEmbedding.
+
+    With method='standard', the neighbors graph is read from
+    adenine.utils.neighbors, so that it is computed only once for all the
+    manifold learning steps sharing the same input (see
+    adenine.utils.neighbors.set_graph_options). The other methods compute
+    their own neighbors.
+    """
+
+    def fit(self, X, y=None):
+        graph = None
+        if self.method == 'standard':
+            graph = neighbors.shared_kneighbors(X, self.n_neighbors)
+        if graph is None:
+            return super(LocallyLinearEmbedding, self).fit(X)
+
+        X = np.asarray(X, dtype=np.float64)
+        self.n_features_in_ = X.shape[1]
+        self.nbrs_ = NearestNeighbors(n_neighbors=self.n_neighbors,
+                                      algorithm=self.neighbors_algorithm,
+                                      n_jobs=getattr(self, 'n_jobs', 1))
+        self.nbrs_.fit(X)
+
+        indices = graph[1]
+        W = scipy.sparse.csr_matrix(
+            (_barycenter_weights(X, indices, self.reg).ravel(),
+             indices.ravel(),
+             np.arange(0, indices.size + 1, indices.shape[1])),
+            shape=(X.shape[0], X.shape[0]))
+        M = scipy.sparse.identity(X.shape[0], format='csr') - W
+        M = M.T.dot(M).tocsr()
+        self.embedding_, self.reconstruction_error_ = _null_space(
+            M, self.n_components, k_skip=1, eigen_solver=self.eigen_solver,
+            tol=self.tol, max_iter=self.max_iter,
+            random_state=self.random_state)
+        return self
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).embedding_
+
+
+class SpectralEmbedding(SpectralEmbedding):
+    """Extension of sklearn SpectralEmbedding.
+
+    With affinity='nearest_neighbors', the neighbors graph is read from
+    adenine.utils.neighbors, so that it is computed only once for all the
+    manifold learning steps sharing the same input (see
+    adenine.utils.neighbors.set_graph_options). This requires sklearn >= 0.22,
+    older versions compute their own neighbors.
+    """
+
+    def fit(self, X, y=None):
+        graph = None
+        if PRECOMPUTED_GRAPH and self.affinity == 'nearest_neighbors':
+            n_neighbors = self.n_neighbors if self.n_neighbors is not None \
+                else max(int(X.shape[0] / 10), 1)
+            graph = neighbors.shared_kneighbors(X, n_neighbors)
+        if graph is None:
+            return super(SpectralEmbedding, self).fit(X)
+
+        # each sample is its own (first) neighbor, as in sklearn
+        X = np.asarray(X, dtype=np.float64)
+        embedding = copy.copy(self)
+        embedding.affinity = 'precomputed_nearest_neighbors'
+        embedding.n_neighbors = n_neighbors
+        super(SpectralEmbedding, embedding).fit(
+            neighbors.kneighbors_graph(*graph, include_self=True))
+        return _copy_fitted(embedding, self, X)
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).embedding_
+
+
+class TSNE(TSNE):
+    """Extension of sklearn TSNE.
+
+    With method='barnes_hut', the neighbors graph is read from
+    adenine.utils.neighbors, so that it is computed only once for all the
+    manifold learning steps sharing the same input (see
+    adenine.utils.neighbors.set_graph_options). This requires sklearn >= 0.22,
+    older versions compute their own neighbors.
+    """
+
+    def fit_transform(self, X, y=None):
+        graph = None
+        if PRECOMPUTED_GRAPH and self.method == 'barnes_hut' and \
+                self.metric == 'euclidean':
+            # as sklearn's KNeighborsTransformer, the graph includes each
+            # sample as its own (first) neighbor
+            n_neighbors = min(X.shape[0] - 1, int(3. * self.perplexity + 1))
+            graph = neighbors.shared_kneighbors(X, n_neighbors + 1)
+        if graph is None:
+            return super(TSNE, self).fit_transform(X)
+
+        X = np.asarray(X, dtype=np.float64)
+        tsne = copy.copy(self)
+        tsne.metric = 'precomputed'
+        if isinstance(self.init, six.string_types) and self.init == 'pca':
+            # PCA initialization as in sklearn, it needs the data matrix
+            pca = PCA(n_components=self.n_components,
+                      random_state=check_random_state(self.random_state))
+            init = pca.fit_transform(X).astype(np.float32)
+            tsne.init = init / np.std(init[:, 0]) * 1e-4
+
+        # the barnes_hut method works on squared euclidean distances, recent
+        # sklearn versions square also the precomputed ones
+        distances, indices = graph
+        if not (_SKLEARN_VERSION >= (1, 1) or
+                getattr(self, 'square_distances', None) is True):
+            distances = distances ** 2
+        embedding = super(TSNE, tsne).fit_transform(
+            neighbors.kneighbors_graph(distances, indices, include_self=True))
+        _copy_fitted(tsne, self, X)
+        return embedding
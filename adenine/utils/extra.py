@@ -8,20 +8,26 @@
 ######################################################################
 
 import os
+import sys
 import time
-import matplotlib; matplotlib.use('Agg')
-import seaborn as sns
 
+from contextlib import contextmanager
 from datetime import datetime
 from itertools import product
 
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
 
 class Palette():
     """Wrapper for seaborn palette."""
 
     def __init__(self, name='Set1', n_colors=6):
         self.name = name
-        self.palette = sns.color_palette(name, n_colors)
+        self.reset(n_colors)
 
     def get(self, i=0):
         return self.palette[i]
@@ -31,6 +37,8 @@ class Palette():
         return self.palette[-1]
 
     def reset(self, n_colors=6):
+        # seaborn is imported only by the analysis, not by ade_run
+        import seaborn as sns
         self.palette = sns.color_palette(self.name, n_colors)
 
 
@@ -163,6 +171,46 @@ def timed(function):
     return timed_function
 
 
+def peak_rss():
+    """Peak resident set size of the current process, in MB (nan if
+    unknown)."""
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on OS X, kilobytes elsewhere
+    return peak / 2. ** (20 if sys.platform == 'darwin' else 10)
+
+
+@contextmanager
+def measured(record, key):
+    """Context manager that measures the resources used by a block of code.
+
+    The wall time (s), the CPU time (s) and the growth of the peak resident
+    set size (MB) of the process while executing the block are stored in
+    record[key] as a dictionary with keys 'wall', 'cpu' and 'peak_rss'. If
+    the same key is measured again (e.g. a retry), the times are summed.
+
+    Parameters
+    -----------
+    record : dictionary
+        Where the measures are stored; if None nothing is measured.
+    key : string
+        The name of the measured block (e.g. 'fit').
+    """
+    if record is None:
+        yield
+        return
+    rss0, cpu0, wall0 = peak_rss(), sum(os.times()[:2]), time.time()
+    try:
+        yield
+    finally:
+        previous = record.get(key, {'wall': 0., 'cpu': 0., 'peak_rss': 0.})
+        record[key] = {
+            'wall': previous['wall'] + time.time() - wall0,
+            'cpu': previous['cpu'] + sum(os.times()[:2]) - cpu0,
+            'peak_rss': max(previous['peak_rss'], peak_rss() - rss0)}
+
+
 def set_module_defaults(module, dictionary):
     """Set default variables of a module, given a dictionary.
 
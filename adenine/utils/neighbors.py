@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Nearest neighbors graph shared by the manifold learning steps.
+
+Isomap, LLE, SE and t-SNE all start from the k nearest neighbors of each
+sample. Pipelines that differ only in the parameters of those steps (e.g.
+n_components or method) would compute the same neighbors over and over: the
+functions of this module compute them once per input matrix and store them
+in a cache directory shared by the pipeline workers.
+"""
+
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+import os
+import time
+import errno
+import weakref
+import hashlib
+import logging
+import numpy as np
+import scipy.sparse
+
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils import check_random_state
+
+# seconds to wait for another worker which is computing the same graph
+LOCK_TIMEOUT = 3600
+
+GRAPH_OPTIONS = {'algorithm': None, 'cache_dir': None}
+
+_MEMORY_CACHE = dict()
+
+# (weak reference, algorithm, key) of the last matrix hashed by _cache_key
+_LAST_KEY = (None, None, None)
+
+
+def set_graph_options(algorithm='auto', cache_dir=None):
+    """Enable (or disable) the shared nearest neighbors graph.
+
+    Parameters
+    -----------
+    algorithm : {'auto', 'exact', 'approximate', None}
+        The algorithm used to compute the neighbors, see kneighbors ('auto'
+        is 'exact'). If None each manifold learning step computes its own
+        neighbors.
+
+    cache_dir : string, optional, default None
+        The folder where the graphs are stored to be shared among different
+        processes. If None, graphs are shared only inside the same process.
+    """
+    if algorithm not in ('auto', 'exact', 'approximate', None):
+        raise ValueError("Unknown nearest neighbors algorithm: {}"
+                         .format(algorithm))
+    GRAPH_OPTIONS['algorithm'] = 'exact' if algorithm == 'auto' \
+        else algorithm
+    GRAPH_OPTIONS['cache_dir'] = cache_dir
+
+
+def _merge(distances, indices, cand_distances, cand_indices, n_neighbors):
+    """Keep the n_neighbors closest distinct candidates of each row."""
+    distances = np.hstack((distances, cand_distances))
+    indices = np.hstack((indices, cand_indices))
+    rows = np.arange(indices.shape[0])[:, None]
+
+    # discard duplicated candidates
+    order = np.argsort(indices, axis=1, kind='mergesort')
+    indices, distances = indices[rows, order], distances[rows, order]
+    distances[:, 1:][indices[:, 1:] == indices[:, :-1]] = np.inf
+
+    order = np.argsort(distances, axis=1, kind='mergesort')[:, :n_neighbors]
+    return distances[rows, order], indices[rows, order]
+
+
+def _leaves(X, leaf_size, random_state):
+    """Split the samples of X with a random projection tree."""
+    stack, leaves = [np.arange(X.shape[0])], []
+    while stack:
+        idx = stack.pop()
+        if idx.shape[0] <= leaf_size:
+            leaves.append(idx)
+            continue
+        proj = X[idx].dot(random_state.randn(X.shape[1]))
+        order = np.argsort(proj, kind='mergesort')
+        half = idx.shape[0] // 2
+        stack.extend((idx[order[:half]], idx[order[half:]]))
+    return leaves
+
+
+def _row_distances(X, sq_norms, rows, cols):
+    """Euclidean distances between X[rows] and X[cols[i]], for each row."""
+    dots = np.einsum('ij,ikj->ik', X[rows], X[cols])
+    sq = sq_norms[rows][:, None] - 2 * dots + sq_norms[cols]
+    return np.sqrt(np.maximum(sq, 0))
+
+
+def rp_forest_kneighbors(X, n_neighbors, n_trees=10, leaf_size=None,
+                         n_iter=2, batch_size=1000, random_state=None):
+    """Approximate k nearest neighbors via a random projection forest.
+
+    Each tree recursively splits the samples on the median of their
+    projection on a random direction; the candidate neighbors of a sample are
+    the samples falling in the same leaf in any of the trees. The candidates
+    are then refined with n_iter rounds of neighbors-of-neighbors search (as
+    in NN-descent).
+
+    Parameters
+    -----------
+    X : array of float, shape : n_samples x n_features
+        The input data matrix.
+
+    n_neighbors : int
+        The number of neighbors of each sample (the sample itself excluded).
+
+    n_trees : int, optional, default 10
+        The number of random projection trees.
+
+    leaf_size : int, optional, default None
+        The maximum number of samples in a leaf, at least 2 * (n_neighbors+1).
+
+    n_iter : int, optional, default 2
+        The number of neighbors-of-neighbors refinement rounds.
+
+    batch_size : int, optional, default 1000
+        The number of samples refined at once.
+
+    random_state : int or RandomState, optional, default None
+        Seed of the random projections.
+
+    Returns
+    -----------
+    distances, indices : array, shape : n_samples x n_neighbors
+        The euclidean distances and the indices of the neighbors of each
+        sample, sorted by increasing distance.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n_samples = X.shape[0]
+    leaf_size = max(leaf_size or 0, 2 * (n_neighbors + 1))
+    random_state = check_random_state(random_state)
+    sq_norms = np.einsum('ij,ij->i', X, X)
+
+    distances = np.full((n_samples, n_neighbors), np.inf)
+    indices = np.zeros((n_samples, n_neighbors), dtype=np.intp)
+    for _ in range(n_trees):
+        cand_distances = np.empty_like(distances)
+        cand_indices = np.empty_like(indices)
+        leaves = _leaves(X, leaf_size, random_state)
+        sizes = np.array([leaf.shape[0] for leaf in leaves])
+        # the leaves of the same size are processed at once
+        for size in np.unique(sizes):
+            leaf = np.array([l for l in leaves if l.shape[0] == size])
+            Z = X[leaf]
+            sq = (sq_norms[leaf][:, :, None] + sq_norms[leaf][:, None, :] -
+                  2 * np.einsum('lij,lkj->lik', Z, Z))
+            sq[:, np.arange(size), np.arange(size)] = np.inf
+            nearest = np.argsort(sq, axis=2, kind='mergesort')
+            nearest = nearest[:, :, :n_neighbors]
+            rows = np.arange(leaf.shape[0])[:, None, None]
+            cols = np.arange(size)[None, :, None]
+            cand_indices[leaf] = leaf[rows, nearest]
+            cand_distances[leaf] = np.sqrt(np.maximum(
+                sq[rows, cols, nearest], 0))
+        distances, indices = _merge(distances, indices, cand_distances,
+                                    cand_indices, n_neighbors)
+
+    for _ in range(n_iter):
+        new_distances = np.empty_like(distances)
+        new_indices = np.empty_like(indices)
+        for start in range(0, n_samples, batch_size):
+            rows = np.arange(start, min(start + batch_size, n_samples))
+            cand = indices[indices[rows]].reshape(rows.shape[0], -1)
+            cand_distances = _row_distances(X, sq_norms, rows, cand)
+            cand_distances[cand == rows[:, None]] = np.inf
+            new_distances[rows], new_indices[rows] = _merge(
+                distances[rows], indices[rows], cand_distances, cand,
+                n_neighbors)
+        distances, indices = new_distances, new_indices
+    return distances, indices
+
+
+def kneighbors(X, n_neighbors, algorithm='auto', random_state=None):
+    """Compute the k nearest neighbors of each sample of X.
+
+    Parameters
+    -----------
+    X : array of float, shape : n_samples x n_features
+        The input data matrix.
+
+    n_neighbors : int
+        The number of neighbors of each sample (the sample itself excluded).
+
+    algorithm : {'auto', 'exact', 'approximate'}
+        'exact' uses a sklearn NearestNeighbors tree, 'approximate' uses
+        rp_forest_kneighbors. 'auto' is 'exact': the approximate search
+        misses part of the true neighbors and, on the inputs measured so
+        far, it is not faster.
+
+    random_state : int or RandomState, optional, default None
+        Seed of the approximate search.
+
+    Returns
+    -----------
+    distances, indices : array, shape : n_samples x n_neighbors
+        The euclidean distances and the indices of the neighbors of each
+        sample, sorted by increasing distance.
+    """
+    if algorithm == 'approximate':
+        return rp_forest_kneighbors(X, n_neighbors, random_state=random_state)
+    nbrs = NearestNeighbors(n_neighbors=n_neighbors).fit(X)
+    return nbrs.kneighbors()
+
+
+def _cache_key(X, algorithm):
+    """Identify an input matrix by its content.
+
+    The matrix is hashed once: the key of the last matrix is reused as long
+    as the same (unmodified) object is passed, e.g. by the fit and the
+    transform of a step.
+    """
+    global _LAST_KEY
+    ref, last_algorithm, key = _LAST_KEY
+    if ref is not None and ref() is X and last_algorithm == algorithm:
+        return key
+    data = np.ascontiguousarray(X)
+    sha = hashlib.sha1(data.view(np.uint8))
+    sha.update(str((data.shape, data.dtype.str, algorithm)).encode('utf-8'))
+    key = sha.hexdigest()
+    try:
+        _LAST_KEY = (weakref.ref(X), algorithm, key)
+    except TypeError:  # e.g. a list
+        pass
+    return key
+
+
+def _read(filename, n_neighbors):
+    """Read a cached graph, if it has at least n_neighbors columns."""
+    try:
+        with np.load(filename) as data:
+            if data['indices'].shape[1] >= n_neighbors:
+                return data['distances'], data['indices']
+    except (IOError, OSError, KeyError):
+        pass
+    return None
+
+
+def _write(filename, distances, indices):
+    """Atomically write a graph in the cache."""
+    tmp = filename + '.{}.tmp.npz'.format(os.getpid())
+    np.savez(tmp, distances=distances, indices=indices)
+    os.rename(tmp, filename)
+
+
+def _lock(filename):
+    """Try to create the lock file, return False if it already exists."""
+    try:
+        os.close(os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+        return False
+
+
+def _cached_kneighbors(X, n_neighbors, algorithm, cache_dir):
+    """Read the neighbors from cache_dir, or compute and store them."""
+    try:
+        os.makedirs(cache_dir)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+    key = os.path.join(cache_dir, _cache_key(X, algorithm))
+    filename, lockname = key + '.npz', key + '.lock'
+    waited = 0
+    while True:
+        graph = _read(filename, n_neighbors)
+        if graph is not None:
+            return graph
+        if _lock(lockname):
+            break
+        if waited >= LOCK_TIMEOUT:
+            # the worker holding the lock probably died
+            logging.warning("Waited too long for %s, computing it again",
+                            filename)
+            return kneighbors(X, n_neighbors, algorithm)
+        time.sleep(1)
+        waited += 1
+
+    try:
+        graph = kneighbors(X, n_neighbors, algorithm)
+        _write(filename, *graph)
+    finally:
+        os.remove(lockname)
+    return graph
+
+
+def shared_kneighbors(X, n_neighbors):
+    """The k nearest neighbors of X, computed once and shared.
+
+    Parameters
+    -----------
+    X : array of float, shape : n_samples x n_features
+        The input data matrix.
+
+    n_neighbors : int
+        The number of neighbors of each sample (the sample itself excluded).
+
+    Returns
+    -----------
+    distances, indices : array, shape : n_samples x n_neighbors
+        As in kneighbors, or None if the shared graph is disabled (see
+        set_graph_options).
+    """
+    algorithm = GRAPH_OPTIONS['algorithm']
+    if algorithm is None or scipy.sparse.issparse(X):
+        return None
+    n_neighbors = min(n_neighbors, X.shape[0] - 1)
+
+    key = _cache_key(X, algorithm)
+    graph = _MEMORY_CACHE.get(key)
+    if graph is None or graph[1].shape[1] < n_neighbors:
+        if GRAPH_OPTIONS['cache_dir'] is None:
+            graph = kneighbors(X, n_neighbors, algorithm)
+        else:
+            graph = _cached_kneighbors(X, n_neighbors, algorithm,
+                                       GRAPH_OPTIONS['cache_dir'])
+        _MEMORY_CACHE.clear()
+        _MEMORY_CACHE[key] = graph
+    distances, indices = graph
+    return distances[:, :n_neighbors], indices[:, :n_neighbors]
+
+
+def kneighbors_graph(distances, indices, mode='distance', include_self=False):
+    """Build the sparse neighbors graph from the output of kneighbors.
+
+    Parameters
+    -----------
+    distances, indices : array, shape : n_samples x n_neighbors
+        The neighbors of each sample.
+
+    mode : {'distance', 'connectivity'}
+        Whether the graph entries are the distances or ones.
+
+    include_self : bool, optional, default False
+        Mark each sample as its own neighbor (with distance 0). As in
+        sklearn, the last neighbor is dropped to keep n_neighbors per row.
+
+    Returns
+    -----------
+    graph : sparse matrix, shape : n_samples x n_samples
+        The neighbors graph, in CSR format.
+    """
+    n_samples = indices.shape[0]
+    if include_self:
+        own = np.arange(n_samples)[:, None]
+        indices = np.hstack((own, indices[:, :-1]))
+        distances = np.hstack((np.zeros((n_samples, 1)), distances[:, :-1]))
+    data = distances.ravel() if mode == 'distance' \
+        else np.ones(indices.size)
+    indptr = np.arange(0, indices.size + 1, indices.shape[1])
+    return scipy.sparse.csr_matrix((data, indices.ravel(), indptr),
+                                   shape=(n_samples, n_samples))
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Opt-in profiling of selected pipelines."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import os
+import glob
+import zlib
+import logging
+import cProfile
+import pstats
+
+from six import string_types
+
+# set by ade_run and ade_analysis from the ade_config file: selection is
+# None (disabled), a list of pipe ids and/or step names, or the fraction of
+# pipelines to profile; folder is where the .prof files are written
+PROFILE_OPTIONS = {'selection': None, 'folder': None}
+
+# number of functions in the text reports
+REPORT_LINES = 50
+
+
+def set_profile_options(selection, folder):
+    """Set the pipelines to profile and the output folder.
+
+    Parameters
+    -----------
+    selection : list of strings, float or None
+        The pipelines to profile: a list of pipe ids (e.g. 'pipe3') and/or
+        step names (e.g. 'KernelPCA', all the pipelines including that step),
+        or a sampling rate in (0, 1] (that fraction of the pipelines, picked
+        deterministically from their ids). None disables profiling.
+    folder : string
+        The folder where the .prof files are written.
+    """
+    if isinstance(selection, string_types):
+        selection = [selection]
+    PROFILE_OPTIONS['selection'] = selection
+    PROFILE_OPTIONS['folder'] = folder
+    if selection is not None and folder is not None and \
+            not os.path.exists(folder):
+        os.makedirs(folder)
+
+
+def is_selected(pipe_id, step_names=()):
+    """Whether a pipeline is selected for profiling."""
+    selection = PROFILE_OPTIONS['selection']
+    if selection is None or PROFILE_OPTIONS['folder'] is None:
+        return False
+    if isinstance(selection, (int, float)):
+        # the same pipelines are picked on every run and every MPI rank
+        crc = zlib.crc32(pipe_id.encode('utf-8')) & 0xffffffff
+        return crc % 10000 < selection * 10000
+    selection = [str(s).lower() for s in selection]
+    return pipe_id.lower() in selection or \
+        any(name.lower() in selection for name in step_names)
+
+
+class Profiled(object):
+    """Run a function under cProfile and dump the stats to a .prof file."""
+
+    def __init__(self, function, filename):
+        self.function = function
+        self.filename = filename
+
+    def __call__(self, *args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.function, *args, **kwargs)
+        finally:
+            profiler.dump_stats(self.filename)
+
+
+def profiled(function, prefix, pipe_id, step_names=()):
+    """The function, wrapped in a profiler if the pipeline is selected.
+
+    Parameters
+    -----------
+    function : callable
+        The function executing the pipeline (e.g. pipe_worker).
+    prefix : string
+        Prefix of the .prof file, e.g. 'run' or 'analysis'.
+    pipe_id : string
+        Pipeline identifier.
+    step_names : list of strings, optional
+        The names of the steps of the pipeline (e.g. 'KernelPCA').
+
+    Returns
+    -----------
+    function : callable
+        Either function or a Profiled wrapper, which is picklable as long as
+        function is, hence it can be the target of a process.
+    """
+    if not is_selected(pipe_id, step_names):
+        return function
+    logging.info("Profiling %s of %s", prefix, pipe_id)
+    return Profiled(function, os.path.join(
+        PROFILE_OPTIONS['folder'], '{}_{}.prof'.format(prefix, pipe_id)))
+
+
+def merge_profiles(prefix, folder=None, sort_by='cumulative'):
+    """Merge the profiles with the same prefix into one report.
+
+    Writes <prefix>.prof (loadable with pstats, snakeviz, ...) and
+    <prefix>_report.txt with the REPORT_LINES most expensive functions.
+
+    Parameters
+    -----------
+    prefix : string
+        Prefix of the .prof files, e.g. 'run' or 'analysis'.
+    folder : string, optional, default None
+        The folder with the .prof files, PROFILE_OPTIONS['folder'] if None.
+    sort_by : string, optional, default 'cumulative'
+        The sorting key of the report (see pstats.Stats.sort_stats).
+    """
+    folder = folder or PROFILE_OPTIONS['folder']
+    if folder is None:
+        return
+    filenames = sorted(glob.glob(os.path.join(folder, prefix + '_*.prof')))
+    if not filenames:
+        return
+
+    with open(os.path.join(folder, prefix + '_report.txt'), 'w') as f:
+        stats = pstats.Stats(filenames[0], stream=f)
+        for filename in filenames[1:]:
+            stats.add(filename)
+        stats.dump_stats(os.path.join(folder, prefix + '.prof'))
+        f.write("Adenine: merged profile of {} pipelines ({})\n\n".format(
+            len(filenames), ', '.join(os.path.basename(fn)[
+                len(prefix) + 1:-len('.prof')] for fn in filenames)))
+        stats.strip_dirs().sort_stats(sort_by).print_stats(REPORT_LINES)
+    logging.info("Profile report: %s",
+                 os.path.join(folder, prefix + '_report.txt'))
@@ -26,12 +26,15 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from scipy.optimize import linear_sum_assignment
+from sklearn.metrics.cluster import expected_mutual_information
+
 
 def get_clones_real_estimated(filename):
     """Get true and estimated labels from a partis-generated dataset."""
     df = pd.read_csv(filename, dialect='excel-tab', header=0,
                      usecols=('SEQUENCE_ID', 'CLONE'))
-    df['CLONE_ID'] = df['SEQUENCE_ID'].str.split('_').apply(lambda x: x[3])
+    df['CLONE_ID'] = df['SEQUENCE_ID'].str.split('_').str[3]
 
     clone_ids = np.array(df['CLONE_ID'], dtype=str)
     found_ids = np.array(df['CLONE'], dtype=str)
@@ -39,65 +42,85 @@ def get_clones_real_estimated(filename):
 
 
 def order_cm(cm):
-    """Reorder a multiclass confusion matrix."""
-    # reorder rows
-    idx_rows = np.max(cm, axis=1).argsort()[::-1]
-    b = cm[idx_rows, :]
-
-    # reorder cols
-    max_idxs = np.ones(b.shape[1], dtype=bool)
-    final_idxs = []
-    for i, row in enumerate(b.copy()):
-        if i == b.shape[0] or not max_idxs.any():
-            break
-        row[~max_idxs] = np.min(cm) - 1
-        max_idx = np.argmax(row)
-        final_idxs.append(max_idx)
-        max_idxs[max_idx] = False
-
-    idx_cols = np.append(np.array(final_idxs, dtype=int),
-                         np.argwhere(max_idxs).T[0])  # residuals
-
-    # needs also this one
-    b = b[:, idx_cols]
-    bb = b.copy()
-    max_idxs = np.ones(b.shape[0], dtype=bool)
-    final_idxs = []
-    for i in range(b.shape[1]):
-        # for each column
-        if i == b.shape[1] or not max_idxs.any():
-            break
-        col = bb[:, i]
-        col[~max_idxs] = -1
-        max_idx = np.argmax(col)
-        final_idxs.append(max_idx)
-        max_idxs[max_idx] = False
-
-    idx_rows2 = np.append(np.array(final_idxs, dtype=int),
-                          np.argwhere(max_idxs).T[0])  # residuals
-
-    idx = np.argsort(idx_rows)
-    return b[idx_rows2, :], idx_rows2[idx], idx_cols
+    """Reorder a multiclass confusion matrix.
 
+    Rows (true classes) and columns (clusters) are matched one-to-one so that
+    the total number of samples on the diagonal is maximum, solving the
+    linear assignment problem with the Hungarian algorithm. Matched pairs
+    come first, sorted by decreasing size, then the unmatched rows and
+    columns.
 
-def confusion_matrix(true_labels, estimated_labels, ordered=True):
-    """Return a confusion matrix in a multiclass / multilabel problem."""
-    true_labels = np.array(true_labels, dtype=str)
-    estimated_labels = np.array(estimated_labels, dtype=str)
+    Returns
+    -----------
+    cm : array, shape : (n_rows, n_cols)
+        The reordered confusion matrix.
+
+    idx_rows : array of int, shape : n_rows
+        The order of the rows.
+
+    idx_cols : array of int, shape : n_cols
+        The order of the columns.
+    """
+    cm = np.asarray(cm)
+    matched_rows, matched_cols = linear_sum_assignment(-cm)
+    order = np.argsort(-cm[matched_rows, matched_cols], kind='mergesort')
+    matched_rows, matched_cols = matched_rows[order], matched_cols[order]
+
+    unmatched_rows = np.ones(cm.shape[0], dtype=bool)
+    unmatched_rows[matched_rows] = False
+    unmatched_cols = np.ones(cm.shape[1], dtype=bool)
+    unmatched_cols[matched_cols] = False
+
+    idx_rows = np.append(matched_rows, np.flatnonzero(unmatched_rows))
+    idx_cols = np.append(matched_cols, np.flatnonzero(unmatched_cols))
+    return cm[idx_rows[:, np.newaxis], idx_cols], idx_rows, idx_cols
+
+
+def _as_labels(labels):
+    """Return labels as an array that can be sorted by np.unique."""
+    labels = np.asarray(labels)
+    if labels.dtype.kind == 'O':
+        # mixed types cannot be compared
+        labels = labels.astype(str)
+    return labels.ravel()
+
+
+def contingency_matrix(true_labels, estimated_labels):
+    """Return the contingency matrix of two label assignments.
+
+    Labels are encoded as integers once, then the matrix is obtained with a
+    single bincount.
+
+    Returns
+    -----------
+    cm : array of int, shape : (n_classes, n_clusters)
+        cm[i, j] is the number of samples of class rows[i] in cluster cols[j].
+
+    rows : array, shape : n_classes
+        The sorted true labels.
+
+    cols : array, shape : n_clusters
+        The sorted estimated labels.
+    """
+    true_labels = _as_labels(true_labels)
+    estimated_labels = _as_labels(estimated_labels)
     if true_labels.shape[0] != estimated_labels.shape[0]:
         raise ValueError("Inputs must have the same dimensions.")
-    rows = np.unique(true_labels)
-    cols = np.unique(estimated_labels)
+    rows, row_idx = np.unique(true_labels, return_inverse=True)
+    cols, col_idx = np.unique(estimated_labels, return_inverse=True)
+    cm = np.bincount(row_idx * cols.shape[0] + col_idx,
+                     minlength=rows.shape[0] * cols.shape[0])
+    return cm.reshape(rows.shape[0], cols.shape[0]), rows, cols
+
+
+def confusion_matrix(true_labels, estimated_labels, ordered=True):
+    """Return a confusion matrix in a multiclass / multilabel problem."""
+    cm, rows, cols = contingency_matrix(true_labels, estimated_labels)
+    rows, cols = rows.astype(str), cols.astype(str)
 
     # padding only on columns
-    cm = np.zeros((rows.shape[0], max(cols.shape[0], rows.shape[0])))
-    from collections import Counter
-    for i, row in enumerate(rows):
-        idx_rows = true_labels == row
-        counter = Counter(estimated_labels[idx_rows])
-        for g in counter:
-            idx_col = np.where(cols == g)[0][0]
-            cm[i, idx_col] += counter[g]
+    cm = np.hstack((cm, np.zeros((rows.shape[0],
+                                  max(rows.shape[0] - cols.shape[0], 0)))))
 
     cols = np.append(cols, ['pad'] * (cm.shape[1] - cols.shape[0]))
     if ordered:
@@ -106,21 +129,100 @@ def confusion_matrix(true_labels, estimated_labels, ordered=True):
     return cm, rows, cols
 
 
+def _entropy(counts, n_samples):
+    """Entropy of a labelling, given the size of each label."""
+    counts = counts[counts > 0].astype(np.float64)
+    return -np.sum(counts / n_samples * (np.log(counts) - np.log(n_samples)))
+
+
+def _comb2(n):
+    """Number of pairs in n elements, elementwise."""
+    n = np.asarray(n, dtype=np.float64)
+    return np.sum(n * (n - 1) / 2.)
+
+
+def clustering_scores(true_labels, estimated_labels):
+    """Evaluate all the label agreement scores from one contingency matrix.
+
+    The adjusted Rand index, the adjusted mutual information (normalised by
+    the maximum entropy, as in scikit-learn 0.18), homogeneity, completeness,
+    V-measure and the micro F score are derived from the same contingency
+    matrix, which is built only once.
+
+    Parameters
+    -----------
+    true_labels : array, shape : n_samples
+        The gold standard.
+
+    estimated_labels : array, shape : n_samples
+        The clustering assignment.
+
+    Returns
+    -----------
+    perf_out : dictionary
+        The scores, keyed by 'ari', 'ami', 'homogeneity', 'completeness',
+        'v_measure' and 'fscore'.
+    """
+    cm, rows, cols = contingency_matrix(true_labels, estimated_labels)
+    n_samples = float(cm.sum())
+    n_classes, n_clusters = cm.shape
+    class_sizes, cluster_sizes = cm.sum(axis=1), cm.sum(axis=0)
+
+    # adjusted Rand index
+    if n_classes == n_clusters == 1 or n_classes == n_clusters == 0 or \
+            n_classes == n_clusters == n_samples:
+        ari = 1.
+    else:
+        sum_comb = _comb2(cm[cm > 1])
+        sum_comb_c, sum_comb_k = _comb2(class_sizes), _comb2(cluster_sizes)
+        expected = sum_comb_c * sum_comb_k / _comb2(n_samples)
+        ari = (sum_comb - expected) / \
+            ((sum_comb_c + sum_comb_k) / 2. - expected)
+
+    # mutual information based scores
+    nnz_i, nnz_j = np.nonzero(cm)
+    nnz = cm[nnz_i, nnz_j].astype(np.float64)
+    mi = np.sum(nnz / n_samples * (
+        np.log(nnz) + np.log(n_samples) -
+        np.log(class_sizes[nnz_i].astype(np.float64)) -
+        np.log(cluster_sizes[nnz_j].astype(np.float64))))
+    h_true = _entropy(class_sizes, n_samples)
+    h_pred = _entropy(cluster_sizes, n_samples)
+
+    homogeneity = 1. if h_true == 0 else mi / h_true
+    completeness = 1. if h_pred == 0 else mi / h_pred
+    v_measure = 0. if homogeneity + completeness == 0 else \
+        2. * homogeneity * completeness / (homogeneity + completeness)
+
+    if n_classes == n_clusters == 1 or n_classes == n_clusters == 0:
+        ami = 1.
+    elif n_classes == 1 or n_clusters == 1:
+        ami = 0.
+    else:
+        emi = expected_mutual_information(cm, int(n_samples))
+        ami = (mi - emi) / max(max(h_true, h_pred) - emi,
+                               np.finfo(np.float64).eps)
+
+    # F score on the ordered confusion matrix
+    cm = np.hstack((cm, np.zeros((n_classes, max(n_classes - n_clusters, 0)))))
+    fscore = precision_recall_fscore(order_cm(cm)[0])[2]
+
+    return {'ari': ari, 'ami': ami, 'homogeneity': homogeneity,
+            'completeness': completeness, 'v_measure': v_measure,
+            'fscore': fscore}
+
+
 def precision_recall_fscore(a, method='micro', beta=1.):
     """Return a precision / recall value for multiclass confuison matrix cm.
 
     See
     http://stats.stackexchange.com/questions/44261/how-to-determine-the-quality-of-a-multiclass-classifier
     """
-    def _single_measures(a, i):
-        tp = a[i, i]
-        fp = np.sum(a[:, i]) - tp
-        fn = np.sum(a[i, :]) - tp
-        tn = a.sum() - tp - fp - fn
-        return tp, fp, fn, tn
-
-    singles = zip(*[_single_measures(a, i) for i in range(min(a.shape))])
-    tps, fps, fns, tns = map(lambda x: np.array(list(x), dtype=float), singles)
+    a = np.asarray(a, dtype=float)
+    k = min(a.shape)
+    tps = np.diag(a)[:k]
+    fps = a.sum(axis=0)[:k] - tps
+    fns = a.sum(axis=1)[:k] - tps
 
     if method == 'micro':
         precision = float(tps.sum()) / (tps + fps).sum()
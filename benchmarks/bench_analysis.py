@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the analysis (plots and scores) of the pipelines."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import shutil
+import tempfile
+import multiprocessing as mp
+
+from adenine.core import define_pipeline
+from adenine.core.analyze_results import analysis_worker
+from adenine.core.pipelines import pipe_worker
+
+from .common import SCALES, make_data, skip_larger_than
+
+# the analysed pipelines: dimred -> clustering
+CLUSTERING = {
+    'KMeans': {'KMeans': [True, {'n_clusters': 4}]},
+    'Hierarchical': {'Hierarchical': [True, {'n_clusters': 4}]},
+}
+
+
+class AnalysisWorker(object):
+    """analysis_worker on a PCA -> clustering pipeline."""
+
+    params = [SCALES, sorted(CLUSTERING)]
+    param_names = ['n_samples', 'clustering']
+    timeout = 900
+
+    def setup(self, n_samples, clustering):
+        # the silhouette plots are quadratic in the number of samples
+        skip_larger_than(n_samples, 10000)
+        self.X, self.y = make_data(n_samples)
+        pipe = define_pipeline.parse_steps(
+            [{'None': [False]}, {'Standardize': [True]},
+             {'PCA': [True, {'n_components': 3}]},
+             CLUSTERING[clustering]])[0]
+        self.content = pipe_worker('pipe0', pipe, None, self.X)
+        # the plot titles are taken from the 'ade_' folder
+        self.root = tempfile.mkdtemp(prefix='ade_bench_')
+        self.lock = mp.Lock()
+
+    def teardown(self, n_samples, clustering):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def time_analysis_worker(self, n_samples, clustering):
+        analysis_worker(('pipe0', self.content), self.root, self.y,
+                        None, range(n_samples), self.lock)
+
+    def peakmem_analysis_worker(self, n_samples, clustering):
+        analysis_worker(('pipe0', self.content), self.root, self.y,
+                        None, range(n_samples), self.lock)
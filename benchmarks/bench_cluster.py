@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the adenine clustering algorithms."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+from adenine.cluster import Optics
+from adenine.externals.hierarchical import linkage_tree
+
+from .common import SCALES, make_data, skip_larger_than
+
+
+class OpticsFit(object):
+    """Optics.fit."""
+
+    params = [SCALES]
+    param_names = ['n_samples']
+    timeout = 600
+
+    def setup(self, n_samples):
+        skip_larger_than(n_samples, 10000)
+        self.X = make_data(n_samples)[0]
+
+    def time_fit(self, n_samples):
+        Optics(eps=2., min_samples=5).fit(self.X)
+
+    def peakmem_fit(self, n_samples):
+        Optics(eps=2., min_samples=5).fit(self.X)
+
+
+class LinkageTree(object):
+    """hierarchical.linkage_tree (full tree) for each linkage."""
+
+    params = [SCALES, ['complete', 'average']]
+    param_names = ['n_samples', 'linkage']
+    timeout = 600
+
+    def setup(self, n_samples, linkage):
+        skip_larger_than(n_samples, 10000)
+        self.X = make_data(n_samples)[0]
+
+    def time_linkage_tree(self, n_samples, linkage):
+        linkage_tree(self.X, linkage=linkage, return_distance=True)
+
+    def peakmem_linkage_tree(self, n_samples, linkage):
+        linkage_tree(self.X, linkage=linkage, return_distance=True)
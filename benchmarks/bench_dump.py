@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the writing and reading of the results dump."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import os
+import shutil
+import tempfile
+
+from adenine.core import define_pipeline
+from adenine.core.pipelines import pipe_worker
+from adenine.utils import dump
+
+from .common import SCALES, make_data
+
+# the dumped grid: 2 preprocessing x 2 PCA x 3 KMeans pipelines
+STEPS = [{'None': [False]},
+         {'Standardize': [True], 'MinMax': [True]},
+         {'PCA': [True, {'n_components': [2, 3]}]},
+         {'MiniBatchKMeans': [True, {'n_clusters': [2, 3, 4]}]}]
+
+
+class Dump(object):
+    """dump.save_results and dump.load_results of a grid of pipelines."""
+
+    params = [SCALES, [None, 'zlib', 'auto']]
+    param_names = ['n_samples', 'codec']
+    timeout = 600
+
+    def setup_cache(self):
+        # the pipelines results, computed once for all the benchmarks
+        results = dict()
+        for n_samples in SCALES:
+            X = make_data(n_samples)[0]
+            pipes = define_pipeline.parse_steps(STEPS)
+            results[n_samples] = dict(
+                ('pipe' + str(i), pipe_worker('pipe' + str(i), pipe, None, X))
+                for i, pipe in enumerate(pipes))
+        return results
+
+    def setup(self, results, n_samples, codec):
+        self.results = results[n_samples]
+        self.tmp_dir = tempfile.mkdtemp(prefix='ade_bench_')
+        self.filename = os.path.join(self.tmp_dir, 'dump.pkl')
+        dump.save_results(self.results, self.filename, codec=codec)
+
+    def teardown(self, results, n_samples, codec):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def time_save_results(self, results, n_samples, codec):
+        dump.save_results(self.results, self.filename, codec=codec)
+
+    def time_load_results(self, results, n_samples, codec):
+        dump.load_results(self.filename)
+
+    def peakmem_load_results(self, results, n_samples, codec):
+        dump.load_results(self.filename)
+
+    def track_dump_size(self, results, n_samples, codec):
+        return os.path.getsize(self.filename)
+    track_dump_size.unit = 'bytes'
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the import time of adenine and of its entry points."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+# each timeraw_ benchmark runs its code in a fresh interpreter, so that the
+# modules are not already cached in sys.modules
+
+
+def timeraw_import_adenine():
+    return "import adenine"
+
+
+def timeraw_ade_run_startup():
+    # the imports of ade_run.py up to the parsing of the command line
+    # (e.g. ade_run.py --version or -c)
+    return """
+    import os, shutil, argparse
+    from adenine import __version__
+    """
+
+
+def timeraw_ade_analysis_startup():
+    # the imports of ade_analysis.py before the analysis starts
+    return """
+    import imp, sys, os, time, logging, argparse
+    from adenine.utils import extra
+    from adenine.utils import profiling
+    """
+
+
+def timeraw_define_pipeline():
+    # the estimators are imported only when a pipeline uses them
+    return "from adenine.core import define_pipeline"
+
+
+def timeraw_job_distribution():
+    # what each MPI rank pays before running its first pipeline
+    return "from adenine.core import job_distribution"
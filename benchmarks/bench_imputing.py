@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the nearest neighbors data imputing."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+from adenine.utils.extensions import Imputer
+
+from .common import SCALES, make_data, skip_larger_than
+
+
+class NearestNeighborsImputer(object):
+    """Imputer(strategy='nearest_neighbors') fit and transform."""
+
+    params = [SCALES, [.01, .1]]
+    param_names = ['n_samples', 'missing_rate']
+    timeout = 600
+
+    def setup(self, n_samples, missing_rate):
+        skip_larger_than(n_samples, 10000)
+        self.X = make_data(n_samples, missing_rate=missing_rate)[0]
+        self.imputer = Imputer(missing_values='NaN',
+                               strategy='nearest_neighbors').fit(self.X)
+
+    def time_fit(self, n_samples, missing_rate):
+        Imputer(missing_values='NaN',
+                strategy='nearest_neighbors').fit(self.X)
+
+    def time_transform(self, n_samples, missing_rate):
+        self.imputer.transform(self.X)
+
+    def peakmem_fit_transform(self, n_samples, missing_rate):
+        Imputer(missing_values='NaN',
+                strategy='nearest_neighbors').fit(self.X).transform(self.X)
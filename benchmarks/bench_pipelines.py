@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the pipelines definition and execution."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+from adenine.core import define_pipeline
+from adenine.core.pipelines import pipe_worker
+
+from .common import SCALES, make_data, skip_larger_than
+
+# one step per type, as coded in the ade_config files:
+# name -> (level, step dictionary, max number of samples)
+STEPS = {
+    'Impute': (0, {'Impute': [True, {'missing_values': 'NaN',
+                                     'strategy': 'nearest_neighbors'}]},
+               10000),
+    'Standardize': (1, {'Standardize': [True]}, None),
+    'PCA': (2, {'PCA': [True, {'n_components': 3}]}, None),
+    'IncrementalPCA': (2, {'IncrementalPCA': [True, {'n_components': 3}]},
+                       None),
+    'KernelPCA': (2, {'KernelPCA': [True, {'kernel': 'rbf',
+                                           'n_components': 3}]}, 10000),
+    'NystroemKernelPCA': (2, {'NystroemKernelPCA': [True, {
+        'kernel': 'rbf', 'n_components': 3}]}, None),
+    'Isomap': (2, {'Isomap': [True, {'n_components': 3}]}, 10000),
+    'LLE': (2, {'LLE': [True, {'n_components': 3}]}, 10000),
+    'SE': (2, {'SE': [True, {'n_components': 3}]}, 10000),
+    'MDS': (2, {'MDS': [True, {'n_components': 3}]}, 1000),
+    'LandmarkMDS': (2, {'LandmarkMDS': [True, {'n_components': 3}]}, None),
+    'tSNE': (2, {'tSNE': [True, {'n_components': 2}]}, 10000),
+    'KMeans': (3, {'KMeans': [True, {'n_clusters': 4}]}, None),
+    'MiniBatchKMeans': (3, {'MiniBatchKMeans': [True, {'n_clusters': 4}]},
+                        None),
+    'AP': (3, {'AP': [True]}, 10000),
+    'MS': (3, {'MS': [True]}, 10000),
+    'Spectral': (3, {'Spectral': [True, {'n_clusters': 4}]}, 10000),
+    'Hierarchical': (3, {'Hierarchical': [True, {'n_clusters': 4}]}, 10000),
+}
+
+
+def make_steps(name):
+    """The four steps of a pipeline made only of the step name."""
+    level, step, _ = STEPS[name]
+    steps = [{'None': [False]}, {'None': [True]}, {'None': [True]},
+             {'None': [False]}]
+    steps[level] = step
+    return steps
+
+
+class ParseSteps(object):
+    """define_pipeline.parse_steps on grids of increasing size."""
+
+    params = [2, 4, 8]
+    param_names = ['n_values']
+
+    def setup(self, n_values):
+        self.steps = [
+            {'Impute': [True, {'strategy': ['mean', 'median']}]},
+            {'Standardize': [True], 'MinMax': [True]},
+            {'PCA': [True, {'n_components': list(range(2, 2 + n_values))}],
+             'KernelPCA': [True, {'kernel': ['rbf', 'poly']}]},
+            {'KMeans': [True, {'n_clusters': list(range(2, 2 + n_values))}],
+             'Hierarchical': [True, {'n_clusters': 3,
+                                     'linkage': ['ward', 'average']}]}]
+
+    def time_parse_steps(self, n_values):
+        define_pipeline.parse_steps(self.steps, max_n_pipes=10000)
+
+    def time_list_pipelines(self, n_values):
+        # the specifications only, the estimators are not created
+        define_pipeline.list_pipelines(self.steps, max_n_pipes=None)
+
+
+class PipeWorker(object):
+    """pipe_worker on a single step of each type."""
+
+    params = [SCALES, sorted(STEPS)]
+    param_names = ['n_samples', 'step']
+    timeout = 600
+
+    def setup(self, n_samples, step):
+        skip_larger_than(n_samples, STEPS[step][2] or n_samples)
+        missing_rate = .05 if step == 'Impute' else 0.
+        self.X = make_data(n_samples, missing_rate=missing_rate)[0]
+        self.pipe = define_pipeline.parse_steps(make_steps(step))[0]
+
+    def time_pipe_worker(self, n_samples, step):
+        pipe_worker('pipe0', self.pipe, None, self.X)
+
+    def peakmem_pipe_worker(self, n_samples, step):
+        pipe_worker('pipe0', self.pipe, None, self.X)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Synthetic data and helpers shared by the adenine benchmarks."""
+######################################################################
+# Copyright (C) 2016 Samuele Fiorini, Federico Tomasi, Annalisa Barla
+#
+# FreeBSD License
+######################################################################
+
+import numpy as np
+
+from sklearn.datasets import make_blobs
+
+# number of samples of the synthetic datasets
+SCALES = [1000, 10000, 100000]
+
+N_FEATURES = 20
+N_CENTERS = 4
+
+
+def make_data(n_samples, n_features=N_FEATURES, missing_rate=0.,
+              random_state=0):
+    """Gaussian blobs, optionally with missing values (NaN).
+
+    Parameters
+    -----------
+    n_samples : int
+        The number of samples.
+    n_features : int, optional, default N_FEATURES
+        The number of features.
+    missing_rate : float, optional, default 0
+        The fraction of entries replaced by NaN.
+    random_state : int, optional, default 0
+        The seed of the random generator.
+
+    Returns
+    -----------
+    X : array of float, shape : n_samples x n_features
+    y : array of int, shape : n_samples
+    """
+    X, y = make_blobs(n_samples=n_samples, n_features=n_features,
+                      centers=N_CENTERS, random_state=random_state)
+    if missing_rate > 0:
+        rng = np.random.RandomState(random_state)
+        X[rng.rand(*X.shape) < missing_rate] = np.nan
+    return X, y
+
+
+def skip_larger_than(n_samples, max_samples):
+    """Skip (the asv way) the quadratic benchmarks on too large data."""
+    if n_samples > max_samples:
+        raise NotImplementedError("skipped: {} samples > {}"
+                                  .format(n_samples, max_samples))
@@ -7,6 +7,7 @@
 # FreeBSD License
 ######################################################################
 
+import os
 import argparse
 import pandas as pd
 
@@ -34,14 +35,23 @@ def main():
     parser.add_argument('--signature', dest='signature',
                         default=None, help='Generate a data matrix comprising '
                         'only the genes in the signature.')
+    parser.add_argument('--cache_dir', dest='cache_dir', default=os.curdir,
+                        help='The folder of the binary GEO cache, where '
+                        'parsed datasets are stored by accession number.')
+    parser.add_argument('--soft_file', dest='soft_file', default=None,
+                        help='Parse a SOFT file already on disk instead of '
+                        'downloading it (offline mode).')
+    parser.add_argument('--format', dest='format', default='csv',
+                        choices=('csv', 'parquet'), help='The format of the '
+                        'data matrix file (parquet requires pyarrow).')
     args = parser.parse_args()
 
     # Get the data
     try:
-        if args.gs or (args.signature is not None):
-            data, gse = GEO2csv.get_GEO(args.accession_number, args.pheno_name, True)
-        else:
-            data = GEO2csv.get_GEO(args.accession_number, args.pheno_name)[0]
+        data = GEO2csv.get_GEO(args.accession_number, args.pheno_name,
+                               cache_dir=args.cache_dir,
+                               filepath=args.soft_file)[0]
+        platform = data.platform
         print('* GEO dataset {} loaded'.format(args.accession_number))
 
         # Filter samples per phenotype
@@ -52,7 +62,8 @@ def main():
             print('* Phenotypes {}'.format(args.pheno))
 
         if args.gs or (args.signature is not None):
-            data = GEO2csv.id2gs(data, gse)
+            data.platform = platform
+            data = GEO2csv.id2gs(data)
             print('* Probe ID converted to gene symbols')
 
         if args.signature is not None:
@@ -60,10 +71,16 @@ def main():
             print('* Dataset restricted to {}'.format(data.feature_names))
 
         # Save dataset
-        pd.DataFrame(data=data.data, columns=data.feature_names,
-                     index=data.index).to_csv('{}_data.csv'.format(args.accession_number))
-        print('* {}_data.csv created: {} samples x {} features'.format(args.accession_number,
-                                                                     *data.data.shape))
+        df = pd.DataFrame(data=data.data, columns=data.feature_names,
+                          index=data.index)
+        data_file = '{}_data.{}'.format(args.accession_number, args.format)
+        if args.format == 'parquet':
+            df.columns = df.columns.astype(str)
+            df.to_parquet(data_file)
+        else:
+            df.to_csv(data_file)
+        print('* {} created: {} samples x {} features'.format(data_file,
+                                                             *data.data.shape))
         pd.DataFrame(data=data.target, columns=['Phenotype'],
                      index=data.index).to_csv('{}_labels.csv'.format(args.accession_number))
         print('* {}_labels.csv created: {} samples'.format(args.accession_number,
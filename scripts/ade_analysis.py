@@ -14,15 +14,9 @@ import os
 import time
 import logging
 import argparse
-import gzip
-import numpy as np
-try:
-    import cPickle as pkl
-except:
-    import pickle as pkl
-
-from adenine.core import analyze_results
+
 from adenine.utils import extra
+from adenine.utils import profiling
 
 
 def init_main():
@@ -33,12 +27,17 @@ def init_main():
     parser.add_argument('--version', action='version',
                         version='%(prog)s v' + __version__)
     parser.add_argument("result_folder", help="specify results directory")
+    parser.add_argument("--from-config", dest="from_config",
+                        action="store_true", default=False,
+                        help="read the settings and the data by executing "
+                             "the ade_config.py file in the results "
+                             "directory (instead of __metadata.json)")
     args = parser.parse_args()
 
     root_folder = args.result_folder
     filename = [f for f in os.listdir(root_folder)
                 if os.path.isfile(os.path.join(root_folder, f)) and
-                '.pkl' in f  and f != "__data.pkl"]
+                '.pkl' in f and not f.startswith('__data.pkl')]
     if not filename:
         sys.stderr.write("No .pkl file found in {}. Aborting...\n"
                          .format(root_folder))
@@ -46,45 +45,28 @@ def init_main():
 
     # Run analysis
     # print("Starting the analysis of {}".format(filename))
-    main(os.path.join(os.path.abspath(root_folder), filename[0]))
+    main(os.path.join(os.path.abspath(root_folder), filename[0]),
+         from_config=args.from_config)
 
 
-def main(dumpfile):
-    """Analyze the pipelines."""
-    # Load the configuration file
-    config_path = os.path.dirname(dumpfile)
-    config_path = os.path.join(os.path.abspath(config_path), 'ade_config.py')
-    config = imp.load_source('ade_config', config_path)
-    extra.set_module_defaults(config, {'file_format': 'pdf',
-                                       'plotting_context': 'paper',
-                                       'verbose': False})
-    if hasattr(config, 'use_compression'):
-        use_compression = config.use_compression
-    else:
-        use_compression = False
+def _load_from_config(config, dumpfile):
+    """Labels, index and feature names of results without metadata."""
+    import numpy as np
+    from adenine.utils import dump
+
+    # the data file has the same suffix of the results file (e.g. .pkl.zstd);
+    # the compression codec is detected from the files
+    suffix = os.path.basename(dumpfile).split('.pkl', 1)[1]
+    data_filename = '__data.pkl' + suffix
 
     # Load the results used with ade_run.py
     try:
-        if use_compression:
-            with gzip.open(os.path.join(os.path.dirname(dumpfile),
-                                        '__data.pkl.tz'), 'r') as fdata:
-                data_X_y_index = pkl.load(fdata)
-                data = data_X_y_index['X']
-                labels = data_X_y_index['y']
-                index = data_X_y_index['index']
-        else:
-            with open(os.path.join(os.path.dirname(dumpfile),
-                                   '__data.pkl'), 'r') as fdata:
-                data_X_y_index = pkl.load(fdata)
-                data = data_X_y_index['X']
-                labels = data_X_y_index['y']
-                index = data_X_y_index['index']
+        data_X_y_index = dump.load_results(
+            os.path.join(os.path.dirname(dumpfile), data_filename))
+        data = data_X_y_index['X']
+        labels = data_X_y_index['y']
+        index = data_X_y_index['index']
     except IOError:
-        if use_compression:
-            data_filename = '__data.pkl.tz'
-        else:
-            data_filename = '__data.pkl'
-
         sys.stderr.write("Cannot load {} Reloading data from "
                          "config file ...".format(data_filename))
         data = config.X
@@ -95,9 +77,48 @@ def main(dumpfile):
     # Read the feature names from the config file
     feat_names = config.feat_names if hasattr(config, 'feat_names') \
         else np.arange(data.shape[1])
+    return labels, index, feat_names
+
+
+def main(dumpfile, from_config=False):
+    """Analyze the pipelines.
+
+    The settings, labels, index and feature names are read from the
+    metadata file written by ade_run; the ade_config file is executed only
+    if it is missing (results of older versions) or if from_config is True.
+    """
+    # the plotting stack is imported only when the analysis starts
+    from adenine.core import analyze_results
+    from adenine.utils import dump
+
+    root = os.path.dirname(dumpfile)
+    metadata_file = os.path.join(root, dump.METADATA_FILE)
+    if not from_config and os.path.exists(metadata_file):
+        # the settings, feature names, index and labels saved by ade_run
+        metadata = dump.load_metadata(metadata_file)
+        config = argparse.Namespace(**metadata['settings'])
+        labels = metadata['y']
+        index = metadata['index']
+        feat_names = metadata['feat_names']
+    else:
+        # fallback (results of older versions or --from-config): execute the
+        # ade_config file, which may load the whole dataset again
+        config_path = os.path.join(os.path.abspath(root), 'ade_config.py')
+        sys.stderr.write("Executing {} to read the settings and the data "
+                         "...\n".format(config_path))
+        config = imp.load_source('ade_config', config_path)
+        labels, index, feat_names = _load_from_config(config, dumpfile)
+
+    extra.set_module_defaults(config, {'file_format': 'pdf',
+                                       'plotting_context': 'paper',
+                                       'profile': None,
+                                       'verbose': False})
+    profiling.set_profile_options(
+        config.profile, os.path.join(root, 'profiles'))
+
     # Initialize the log file
-    filename = 'results_' + os.path.basename(dumpfile)[0:-7]
-    logfile = os.path.join(os.path.dirname(dumpfile), filename + '.log')
+    filename = 'results_' + os.path.basename(dumpfile).split('.pkl', 1)[0]
+    logfile = os.path.join(root, filename + '.log')
     logging.basicConfig(filename=logfile, level=logging.INFO, filemode='w',
                         format='%(levelname)s (%(name)s): %(message)s')
     root_logger = logging.getLogger()
@@ -110,17 +131,12 @@ def main(dumpfile):
     tic = time.time()
     print("\nUnpickling output ...", end=' ')
     # Load the results
-    if use_compression:
-        with gzip.open(dumpfile, 'r') as fres:
-            res = pkl.load(fres)
-    else:
-        with open(dumpfile, 'r') as fres:
-            res = pkl.load(fres)
+    res = dump.load_results(dumpfile)
 
     print("done: {} s".format(extra.sec_to_time(time.time() - tic)))
 
     # Analyze the pipelines
-    analyze_results.analyze(input_dict=res, root=os.path.dirname(dumpfile),
+    analyze_results.analyze(input_dict=res, root=root,
                             y=labels, feat_names=feat_names, index=index,
                             plotting_context=config.plotting_context,
                             file_format=config.file_format)
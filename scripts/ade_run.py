@@ -11,8 +11,6 @@ import os
 import shutil
 import argparse
 
-from adenine import main
-
 
 def init_main():
     """Initialize main for ade_run.py."""
@@ -23,6 +21,15 @@ def init_main():
                         version='%(prog)s v' + __version__)
     parser.add_argument("-c", "--create", dest="create", action="store_true",
                         help="create config file", default=False)
+    parser.add_argument("--plan", dest="plan", action="store_true",
+                        help="print the estimated time and memory of the "
+                             "pipelines without running them", default=False)
+    parser.add_argument("--calibrate", dest="calibrate", type=int,
+                        metavar="N_SAMPLES", default=None,
+                        help="with --plan, calibrate the estimates by timing "
+                             "the steps on a subsample of N_SAMPLES samples")
+    parser.add_argument("--plan-file", dest="plan_file", default=None,
+                        help="with --plan, write the plan to this csv file")
     parser.add_argument("configuration_file", help="specify config file",
                         default='ade_config.py')
     args = parser.parse_args()
@@ -38,7 +45,11 @@ def init_main():
             parser.error("adenine configuration file already exists")
         # Copy the config file
         shutil.copy(std_config_path, args.configuration_file)
+    elif args.plan:
+        from adenine.core import planner
+        planner.main(args.configuration_file, args.calibrate, args.plan_file)
     else:
+        from adenine import main
         main(args.configuration_file)
 
 